@@ -0,0 +1,226 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Tuple
+import math
+import time
+import numpy as np
+from scipy.special import logsumexp
+
+# One hyperparam of a search space. Lists are categorical, loguniform/uniform distributions
+# are modelled in log/linear space, any other scipy distribution is only sampled from.
+class _Dimension:
+  def __init__(self, name: str, space: Any):
+    self.name = name
+    self.kind = "prior"
+    self.choices: List[Any] = []
+    self.low = self.high = 0.0
+
+    if isinstance(space, (list, tuple)):
+      self.kind = "categorical"
+      self.choices = list(space)
+    elif hasattr(space, "dist") and space.dist.name in ("loguniform", "reciprocal"):
+      self.kind = "log"
+      low, high = space.support()
+      self.low, self.high = math.log(low), math.log(high)
+    elif hasattr(space, "dist") and space.dist.name == "uniform":
+      self.kind = "linear"
+      self.low, self.high = space.support()
+
+    self.space = space
+
+  def to_internal(self, value: Any) -> float:
+    if self.kind == "categorical":
+      return float(next(idx for idx, choice in enumerate(self.choices) if choice == value))
+    if self.kind == "log":
+      return math.log(value)
+    return float(value)
+
+  def from_internal(self, value: float) -> Any:
+    if self.kind == "categorical":
+      return self.choices[int(value)]
+    if self.kind == "log":
+      return float(math.exp(value))
+    return float(value)
+
+  def sample_prior(self, rng: np.random.Generator) -> Any:
+    if self.kind == "categorical":
+      return self.choices[rng.integers(len(self.choices))]
+    if self.kind in ("log", "linear"):
+      return self.from_internal(rng.uniform(self.low, self.high))
+    return self.space.rvs(random_state=rng)
+
+# Parzen estimator of one dimension over a group of observed internal values
+class _ParzenEstimator:
+  def __init__(self, dimension: _Dimension, observations: np.ndarray, min_bandwidth_fraction: float = 0.05):
+    self.dimension = dimension
+    self.observations = observations
+
+    if dimension.kind == "categorical":
+      counts = np.bincount(observations.astype(int), minlength=len(dimension.choices))
+      # +1 smoothing keeps every choice reachable
+      self.probabilities = (counts + 1.0) / (counts.sum() + len(dimension.choices))
+    elif dimension.kind in ("log", "linear"):
+      width = dimension.high - dimension.low
+      std = float(np.std(observations)) if len(observations) > 1 else width
+      # Scott's rule, bounded so the estimator neither collapses on a point nor goes flat
+      self.bandwidth = float(np.clip(1.06 * std * len(observations) ** -0.2, min_bandwidth_fraction * width, width))
+
+  def sample(self, rng: np.random.Generator) -> float:
+    dimension = self.dimension
+    if dimension.kind == "categorical":
+      return float(rng.choice(len(dimension.choices), p=self.probabilities))
+
+    # mixture of the observations' kernels and the uniform prior
+    component = rng.integers(len(self.observations) + 1)
+    if component == len(self.observations):
+      return float(rng.uniform(dimension.low, dimension.high))
+    return float(np.clip(rng.normal(self.observations[component], self.bandwidth), dimension.low, dimension.high))
+
+  def log_pdf(self, value: float) -> float:
+    dimension = self.dimension
+    if dimension.kind == "categorical":
+      return float(np.log(self.probabilities[int(value)]))
+
+    # gaussian kernels' log densities, same as scipy.stats.norm.logpdf without importing scipy.stats
+    kernels = -0.5 * ((value - self.observations) / self.bandwidth) ** 2 - math.log(self.bandwidth) - 0.5 * math.log(2 * math.pi)
+    prior = -math.log(dimension.high - dimension.low)
+    return float(logsumexp(np.append(kernels, prior)) - math.log(len(self.observations) + 1))
+
+# Tree-structured Parzen estimator over sklearn style param distributions (dict of lists / scipy distributions).
+# After n_startup random candidates, observed trials are split into the top gamma fraction
+# ("good", at most max_good trials) and the rest, and each new candidate is the one of n_ei_candidates draws from the good densities
+# with the highest good/bad density ratio (dimensions modelled independently).
+# Trials are (params, score) pairs, pruned trials have score None: their partial fold means aren't
+# comparable to full CV scores, so they're never good and only inform the bad densities.
+class TPESampler:
+  def __init__(self,
+    param_distributions: Dict[str, Any],
+    random_state: int | None = None,
+    n_startup: int = 10,
+    n_ei_candidates: int = 24,
+    gamma: float = 0.1,
+    max_good: int = 25):
+    self.dimensions = [_Dimension(name, space) for name, space in param_distributions.items()]
+    self.rng = np.random.default_rng(random_state)
+    self.n_startup = n_startup
+    self.n_ei_candidates = n_ei_candidates
+    self.gamma = gamma
+    self.max_good = max_good
+
+  def suggest(self, trials: List[Tuple[Dict[str, Any], float | None]]) -> Dict[str, Any]:
+    seen = {_params_signature(params) for params, _ in trials}
+    completed = sorted([trial for trial in trials if trial[1] is not None], key=lambda trial: trial[1], reverse=True)
+
+    if len(trials) < self.n_startup or not completed:
+      return self._sample_unseen(seen, lambda: {dim.name: dim.sample_prior(self.rng) for dim in self.dimensions})
+
+    ordered = completed + [trial for trial in trials if trial[1] is None]
+    n_good = min(max(1, int(math.ceil(self.gamma * len(ordered)))), self.max_good, len(completed))
+    modelled = [dim for dim in self.dimensions if dim.kind != "prior"]
+    good = {dim.name: _ParzenEstimator(dim, np.array([dim.to_internal(params[dim.name]) for params, _ in ordered[:n_good]])) for dim in modelled}
+    bad = {dim.name: _ParzenEstimator(dim, np.array([dim.to_internal(params[dim.name]) for params, _ in ordered[n_good:]])) for dim in modelled}
+
+    best_params, best_ratio = None, -np.inf
+    for _ in range(self.n_ei_candidates):
+      internal = {name: estimator.sample(self.rng) for name, estimator in good.items()}
+      params = {dim.name: dim.from_internal(internal[dim.name]) if dim.kind != "prior" else dim.sample_prior(self.rng) for dim in self.dimensions}
+      if _params_signature(params) in seen:
+        continue
+
+      ratio = sum(good[name].log_pdf(value) - bad[name].log_pdf(value) for name, value in internal.items())
+      if ratio > best_ratio:
+        best_params, best_ratio = params, ratio
+
+    if best_params is None:
+      return self._sample_unseen(seen, lambda: {dim.name: dim.sample_prior(self.rng) for dim in self.dimensions})
+
+    return best_params
+
+  def _sample_unseen(self, seen: set, sample: Callable[[], Dict[str, Any]], attempts: int = 100) -> Dict[str, Any]:
+    params = sample()
+    for _ in range(attempts):
+      if _params_signature(params) not in seen:
+        break
+      params = sample()
+    return params
+
+def _params_signature(params: Dict[str, Any]) -> Tuple:
+  return tuple(sorted((name, repr(value)) for name, value in params.items()))
+
+@dataclass
+class BayesianSearchTrial:
+  params: Dict[str, Any]
+  fold_scores: List[float]
+  pruned: bool
+
+  @property
+  def score(self) -> float:
+    return float(np.mean(self.fold_scores))
+
+@dataclass
+class BayesianSearchOutcome:
+  best_params: Dict[str, Any]
+  best_score: float
+  trials: List[BayesianSearchTrial] = field(default_factory=list)
+
+  @property
+  def n_fits(self) -> int:
+    return sum(len(trial.fold_scores) for trial in self.trials)
+
+# Upper confidence bound of the final n_splits-fold mean score difference to the incumbent,
+# given the paired differences on the first folds. Var(final - observed mean) = sigma^2 * (n - j) / (n * j).
+def fold_difference_ucb(differences: np.ndarray, n_splits: int, z: float, min_std: float) -> float:
+  n_folds = len(differences)
+  std = max(float(np.std(differences, ddof=1)) if n_folds > 1 else 0.0, min_std)
+  return float(np.mean(differences) + z * std * math.sqrt((n_splits - n_folds) / (n_splits * n_folds)))
+
+# Adaptive search: TPE proposes candidates, each candidate's folds are scored one at a time
+# and the candidate is abandoned after min_folds folds once the upper confidence bound of its
+# mean score can't beat the incumbent on the same folds (successive halving over folds, per candidate).
+# score_fold(params, fold) -> score, with the same CV splits for every candidate.
+def run_bayesian_search(score_fold: Callable[[Dict[str, Any], int], float],
+  param_distributions: Dict[str, Any],
+  n_candidates: int,
+  n_splits: int = 5,
+  random_state: int | None = None,
+  n_startup: int = 10,
+  min_folds: int = 2,
+  ucb_z: float = 2.0,
+  min_fold_std: float = 0.005) -> BayesianSearchOutcome:
+  if n_candidates < 1:
+    raise ValueError(f"n_candidates must be at least 1, got {n_candidates}")
+
+  sampler = TPESampler(param_distributions, random_state=random_state, n_startup=min(n_startup, n_candidates))
+  outcome = BayesianSearchOutcome(best_params={}, best_score=-np.inf)
+  incumbent_folds: np.ndarray | None = None
+
+  for candidate in range(n_candidates):
+    params = sampler.suggest([(trial.params, None if trial.pruned else trial.score) for trial in outcome.trials])
+    fold_scores: List[float] = []
+    pruned = False
+    start = time.perf_counter()
+
+    for fold in range(n_splits):
+      fold_scores.append(float(score_fold(params, fold)))
+
+      n_folds = len(fold_scores)
+      if incumbent_folds is not None and min_folds <= n_folds < n_splits:
+        differences = np.array(fold_scores) - incumbent_folds[:n_folds]
+        if fold_difference_ucb(differences, n_splits, ucb_z, min_fold_std) < 0:
+          pruned = True
+          break
+
+    trial = BayesianSearchTrial(params=params, fold_scores=fold_scores, pruned=pruned)
+    outcome.trials.append(trial)
+
+    if not pruned and trial.score > outcome.best_score:
+      outcome.best_params, outcome.best_score = params, trial.score
+      incumbent_folds = np.array(fold_scores)
+
+    status = f"pruned after {len(fold_scores)} folds" if pruned else f"{n_splits} folds"
+    print(f"Candidate {candidate + 1}/{n_candidates}: ndcg={trial.score:.4f} ({status}, {time.perf_counter() - start:.1f}s), "
+      f"best={outcome.best_score:.4f}")
+
+  print(f"Bayesian search: {outcome.n_fits} fold fits instead of {n_candidates * n_splits}, "
+    f"{sum(trial.pruned for trial in outcome.trials)}/{n_candidates} candidates stopped early")
+
+  return outcome
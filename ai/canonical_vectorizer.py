@@ -0,0 +1,152 @@
+from itertools import product
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import onnx
+from onnx import helper
+from skl2onnx.sklapi import TraceableTfidfVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from synonym_index import SynonymIndex
+
+# TraceableTfidfVectorizer that replaces every synonym token by its canonical token
+# (e.g. "center" -> "middle", see SynonymIndex.canonical_tokens) before n-grams are counted.
+# Training rows then only need the canonical phrases instead of the synonym cartesian product,
+# and queries get the same mapping: in sklearn through build_tokenizer, in ONNX through
+# add_synonyms_to_onnx_tfidf, which points the synonym n-grams at the canonical n-gram columns.
+class CanonicalTfidfVectorizer(TraceableTfidfVectorizer):
+  _parameter_constraints: dict = {**TraceableTfidfVectorizer._parameter_constraints, "synonyms": [dict, None]}
+
+  def __init__(self,
+    *,
+    synonyms: Dict[str, List[str]] | None = None,
+    input="content",
+    encoding="utf-8",
+    decode_error="strict",
+    strip_accents=None,
+    lowercase=True,
+    preprocessor=None,
+    tokenizer=None,
+    analyzer="word",
+    stop_words=None,
+    token_pattern=r"(?u)\b\w\w+\b",
+    ngram_range=(1, 1),
+    max_df=1.0,
+    min_df=1,
+    max_features=None,
+    vocabulary=None,
+    binary=False,
+    dtype=np.float64,
+    norm="l2",
+    use_idf=True,
+    smooth_idf=True,
+    sublinear_tf=False):
+    super().__init__(input=input,
+      encoding=encoding,
+      decode_error=decode_error,
+      strip_accents=strip_accents,
+      lowercase=lowercase,
+      preprocessor=preprocessor,
+      tokenizer=tokenizer,
+      analyzer=analyzer,
+      stop_words=stop_words,
+      token_pattern=token_pattern,
+      ngram_range=ngram_range,
+      max_df=max_df,
+      min_df=min_df,
+      max_features=max_features,
+      vocabulary=vocabulary,
+      binary=binary,
+      dtype=dtype,
+      norm=norm,
+      use_idf=use_idf,
+      smooth_idf=smooth_idf,
+      sublinear_tf=sublinear_tf)
+    self.synonyms = synonyms
+
+  # synonym token -> canonical token, lowercased along with the documents
+  def get_canonical_tokens(self) -> Dict[str, str]:
+    canonical = SynonymIndex(self.synonyms or {}).canonical_tokens()
+    if self.lowercase:
+      canonical = {synonym.lower(): word.lower() for synonym, word in canonical.items()}
+    return canonical
+
+  def build_tokenizer(self):
+    tokenize = super().build_tokenizer()
+    canonical = self.get_canonical_tokens()
+    if not canonical:
+      return tokenize
+
+    return lambda doc: [canonical.get(token, token) for token in tokenize(doc)]
+
+  def fit(self, X, y=None):
+    # TraceableTfidfVectorizer.fit refits a plain TfidfVectorizer(**self.get_params()) to align ngram columns,
+    # which can't take the synonyms param. Token patterns used here never match spaces, so joined ngrams
+    # are unambiguous and there is nothing to align.
+    TfidfVectorizer.fit(self, X, y=y)
+    return self
+
+  # Vocabulary n-grams of the fitted vectorizer together with their synonym spellings, e.g.
+  # ("white", "middle") -> [("white", "center")], for n-grams that have any
+  def get_synonym_ngrams(self) -> Dict[Tuple[str, ...], List[Tuple[str, ...]]]:
+    variants: Dict[str, List[str]] = {}
+    for synonym, word in self.get_canonical_tokens().items():
+      variants.setdefault(word, [word]).append(synonym)
+
+    synonym_ngrams: Dict[Tuple[str, ...], List[Tuple[str, ...]]] = {}
+    for ngram in self.vocabulary_:
+      ngram = ngram if isinstance(ngram, tuple) else tuple(ngram.split(" "))
+      if any(token in variants for token in ngram):
+        synonym_ngrams[ngram] = list(product(*[variants.get(token, [token]) for token in ngram]))[1:]
+
+    return synonym_ngrams
+
+# Add the synonym spellings of every vocabulary n-gram to the TfIdfVectorizer node of an exported
+# CanonicalTfidfVectorizer, mapped to the output column of the canonical n-gram, so the ONNX model
+# counts "center" as "middle" just like the sklearn tokenizer does. Pool entries keep the
+# (n-gram length, offset) layout TfIdfVectorizer expects, see onnx_optimizer._prune_tfidf_vocabulary.
+def add_synonyms_to_onnx_tfidf(model: onnx.ModelProto, vectorizer: CanonicalTfidfVectorizer):
+  nodes = [node for node in model.graph.node if node.op_type == "TfIdfVectorizer"]
+  if len(nodes) != 1:
+    raise ValueError(f"Expected exactly one TfIdfVectorizer node, found {len(nodes)}")
+  node = nodes[0]
+
+  attrs = {attr.name: helper.get_attribute_value(attr) for attr in node.attribute}
+  pool = [token.decode("utf-8") for token in attrs["pool_strings"]]
+  ngram_counts = list(attrs["ngram_counts"])
+  ngram_indexes = list(attrs["ngram_indexes"])
+  pool_weights = list(attrs.get("weights", []))
+
+  entries: List[Tuple[Tuple[str, ...], int, float]] = []
+  for gram_length, start in enumerate(ngram_counts, start=1):
+    end = ngram_counts[gram_length] if gram_length < len(ngram_counts) else len(pool)
+    for offset in range(start, end, gram_length):
+      position = len(entries)
+      entries.append((tuple(pool[offset:offset + gram_length]), ngram_indexes[position], pool_weights[position] if pool_weights else 1.0))
+
+  synonym_ngrams = vectorizer.get_synonym_ngrams()
+  entries.extend(
+    (synonym_ngram, index, weight)
+    for ngram, index, weight in list(entries)
+    for synonym_ngram in synonym_ngrams.get(ngram, []))
+  # stable sort keeps canonical n-grams ahead of their synonyms within a length
+  entries.sort(key=lambda entry: len(entry[0]))
+
+  new_pool: List[str] = []
+  new_counts: List[int] = []
+  for ngram, _, _ in entries:
+    while len(new_counts) < len(ngram):
+      new_counts.append(len(new_pool))
+    new_pool.extend(ngram)
+
+  replaced: Dict[str, Any] = {
+    "pool_strings": new_pool,
+    "ngram_counts": new_counts,
+    "ngram_indexes": [index for _, index, _ in entries],
+  }
+  if pool_weights:
+    replaced["weights"] = [float(weight) for _, _, weight in entries]
+
+  kept_attrs = [attr for attr in node.attribute if attr.name not in replaced]
+  del node.attribute[:]
+  node.attribute.extend(kept_attrs)
+  node.attribute.extend(helper.make_attribute(name, value) for name, value in replaced.items())
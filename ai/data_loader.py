@@ -1,9 +1,12 @@
 from dataclasses import dataclass
-from itertools import product
+from typing import IO, Iterable, Iterator
 import pandas as pd
 from pathlib import Path
 import json;
 
+from instrumentation import span
+from synonym_index import SynonymIndex, load_synonyms
+
 @dataclass
 class RawTrainingDataRow:
   key: str
@@ -11,27 +14,31 @@ class RawTrainingDataRow:
   weight: float
   description: dict[str, str]
 
-synonyms_lkp = {
-  "middle": ["center"],
-  "line": ["strip", "banner", "stripe"],
-  "lines": ["strips", "banners", "stripes"],
-  "solid": ["all"],
-  "plate": ["background"]
-}
+# word -> synonyms used to expand descriptions, e.g. "middle" -> ["center"]
+SYNONYMS_PATH = Path(__file__).parent / "training_data" / "synonyms.json"
+synonyms_lkp = load_synonyms(SYNONYMS_PATH)
+
+TRAINING_ROW_COLUMNS = ["label", "text"]
+WEIGHTED_TRAINING_ROW_COLUMNS = [*TRAINING_ROW_COLUMNS, "weight"]
+EXCLUDED_KEYS = {"sample"}
 
 # Read training data json and transform it into de-normalized training rows.
 # Note: we are loading entire data set into memory because it is small enough and makes rest of the code simpler.
-# For larger data sets, we'll need to refactor solution to work with streams, and de-normalize once into a temp file.
+# For larger data sets use iter_raw_data/load_training_rows (streaming).
 def read_raw_data(training_data_path: str) -> list[RawTrainingDataRow]:
   
   print(f"Reading raw json data from {training_data_path}...")
 
   training_data_json = Path(training_data_path)
 
-  with training_data_json.open("r", encoding="utf-8") as file:
-    raw_json_data = json.load(file)
+  with span("load") as load_span:
+    with training_data_json.open("r", encoding="utf-8") as file:
+      raw_json_data = json.load(file)
 
-  return [RawTrainingDataRow(**item) for item in raw_json_data]
+    raw_rows = [RawTrainingDataRow(**item) for item in raw_json_data]
+    load_span.count(rows=len(raw_rows))
+
+  return raw_rows
 
 # Generate training rows by de-normalizing source json data
 # and expanding vocabulary with synonyms and plate description keys
@@ -53,43 +60,213 @@ def transform_to_training_rows(training_data: list[RawTrainingDataRow]) -> pd.Da
   print("Transforming to training rows...")
   
   training_row_df = pd.DataFrame(training_data)
-  training_row_df = training_row_df[training_row_df["key"] != "sample"]
+  training_row_df = training_row_df[~training_row_df["key"].isin(EXCLUDED_KEYS)]
+  synonym_index = SynonymIndex(synonyms_lkp)
 
   training_rows = (
     training_row_df
       .rename(columns={"key": "label"})
       .assign(
-        text = lambda frame: frame["description"].apply(create_training_text)
+        text = lambda frame: frame["description"].apply(lambda description: list(iter_training_text(description, synonym_index=synonym_index)))
       )
-      .explode("text", ignore_index=True)[["label", "text"]]
+      .explode("text", ignore_index=True)[TRAINING_ROW_COLUMNS]
   )
 
   return training_rows
 
+# Weighted counterpart of transform_to_training_rows.
+# Every expanded row carries the weight of its source RawTrainingDataRow, so important plates
+# can be boosted in the json instead of by duplicating their descriptions.
+# When dedup is set, identical (label, text) pairs are collapsed into a single row whose weight
+# is the sum of the collapsed copies. Fitting with weight as sample_weight is equivalent to fitting
+# on the repeated rows, but vectorizer and classifier only have to process each distinct row once.
+# max_phrase_variants caps synonym combinations generated per phrase (None - no cap).
+# canonicalize_synonyms replaces synonyms by canonical tokens instead of expanding them (see iter_training_text).
+def transform_to_weighted_training_rows(training_data: Iterable[RawTrainingDataRow],
+  max_phrase_variants: int | None = None,
+  dedup: bool = True,
+  canonicalize_synonyms: bool = False) -> pd.DataFrame:
+  print("Transforming to weighted training rows...")
+
+  with span("expansion") as expansion_span:
+    weighted_rows = iter_weighted_training_rows(training_data, max_phrase_variants, canonicalize_synonyms)
+
+    if not dedup:
+      training_rows = pd.DataFrame.from_records(weighted_rows, columns=WEIGHTED_TRAINING_ROW_COLUMNS)
+    else:
+      row_weights: dict[tuple[str, str], float] = {}
+      for label, text, weight in weighted_rows:
+        row_weights[(label, text)] = row_weights.get((label, text), 0.0) + weight
+
+      training_rows = pd.DataFrame(
+        [(label, text, weight) for (label, text), weight in row_weights.items()],
+        columns=WEIGHTED_TRAINING_ROW_COLUMNS)
+
+    expansion_span.count(rows=len(training_rows))
+
+  return training_rows
+
 # Generate training row text by expanding original training data with synonyms
 # and description keys.
-def create_training_text(plate_descriptions: dict[str, str]) -> list[str]:
-  rows: list[str] = []
+def create_training_text(plate_descriptions: dict[str, str],
+  max_phrase_variants: int | None = None,
+  canonicalize_synonyms: bool = False) -> list[str]:
+  return list(iter_training_text(plate_descriptions, max_phrase_variants, canonicalize_synonyms=canonicalize_synonyms))
+
+# Generator version of create_training_text. Yields expanded rows one at a time
+# so callers don't have to hold the synonym cartesian product in memory.
+# Phrases are expanded through the synonym index (default: a new one compiled from synonyms_lkp,
+# loops over many descriptions pass one index so its expansion caches are shared between them).
+# With canonicalize_synonyms every phrase and key is replaced by its canonical form instead of being
+# expanded, for models whose vectorizer canonicalizes queries too (see canonical_vectorizer.py).
+def iter_training_text(plate_descriptions: dict[str, str],
+  max_phrase_variants: int | None = None,
+  synonym_index: SynonymIndex | None = None,
+  canonicalize_synonyms: bool = False) -> Iterator[str]:
+  if synonym_index is None:
+    synonym_index = SynonymIndex(synonyms_lkp)
 
   for desc_key, desc_val in plate_descriptions.items():
     if not isinstance(desc_val, str):
       continue
 
-    desk_key_variants = [desc_key, *synonyms_lkp.get(desc_key, [])]
+    if canonicalize_synonyms:
+      desk_key_variants = [synonym_index.canonicalize_phrase(desc_key)]
+    else:
+      desk_key_variants = synonym_index.expand_key(desc_key)
 
     for raw_phrase in (p.strip() for p in desc_val.split(",") if p.strip()):
-      phrase_variants_parts: list[list[str]] = []
-      
-      for word in raw_phrase.split(" "):
-        word_synonyms = [word, *synonyms_lkp.get(word, [])]
-        phrase_variants_parts.append(word_synonyms)
-      
-      for parts in product(*phrase_variants_parts):
-        phrase = " ".join(parts)
-        rows.append(phrase)
+      if canonicalize_synonyms:
+        phrase_variants = [synonym_index.canonicalize_phrase(raw_phrase)]
+      else:
+        # max_phrase_variants guards against combinatorial blow-up for phrases with many synonym-able words
+        phrase_variants = synonym_index.expand_phrase(raw_phrase, max_phrase_variants)
+
+      for phrase in phrase_variants:
+        yield phrase
 
         for desk_key_variant in desk_key_variants:
-          rows.append(f"{desk_key_variant} {phrase}")
-          rows.append(f"{phrase} {desk_key_variant}")
+          yield f"{desk_key_variant} {phrase}"
+          yield f"{phrase} {desk_key_variant}"
+
+# Streaming counterpart of read_raw_data.
+# Parses top-level json array incrementally and yields one raw row at a time,
+# so the whole file never has to be decoded into memory at once.
+def iter_raw_data(training_data_path: str, chunk_size: int = 64 * 1024) -> Iterator[RawTrainingDataRow]:
+  print(f"Streaming raw json data from {training_data_path}...")
+
+  training_data_json = Path(training_data_path)
+
+  with training_data_json.open("r", encoding="utf-8") as file:
+    for item in _iter_json_array_items(file, chunk_size):
+      yield RawTrainingDataRow(**item)
+
+# Streaming counterpart of transform_to_weighted_training_rows(dedup=False). Yields (label, text, weight)
+# tuples, where weight comes from the source RawTrainingDataRow. Each (key, version) pair is expanded
+# separately, so several versions of the same plate contribute their own descriptions and weights to the same label.
+# Rows with non-positive weight are skipped, and a (key, version) pair listed twice is rejected
+# because it would silently double that plate's weight.
+# The synonym index is per call and is dropped with the generator, so a streamed load doesn't leave
+# the expansions and words of the whole data set behind.
+def iter_weighted_training_rows(training_data: Iterable[RawTrainingDataRow],
+  max_phrase_variants: int | None = None,
+  canonicalize_synonyms: bool = False) -> Iterator[tuple[str, str, float]]:
+  synonym_index = SynonymIndex(synonyms_lkp)
+  for raw_row in iter_trainable_raw_rows(training_data):
+    weight = float(raw_row.weight)
+    for text in iter_training_text(raw_row.description, max_phrase_variants, synonym_index, canonicalize_synonyms):
+      yield (raw_row.key, text, weight)
+
+# Raw rows that contribute to training: excluded keys and rows with non-positive weight are skipped,
+# a (key, version) pair listed twice is rejected.
+def iter_trainable_raw_rows(training_data: Iterable[RawTrainingDataRow]) -> Iterator[RawTrainingDataRow]:
+  seen_versions: set[tuple[str, str]] = set()
+
+  for raw_row in training_data:
+    if raw_row.key in EXCLUDED_KEYS:
+      continue
+
+    if (raw_row.key, raw_row.version) in seen_versions:
+      raise ValueError(f"Duplicate training data entry for key '{raw_row.key}' version '{raw_row.version}'")
+    seen_versions.add((raw_row.key, raw_row.version))
+
+    if float(raw_row.weight) <= 0:
+      continue
+
+    yield raw_row
+
+# Streaming mode entry point. Produces the same frame as
+# transform_to_weighted_training_rows(read_raw_data(...), dedup=False), but without materializing
+# raw json or intermediate lists: only the expanded rows the model is fitted on are held in memory.
+def load_training_rows(training_data_path: str,
+  max_phrase_variants: int | None = None,
+  canonicalize_synonyms: bool = False) -> pd.DataFrame:
+  # streamed json is parsed while rows are expanded, so loading is part of this span
+  with span("expansion") as expansion_span:
+    training_rows = iter_weighted_training_rows(iter_raw_data(training_data_path), max_phrase_variants, canonicalize_synonyms)
+
+    loaded_rows = pd.DataFrame.from_records(training_rows, columns=WEIGHTED_TRAINING_ROW_COLUMNS)
+    expansion_span.count(rows=len(loaded_rows))
+
+  return loaded_rows
+
+# Incrementally decode items of a top-level json array from a text stream.
+# Items must be separated by exactly one comma, leading, doubled and trailing commas are rejected like json.load does.
+def _iter_json_array_items(file: IO[str], chunk_size: int) -> Iterator[dict]:
+  decoder = json.JSONDecoder()
+  buffer = ""
+  pos = 0
+  eof = False
+  array_started = False
+  # after an item only "," or "]" may follow, after "," only an item
+  after_item = False
+  after_comma = False
+
+  while True:
+    while pos < len(buffer) and buffer[pos].isspace():
+      pos += 1
+
+    if pos >= len(buffer):
+      if eof:
+        raise ValueError("Unexpected end of training data json")
+      buffer = file.read(chunk_size)
+      pos = 0
+      eof = not buffer
+      continue
+
+    if not array_started:
+      if buffer[pos] != "[":
+        raise ValueError("Training data json must be an array")
+      array_started = True
+      pos += 1
+      continue
+
+    if buffer[pos] == "]":
+      if after_comma:
+        raise ValueError("Trailing comma in training data json array")
+      return
+
+    if buffer[pos] == ",":
+      if not after_item:
+        raise ValueError("Unexpected comma in training data json array")
+      after_item, after_comma = False, True
+      pos += 1
+      continue
+
+    if after_item:
+      raise ValueError("Missing comma between training data json array items")
+
+    try:
+      item, end = decoder.raw_decode(buffer, pos)
+    except json.JSONDecodeError:
+      if eof:
+        raise
+      more = file.read(chunk_size)
+      eof = not more
+      buffer = buffer[pos:] + more
+      pos = 0
+      continue
 
-  return rows
\ No newline at end of file
+    yield item
+    pos = end
+    after_item, after_comma = True, False
@@ -1,15 +1,24 @@
 from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence
+import json
+import time
+from joblib import parallel_config
 from sklearn import clone
-from sklearn.calibration import label_binarize
-from sklearn.model_selection import StratifiedKFold, cross_validate
-from sklearn.metrics import accuracy_score, log_loss
-from sklearn.naive_bayes import LabelBinarizer
-from sklearn.metrics import ndcg_score
+from sklearn.model_selection import StratifiedKFold, cross_validate, train_test_split
 from sklearn.pipeline import Pipeline
 import numpy as np
+import pandas as pd
 
-from pipeline_factory import CLF_STEP, VEC_STEP
-from model_utils import make_ndcg_scorer
+from instrumentation import measure_memory_peak, span
+from data_loader import WEIGHTED_TRAINING_ROW_COLUMNS, RawTrainingDataRow, transform_to_weighted_training_rows
+from synonym_index import SynonymIndex
+from pipeline_factory import CLF_STEP, PIPELINE_DTYPES, VEC_STEP, create_dtype_params, create_fit_params, create_lr_pipeline
+from model_utils import compute_proba_metrics, convert_to_onnx, make_fused_scorer
+from numpy_inference import compare_rankings, top_k_indices
+from vectorizer_cache import cached_pipeline_scope
+
+# Metrics of make_fused_scorer that ModelEvaluations is computed from, each with train and test fold scores
+CV_METRICS = ["accuracy", "neg_log_loss", "roc_auc", "ndcg"]
 
 @dataclass
 class ModelEvaluations:
@@ -73,42 +82,53 @@ def compute_model_evaluations(pipeline: Pipeline,
   X_train: list[str],
   y_train: list[str],
   X_test: list[str],
-  y_test: list[str]) -> ModelEvaluations:
+  y_test: list[str],
+  sample_weight_train: Any = None,
+  sample_weight_test: Any = None,
+  use_vectorizer_cache: bool = True,
+  cv_n_jobs: int = 1,
+  cv_blas_threads: int = 1,
+  cv_scores: Dict[str, np.ndarray] | None = None) -> ModelEvaluations:
 
   print("Model evaluations:")
   evals = ModelEvaluations()
 
   ndcg_k = 10
-  ndcg_at_k = make_ndcg_scorer(ndcg_k)
 
   # Compute cross-validations
   # These metrics help tune the model training params (algo, hyperparams, etc)
   # They also help to measure how balanced the training set is (labels + their descriptions)
-  n_splits = 5
-  cv = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
-  cv_scores = cross_validate(
-    clone(pipeline),
-    X_train,
-    y_train,
-    scoring={
-      "accuracy": "accuracy",
-      "log_loss": "neg_log_loss",
-      "roc_auc": "roc_auc_ovr",
-      "ndcg": ndcg_at_k
-    },
-    cv=cv,
-    n_jobs=1,
-    return_train_score=True,
-    error_score="raise",
-    verbose=0
-  )
+  # A search that already cross validated pipeline passes its fold scores (see get_candidate_cv_scores)
+  # Fold scores aren't weighted by sample_weight_train (see make_fused_scorer) while the holdout
+  # metrics below are weighted by sample_weight_test, so with non-uniform weights (--dedup-rows)
+  # CV and holdout scores aren't directly comparable
+  if cv_scores is None:
+    n_splits = 5
+    cv_started = time.perf_counter()
+    cv_scores = cross_validate_model(pipeline,
+      X_train,
+      y_train,
+      random_state,
+      n_splits=n_splits,
+      ndcg_k=ndcg_k,
+      sample_weight_train=sample_weight_train,
+      use_vectorizer_cache=use_vectorizer_cache,
+      n_jobs=cv_n_jobs,
+      blas_threads=cv_blas_threads)
+    print(f"CV({n_splits}) took {time.perf_counter() - cv_started:.2f}s (n_jobs={cv_n_jobs})")
+  else:
+    n_splits = len(cv_scores["test_ndcg"])
+    print(f"CV({n_splits}) scores reused from search")
+
+  if (sample_weight_train is not None and np.ptp(np.asarray(sample_weight_train, dtype=float)) > 0):
+    print("CV scores are unweighted, holdout metrics are weighted by sample weight")
 
   evals.cv_folds = n_splits
   evals.ndcg_k = ndcg_k
   evals.cv_acc_mean = cv_scores["test_accuracy"].mean()
   evals.cv_acc_std  = cv_scores["test_accuracy"].std()
-  evals.cv_ll_mean  = -cv_scores["test_log_loss"].mean()
-  evals.cv_ll_std   = cv_scores["test_log_loss"].std()
+  evals.cv_ll_mean  = -cv_scores["test_neg_log_loss"].mean()
+  evals.cv_ll_std   = cv_scores["test_neg_log_loss"].std()
   evals.cv_roc_auc_train_mean  = cv_scores["train_roc_auc"].mean()
   evals.cv_roc_auc_train_std  = cv_scores["train_roc_auc"].std()
   evals.cv_roc_auc_test_mean  = cv_scores["test_roc_auc"].mean()
@@ -122,19 +142,327 @@ def compute_model_evaluations(pipeline: Pipeline,
 
   # Compute hold-out metrics using test set
   # These metrics show how well this model will perform in the real world on previously unseen data
-  y_pred = fitted_estimator.predict(X_test)
-  evals.holdout_acc = accuracy_score(y_test, y_pred)
-
   y_proba = fitted_estimator.predict_proba(X_test)
+  holdout_metrics = compute_proba_metrics(y_test,
+    y_proba,
+    fitted_estimator.classes_,
+    ndcg_k=ndcg_k,
+    sample_weight=sample_weight_test)
 
-  y_test_bin = label_binarize(y_test, classes=fitted_estimator.classes_)
-  evals.holdout_ndcg_score = ndcg_score(y_test_bin, y_proba, k=ndcg_k)
-  evals.holdout_ll = log_loss(y_test, y_proba, labels=fitted_estimator.classes_)
+  evals.holdout_acc = holdout_metrics["accuracy"]
+  evals.holdout_ndcg_score = holdout_metrics["ndcg"]
+  evals.holdout_ll = -holdout_metrics["neg_log_loss"]
   evals.holdout_vs_cv_acc_delta = evals.holdout_acc - evals.cv_acc_mean
   evals.holdout_vs_cv_ndcg_delta = evals.holdout_ndcg_score - evals.cv_ndcg_train_mean
 
   return evals
 
+# Fold scores of candidate index of a search's cv_results_ in cross_validate's format ("test_ndcg" -> scores per fold),
+# None if the search didn't record train and test scores of every CV_METRICS metric (or a fold failed to score)
+def get_candidate_cv_scores(cv_results: Dict[str, Any], index: int) -> Dict[str, np.ndarray] | None:
+  n_splits = sum(1 for key in cv_results if key.startswith("split") and key.endswith("_test_ndcg"))
+  if n_splits == 0:
+    return None
+
+  cv_scores: Dict[str, np.ndarray] = {}
+  for metric in CV_METRICS:
+    for subset in ["train", "test"]:
+      keys = [f"split{fold}_{subset}_{metric}" for fold in range(n_splits)]
+      if any(key not in cv_results for key in keys):
+        return None
+      cv_scores[f"{subset}_{metric}"] = np.array([cv_results[key][index] for key in keys], dtype=float)
+      if np.isnan(cv_scores[f"{subset}_{metric}"]).any():
+        return None
+
+  return cv_scores
+
+# Run stratified k-fold CV for all evaluation metrics.
+# With n_jobs != 1 folds run in a loky process pool. Arrays larger than max_nbytes (training data,
+# cached token counts) are dumped once and memory-mapped read-only into every worker instead of being
+# pickled per fold, and BLAS/OpenMP threads per worker are capped at blas_threads so
+# n_jobs workers don't oversubscribe the cores.
+def cross_validate_model(pipeline: Pipeline,
+  X_train: Any,
+  y_train: Any,
+  random_state: int,
+  n_splits: int = 5,
+  ndcg_k: int = 10,
+  sample_weight_train: Any = None,
+  use_vectorizer_cache: bool = True,
+  n_jobs: int = 1,
+  blas_threads: int = 1,
+  max_nbytes: str = "1M") -> Dict[str, np.ndarray]:
+
+  cv = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+  # training row weights are passed to each fold's classifier fit
+  fit_params = create_fit_params(sample_weight_train)
+
+  # tokenize training set once, folds only re-derive tf-idf weights from cached counts
+  with cached_pipeline_scope(pipeline, X_train, enabled=use_vectorizer_cache) as (cv_pipeline, cv_X_train):
+    with span("cv", rows=len(X_train), folds=n_splits), parallel_config(backend="loky",
+      max_nbytes=max_nbytes,
+      mmap_mode="r",
+      inner_max_num_threads=blas_threads):
+      return cross_validate(
+        cv_pipeline,
+        cv_X_train,
+        np.asarray(y_train),
+        # one predict_proba per split, all metrics derived from it
+        scoring=make_fused_scorer(ndcg_k),
+        cv=cv,
+        n_jobs=n_jobs,
+        return_train_score=True,
+        error_score="raise",
+        verbose=0,
+        params=fit_params
+      )
+
+# Time serial vs fold-parallel cross validation of the same pipeline and report the speedup.
+def benchmark_cross_validation(pipeline: Pipeline,
+  X_train: Any,
+  y_train: Any,
+  random_state: int,
+  n_jobs: int = -1,
+  blas_threads: int = 1,
+  sample_weight_train: Any = None) -> Dict[str, float]:
+
+  timings: Dict[str, float] = {}
+  for name, jobs in [("serial", 1), ("parallel", n_jobs)]:
+    started = time.perf_counter()
+    cross_validate_model(pipeline,
+      X_train,
+      y_train,
+      random_state,
+      sample_weight_train=sample_weight_train,
+      n_jobs=jobs,
+      blas_threads=blas_threads)
+    timings[f"{name}_seconds"] = time.perf_counter() - started
+
+  timings["speedup"] = timings["serial_seconds"] / timings["parallel_seconds"]
+  print(f"CV serial: {timings['serial_seconds']:.2f}s, parallel (n_jobs={n_jobs}): {timings['parallel_seconds']:.2f}s, speedup: {timings['speedup']:.2f}x")
+
+  return timings
+
+# Fit the LogisticRegression pipeline with the vocabulary vectorizer and with a hashing vectorizer
+# for each bucket count, and compare holdout ndcg, ONNX model size and bucket collisions.
+# Writes the rows to report_path as JSON when given.
+def compare_hashing_vectorizers(training_params: Dict[str, Any],
+  X_train: Any,
+  y_train: Any,
+  X_test: Any,
+  y_test: Any,
+  bucket_counts: Sequence[int],
+  sample_weight_train: Any = None,
+  sample_weight_test: Any = None,
+  ndcg_k: int = 10,
+  report_path: str | None = None) -> List[Dict[str, Any]]:
+
+  rows: List[Dict[str, Any]] = []
+  for hash_buckets in [None, *bucket_counts]:
+    pipeline = create_lr_pipeline(hash_buckets=hash_buckets).set_params(**training_params)
+    started = time.perf_counter()
+    pipeline.fit(X_train, y_train, **create_fit_params(sample_weight_train))
+    fit_seconds = time.perf_counter() - started
+
+    vec = pipeline.named_steps[VEC_STEP]
+    metrics = compute_proba_metrics(y_test, pipeline.predict_proba(X_test), pipeline.classes_, ndcg_k=ndcg_k, sample_weight=sample_weight_test)
+    row = {
+      "vectorizer": "vocabulary" if hash_buckets is None else "hashing",
+      "n_features": len(vec.idf_),
+      "collision_rate": 0.0 if hash_buckets is None else vec.collision_rate_,
+      "onnx_bytes": len(convert_to_onnx(pipeline).SerializeToString()),
+      "fit_seconds": fit_seconds,
+      f"holdout_ndcg_{ndcg_k}": metrics["ndcg"],
+      "holdout_accuracy": metrics["accuracy"],
+    }
+    rows.append(row)
+    print(f"{row['vectorizer']:>10} features={row['n_features']:>6} collisions={row['collision_rate']:.3f} "
+      f"onnx={row['onnx_bytes']:>8}B fit={fit_seconds:.2f}s ndcg({ndcg_k})={metrics['ndcg']:.4f}")
+
+  if report_path is not None:
+    with open(report_path, "w", encoding="utf-8") as f:
+      json.dump({"ndcg_k": ndcg_k, "vectorizers": rows}, f, indent=2)
+
+  return rows
+
+# Compare training on synonym-expanded rows with training on canonical rows and a vectorizer that
+# canonicalizes synonyms (see canonical_vectorizer.py). Both models are scored on the same holdout split
+# of the expanded rows, so queries spelled with synonyms are part of the test set. The canonical model
+# is trained on the canonicalized and de-duplicated expanded training split, which carries the same
+# phrases and total weight as the expanded one. Writes the rows to report_path as JSON when given.
+def compare_synonym_canonicalization(training_params: Dict[str, Any],
+  training_data: List[RawTrainingDataRow],
+  synonyms: Dict[str, List[str]],
+  random_state: int,
+  max_phrase_variants: int | None = None,
+  ndcg_k: int = 10,
+  report_path: str | None = None) -> Dict[str, Any]:
+
+  expanded_rows = transform_to_weighted_training_rows(training_data, max_phrase_variants, dedup=False)
+  canonical_rows = transform_to_weighted_training_rows(training_data, dedup=False, canonicalize_synonyms=True)
+  X_train, X_test, y_train, y_test, w_train, w_test = train_test_split(
+    expanded_rows["text"], expanded_rows["label"], expanded_rows["weight"], test_size=0.2, stratify=expanded_rows["label"], random_state=random_state
+  )
+
+  synonym_index = SynonymIndex(synonyms)
+  canonical_train = (
+    pd.DataFrame({"label": y_train, "text": X_train.map(synonym_index.canonicalize_phrase), "weight": w_train})
+      .groupby(["label", "text"], as_index=False, sort=False)["weight"].sum()[WEIGHTED_TRAINING_ROW_COLUMNS]
+  )
+
+  rows: List[Dict[str, Any]] = []
+  for mode, canonical_synonyms, train_rows in [
+    ("expansion", None, pd.DataFrame({"label": y_train, "text": X_train, "weight": w_train})),
+    ("canonical", synonyms, canonical_train),
+  ]:
+    pipeline = create_lr_pipeline(canonical_synonyms=canonical_synonyms).set_params(**training_params)
+    started = time.perf_counter()
+    pipeline.fit(train_rows["text"], train_rows["label"], **create_fit_params(train_rows["weight"]))
+    fit_seconds = time.perf_counter() - started
+
+    metrics = compute_proba_metrics(y_test, pipeline.predict_proba(X_test), pipeline.classes_, ndcg_k=ndcg_k, sample_weight=w_test)
+    row = {
+      "mode": mode,
+      "training_rows": len(train_rows),
+      "n_features": len(pipeline.named_steps[VEC_STEP].idf_),
+      "fit_seconds": fit_seconds,
+      f"holdout_ndcg_{ndcg_k}": metrics["ndcg"],
+      "holdout_accuracy": metrics["accuracy"],
+    }
+    rows.append(row)
+    print(f"{mode:>10} rows={row['training_rows']:>6} features={row['n_features']:>5} fit={fit_seconds:.2f}s "
+      f"ndcg({ndcg_k})={metrics['ndcg']:.4f} accuracy={metrics['accuracy']:.4f}")
+
+  report = {
+    "ndcg_k": ndcg_k,
+    "expanded_rows": len(expanded_rows),
+    "canonical_rows": len(canonical_rows),
+    "row_reduction": 1 - len(canonical_rows) / len(expanded_rows),
+    "fit_speedup": rows[0]["fit_seconds"] / rows[1]["fit_seconds"],
+    "models": rows,
+  }
+  print(f"Canonicalization: {report['expanded_rows']} -> {report['canonical_rows']} training rows "
+    f"({report['row_reduction']:.1%} fewer), fit speedup {report['fit_speedup']:.2f}x")
+
+  if report_path is not None:
+    with open(report_path, "w", encoding="utf-8") as f:
+      json.dump(report, f, indent=2)
+
+  return report
+
+# Train the LogisticRegression pipeline in float64 and in float32 (see create_lr_pipeline) and compare
+# the bytes of the training features and weights, the fit's tracemalloc peak, fit, CV and predict_proba
+# times and holdout metrics. The float32 model's top k rankings of the holdout queries are checked
+# against the float64 ones: a rank counts as changed only when the float64 probabilities of the two
+# labels differ by more than atol, so ties that rounding can reorder don't count.
+# lbfgs and newton-cg stop at different points within the tuned tol, so both models are also checked
+# against a float64 reference converged to reference_tol: that separates solver tolerance from dtype.
+# Writes the report to report_path as JSON when given.
+def compare_float32_mode(training_params: Dict[str, Any],
+  X_train: Any,
+  y_train: Any,
+  X_test: Any,
+  y_test: Any,
+  random_state: int,
+  sample_weight_train: Any = None,
+  sample_weight_test: Any = None,
+  ndcg_k: int = 10,
+  k: int = 10,
+  atol: float = 1e-4,
+  reference_tol: float = 1e-8,
+  predict_repeats: int = 5,
+  report_path: str | None = None) -> Dict[str, Any]:
+
+  rows: List[Dict[str, Any]] = []
+  pipelines: Dict[str, Pipeline] = {}
+  for dtype_name in ["float64", "float32"]:
+    dtype = PIPELINE_DTYPES[dtype_name]
+    pipeline = create_lr_pipeline(dtype=dtype).set_params(**create_dtype_params(training_params, dtype))
+
+    started = time.perf_counter()
+    features_train = pipeline[:-1].fit_transform(X_train)
+    vectorize_seconds = time.perf_counter() - started
+
+    classifier = pipeline.named_steps[CLF_STEP]
+    with measure_memory_peak() as fit_peak:
+      started = time.perf_counter()
+      classifier.fit(features_train, y_train, sample_weight=sample_weight_train)
+      fit_seconds = time.perf_counter() - started
+    fit_peak_bytes = fit_peak.peak_bytes
+
+    started = time.perf_counter()
+    cv_scores = cross_validate_model(pipeline, X_train, y_train, random_state, ndcg_k=ndcg_k, sample_weight_train=sample_weight_train)
+    cv_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(predict_repeats):
+      proba = pipeline.predict_proba(X_test)
+    predict_seconds = (time.perf_counter() - started) / predict_repeats
+
+    metrics = compute_proba_metrics(y_test, proba, pipeline.classes_, ndcg_k=ndcg_k, sample_weight=sample_weight_test)
+    row = {
+      "dtype": dtype_name,
+      "solver": classifier.solver,
+      "feature_bytes": features_train.data.nbytes + features_train.indices.nbytes + features_train.indptr.nbytes,
+      "feature_value_bytes": features_train.data.nbytes,
+      "weight_bytes": classifier.coef_.nbytes + classifier.intercept_.nbytes,
+      "fit_peak_bytes": fit_peak_bytes,
+      "vectorize_seconds": vectorize_seconds,
+      "fit_seconds": fit_seconds,
+      "cv_seconds": cv_seconds,
+      "predict_rows_per_second": len(X_test) / predict_seconds,
+      f"cv_ndcg_{ndcg_k}": float(np.mean(cv_scores["test_ndcg"])),
+      f"holdout_ndcg_{ndcg_k}": metrics["ndcg"],
+      "holdout_accuracy": metrics["accuracy"],
+    }
+    rows.append(row)
+    pipelines[dtype_name] = pipeline
+    print(f"{dtype_name:>8} solver={row['solver']:<9} features={row['feature_bytes']:>9}B weights={row['weight_bytes']:>7}B "
+      f"fit peak={fit_peak_bytes / 2**20:.1f}MB fit={fit_seconds:.2f}s cv={cv_seconds:.2f}s "
+      f"predict={row['predict_rows_per_second']:.0f} rows/s ndcg({ndcg_k})={metrics['ndcg']:.4f}")
+
+  reference = clone(pipelines["float64"]).set_params(**{f"{CLF_STEP}__tol": reference_tol})
+  reference.set_params(**{f"{CLF_STEP}__max_iter": max(reference.named_steps[CLF_STEP].max_iter, 10000)})
+  pipelines["converged"] = reference.fit(X_train, y_train, **create_fit_params(sample_weight_train))
+
+  texts = list(X_test)
+  probas = {name: pipeline.predict_proba(texts) for name, pipeline in pipelines.items()}
+  top = {name: top_k_indices(proba, k) for name, proba in probas.items()}
+  ranking_parity: Dict[str, Dict[str, Any]] = {}
+  for name, expected_name in [("float32", "float64"), ("float64", "converged"), ("float32", "converged")]:
+    parity = compare_rankings(probas[expected_name],
+      pipelines[expected_name].classes_,
+      pipelines[name].classes_[top[name]],
+      np.take_along_axis(probas[name], top[name], axis=1),
+      atol=atol)
+    parity["exact_top_k_agreement"] = float((top[name] == top[expected_name]).all(axis=1).mean())
+    ranking_parity[f"{name}_vs_{expected_name}"] = parity
+
+  report = {
+    "ndcg_k": ndcg_k,
+    "training_rows": len(X_train),
+    "feature_bytes_ratio": rows[1]["feature_bytes"] / rows[0]["feature_bytes"],
+    "fit_peak_ratio": rows[1]["fit_peak_bytes"] / rows[0]["fit_peak_bytes"],
+    "fit_speedup": rows[0]["fit_seconds"] / rows[1]["fit_seconds"],
+    "cv_speedup": rows[0]["cv_seconds"] / rows[1]["cv_seconds"],
+    f"holdout_ndcg_{ndcg_k}_delta": rows[1][f"holdout_ndcg_{ndcg_k}"] - rows[0][f"holdout_ndcg_{ndcg_k}"],
+    "ranking_parity": ranking_parity,
+    "models": rows,
+  }
+  print(f"float32: features {report['feature_bytes_ratio']:.2f}x bytes, fit peak {report['fit_peak_ratio']:.2f}x, "
+    f"fit speedup {report['fit_speedup']:.2f}x, cv speedup {report['cv_speedup']:.2f}x, "
+    f"ndcg({ndcg_k}) delta {report[f'holdout_ndcg_{ndcg_k}_delta']:+.4f}, "
+    f"top {k} agreement with float64 {ranking_parity['float32_vs_float64']['top_k_agreement']:.4f}")
+  for name, parity in ranking_parity.items():
+    print(f"  {name:>20}: top {k} agreement {parity['top_k_agreement']:.4f} (exact {parity['exact_top_k_agreement']:.4f}), "
+      f"top 1 {parity['top_1_agreement']:.4f}, max probability error {parity['max_probability_error']:.2e}")
+
+  if report_path is not None:
+    with open(report_path, "w", encoding="utf-8") as f:
+      json.dump(report, f, indent=2)
+
+  return report
+
 def get_feature_contribs(pipeline: Pipeline, class_labels: list[str], query: str):  
   vec = pipeline.named_steps[VEC_STEP]
   clf = pipeline.named_steps[CLF_STEP]
@@ -0,0 +1,254 @@
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Sequence, Tuple
+import re
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.utils.validation import check_is_fitted
+
+if TYPE_CHECKING:
+  import onnx
+
+FNV1A_32_OFFSET = 0x811C9DC5
+FNV1A_32_PRIME = 0x01000193
+HASHED_INPUT_NAME = "token_buckets"
+HASHED_OPSET = 18
+# IR version of opset 18, so older onnxruntime (web) builds load the model
+HASHED_IR_VERSION = 8
+
+# 32 bit FNV-1a of the token's UTF-8 bytes. Chosen over murmur3 for being trivial to reproduce
+# outside of Python, e.g. in JavaScript:
+#   let h = 0x811c9dc5; for (const b of new TextEncoder().encode(token)) { h = Math.imul(h ^ b, 0x01000193) >>> 0; }
+@lru_cache(maxsize=1 << 16)
+def fnv1a_32(token: str) -> int:
+  value = FNV1A_32_OFFSET
+  for byte in token.encode("utf-8"):
+    value = ((value ^ byte) * FNV1A_32_PRIME) & 0xFFFFFFFF
+  return value
+
+# Same tokens as TfidfVectorizer(analyzer="word"): token_pattern matches, word n-grams joined by a single space
+def tokenize(text: str, token_regex: re.Pattern, lowercase: bool, ngram_range: Tuple[int, int]) -> List[str]:
+  words = token_regex.findall(text.lower() if lowercase else text)
+  min_n, max_n = ngram_range
+  if max_n == 1:
+    return words if min_n == 1 else []
+
+  return [" ".join(words[start:start + n]) for n in range(min_n, max_n + 1) for start in range(len(words) - n + 1)]
+
+# Bucket index of every token of every text, as a (n_texts, max_tokens) array padded with -1.
+# This is the input of the hashed ONNX model.
+def hash_token_buckets(texts: Iterable[str],
+  n_buckets: int,
+  token_pattern: str,
+  lowercase: bool,
+  ngram_range: Tuple[int, int]) -> np.ndarray:
+  token_regex = re.compile(token_pattern)
+  rows = [[fnv1a_32(token) % n_buckets for token in tokenize(text, token_regex, lowercase, ngram_range)] for text in texts]
+  buckets = np.full((len(rows), max([len(row) for row in rows] + [1])), -1, dtype=np.int64)
+  for idx, row in enumerate(rows):
+    buckets[idx, :len(row)] = row
+  return buckets
+
+# Tf-idf over a fixed number of hashed token buckets instead of a vocabulary:
+# features and model size depend on n_buckets only, not on how many distinct tokens/n-grams the data has.
+# Tokens sharing a bucket share its idf and weights. Hash signs aren't alternated (unlike sklearn's
+# HashingVectorizer) so counts stay non-negative for idf and sublinear tf.
+# Only collision statistics of the training tokens are kept, never the tokens themselves.
+class HashingTfidfVectorizer(TransformerMixin, BaseEstimator):
+  def __init__(self,
+    n_buckets: int = 1 << 14,
+    lowercase: bool = True,
+    token_pattern: str = r"[a-z0-9-]+",
+    ngram_range: Tuple[int, int] = (1, 1),
+    use_idf: bool = True,
+    smooth_idf: bool = True,
+    sublinear_tf: bool = False,
+    norm: str | None = "l2"):
+    self.n_buckets = n_buckets
+    self.lowercase = lowercase
+    self.token_pattern = token_pattern
+    self.ngram_range = ngram_range
+    self.use_idf = use_idf
+    self.smooth_idf = smooth_idf
+    self.sublinear_tf = sublinear_tf
+    self.norm = norm
+
+  def _count_buckets(self, raw_documents: Iterable[str], distinct_tokens: set | None = None) -> csr_matrix:
+    if self.n_buckets < 1:
+      raise ValueError(f"n_buckets must be positive, got {self.n_buckets}")
+
+    token_regex = re.compile(self.token_pattern)
+    ngram_range = tuple(self.ngram_range)
+    indptr, indices = [0], []
+
+    for text in raw_documents:
+      tokens = tokenize(text, token_regex, self.lowercase, ngram_range)
+      if distinct_tokens is not None:
+        distinct_tokens.update(tokens)
+      indices.extend(fnv1a_32(token) % self.n_buckets for token in tokens)
+      indptr.append(len(indices))
+
+    counts = csr_matrix((np.ones(len(indices)), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+      shape=(len(indptr) - 1, self.n_buckets))
+    counts.sum_duplicates()
+    return counts
+
+  def fit(self, raw_documents, y=None):
+    self.fit_transform(raw_documents)
+    return self
+
+  def fit_transform(self, raw_documents, y=None):
+    distinct_tokens: set = set()
+    counts = self._count_buckets(raw_documents, distinct_tokens)
+
+    token_buckets = np.array([fnv1a_32(token) % self.n_buckets for token in distinct_tokens], dtype=np.int64)
+    tokens_per_bucket = np.bincount(token_buckets, minlength=self.n_buckets)
+    self.n_tokens_ = len(distinct_tokens)
+    self.n_used_buckets_ = int(np.count_nonzero(tokens_per_bucket))
+    # share of the distinct training tokens that share their bucket with at least one other token
+    self.collision_rate_ = float(tokens_per_bucket[tokens_per_bucket > 1].sum() / max(self.n_tokens_, 1))
+
+    self._tfidf = TfidfTransformer(norm=self.norm,
+      use_idf=self.use_idf,
+      smooth_idf=self.smooth_idf,
+      sublinear_tf=self.sublinear_tf)
+    return self._tfidf.fit_transform(counts)
+
+  def transform(self, raw_documents):
+    check_is_fitted(self, "_tfidf")
+    return self._tfidf.transform(self._count_buckets(raw_documents))
+
+  @property
+  def idf_(self) -> np.ndarray:
+    return self._tfidf.idf_
+
+  def get_collision_report(self) -> Dict[str, Any]:
+    check_is_fitted(self, "_tfidf")
+    return {
+      "n_buckets": self.n_buckets,
+      "n_tokens": self.n_tokens_,
+      "n_used_buckets": self.n_used_buckets_,
+      "collision_rate": self.collision_rate_,
+    }
+
+# ONNX model of a fitted (HashingTfidfVectorizer, multinomial linear classifier) pipeline.
+# Strings can't be hashed with standard ONNX ops, so the model takes the token bucket indices
+# from hash_token_buckets (or the same FNV-1a hashing in the browser) and computes
+# counts -> tf-idf -> softmax(xW + b) like Pipeline.predict_proba. Outputs match the skl2onnx
+# export (label, probabilities, class_labels); the hashing settings are stored in the model metadata.
+def convert_hashed_pipeline_to_onnx(estimator: Pipeline) -> "onnx.ModelProto":
+  import onnx
+  from onnx import TensorProto, helper, numpy_helper
+
+  vec, clf = estimator.steps[0][1], estimator.steps[-1][1]
+
+  if not isinstance(vec, HashingTfidfVectorizer):
+    raise ValueError(f"Expected a HashingTfidfVectorizer step, got {vec.__class__.__name__}")
+  if not hasattr(clf, "coef_") or clf.coef_.shape[0] != len(clf.classes_) or getattr(clf, "solver", None) == "liblinear":
+    raise ValueError(f"{clf.__class__.__name__} is not a multinomial linear classifier and can't be exported with hashed features")
+  if vec.norm not in (None, "l1", "l2"):
+    raise ValueError(f"Unsupported norm '{vec.norm}'")
+
+  n_buckets = vec.n_buckets
+  initializers = [
+    numpy_helper.from_array(np.array([n_buckets + 1], dtype=np.int64), "hash_bucket_columns"),
+    numpy_helper.from_array(np.array([0], dtype=np.int64), "hash_zero"),
+    numpy_helper.from_array(np.array([n_buckets], dtype=np.int64), "hash_n_buckets"),
+    numpy_helper.from_array(np.array([1], dtype=np.int64), "hash_axis"),
+    numpy_helper.from_array(clf.coef_.T.astype(np.float32), "hash_weights"),
+    numpy_helper.from_array(clf.intercept_.astype(np.float32), "hash_intercepts"),
+    numpy_helper.from_array(np.asarray(clf.classes_).astype(str).astype(object), "hash_classes"),
+  ]
+  zero = helper.make_tensor("zero_value", TensorProto.FLOAT, [1], [0.0])
+  one = helper.make_tensor("one_value", TensorProto.FLOAT, [1], [1.0])
+
+  nodes = [
+    # counts: scatter-add 1 per token into (n_texts, n_buckets + 1); padding (-1) lands in the extra last column
+    helper.make_node("Shape", [HASHED_INPUT_NAME], ["hash_input_shape"]),
+    helper.make_node("Slice", ["hash_input_shape", "hash_zero", "hash_axis"], ["hash_n_texts"]),
+    helper.make_node("Concat", ["hash_n_texts", "hash_bucket_columns"], ["hash_counts_shape"], axis=0),
+    helper.make_node("ConstantOfShape", ["hash_counts_shape"], ["hash_counts_zeros"], value=zero),
+    helper.make_node("ConstantOfShape", ["hash_input_shape"], ["hash_ones"], value=one),
+    helper.make_node("ScatterElements", ["hash_counts_zeros", HASHED_INPUT_NAME, "hash_ones"], ["hash_padded_counts"],
+      axis=1, reduction="add"),
+    helper.make_node("Slice", ["hash_padded_counts", "hash_zero", "hash_n_buckets", "hash_axis"], ["hash_counts"]),
+  ]
+  features = "hash_counts"
+
+  if vec.sublinear_tf:
+    nodes += [
+      helper.make_node("Log", [features], ["hash_log_counts"]),
+      helper.make_node("Add", ["hash_log_counts", "hash_one"], ["hash_log_counts_plus_one"]),
+      helper.make_node("Greater", [features, "hash_zero_f"], ["hash_nonzero"]),
+      helper.make_node("Where", ["hash_nonzero", "hash_log_counts_plus_one", "hash_zero_f"], ["hash_tf"]),
+    ]
+    initializers += [
+      numpy_helper.from_array(np.array(1.0, dtype=np.float32), "hash_one"),
+      numpy_helper.from_array(np.array(0.0, dtype=np.float32), "hash_zero_f"),
+    ]
+    features = "hash_tf"
+
+  if vec.use_idf:
+    initializers.append(numpy_helper.from_array(vec.idf_.astype(np.float32), "hash_idf"))
+    nodes.append(helper.make_node("Mul", [features, "hash_idf"], ["hash_tfidf"]))
+    features = "hash_tfidf"
+
+  if vec.norm is not None:
+    reduce = "ReduceL2" if vec.norm == "l2" else "ReduceL1"
+    initializers.append(numpy_helper.from_array(np.array(np.finfo(np.float32).tiny, dtype=np.float32), "hash_tiny"))
+    nodes += [
+      helper.make_node(reduce, [features, "hash_axis"], ["hash_norm"], keepdims=1),
+      # zero rows stay zero, like sklearn.preprocessing.normalize
+      helper.make_node("Max", ["hash_norm", "hash_tiny"], ["hash_safe_norm"]),
+      helper.make_node("Div", [features, "hash_safe_norm"], ["hash_normalized"]),
+    ]
+    features = "hash_normalized"
+
+  nodes += [
+    helper.make_node("MatMul", [features, "hash_weights"], ["hash_scores"]),
+    helper.make_node("Add", ["hash_scores", "hash_intercepts"], ["hash_logits"]),
+    helper.make_node("Softmax", ["hash_logits"], ["probabilities"], axis=1),
+    helper.make_node("ArgMax", ["probabilities"], ["hash_label_index"], axis=1, keepdims=0),
+    helper.make_node("Gather", ["hash_classes", "hash_label_index"], ["label"], axis=0),
+    helper.make_node("Identity", ["hash_classes"], ["class_labels"]),
+  ]
+
+  graph = helper.make_graph(nodes,
+    "hashed_tfidf_linear_classifier",
+    [helper.make_tensor_value_info(HASHED_INPUT_NAME, TensorProto.INT64, [None, None])],
+    [
+      helper.make_tensor_value_info("label", TensorProto.STRING, [None]),
+      helper.make_tensor_value_info("probabilities", TensorProto.FLOAT, [None, len(clf.classes_)]),
+      helper.make_tensor_value_info("class_labels", TensorProto.STRING, [len(clf.classes_)]),
+    ],
+    initializer=initializers)
+  model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", HASHED_OPSET)], ir_version=HASHED_IR_VERSION)
+  helper.set_model_props(model, {
+    "vectorizer": "hashing",
+    "hash": "fnv1a_32",
+    "n_buckets": str(n_buckets),
+    "token_pattern": vec.token_pattern,
+    "lowercase": str(vec.lowercase).lower(),
+    "ngram_range": f"{vec.ngram_range[0]},{vec.ngram_range[1]}",
+    "padding": "-1",
+  })
+  onnx.checker.check_model(model)
+  return model
+
+# onnxruntime feed for texts: token buckets for hashed models (settings read from the model metadata),
+# a (n, 1) string tensor otherwise.
+def create_onnx_inputs(session: Any, texts: Sequence[str]) -> Dict[str, np.ndarray]:
+  input_name = session.get_inputs()[0].name
+  metadata = session.get_modelmeta().custom_metadata_map
+
+  if metadata.get("vectorizer") != "hashing":
+    return {input_name: np.array(list(texts), dtype=object).reshape(-1, 1)}
+
+  min_n, max_n = (int(n) for n in metadata["ngram_range"].split(","))
+  return {input_name: hash_token_buckets(texts,
+    n_buckets=int(metadata["n_buckets"]),
+    token_pattern=metadata["token_pattern"],
+    lowercase=metadata["lowercase"] == "true",
+    ngram_range=(min_n, max_n))}
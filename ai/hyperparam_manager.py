@@ -1,15 +1,19 @@
 from dataclasses import asdict, dataclass, is_dataclass
 from pathlib import Path
-from sklearn.model_selection import GridSearchCV
-from sklearn.experimental import enable_halving_search_cv
-from sklearn.model_selection import HalvingRandomSearchCV
+import numpy as np
+from sklearn import clone
+from sklearn.model_selection import GridSearchCV, StratifiedKFold
 from sklearn.pipeline import Pipeline
-from typing import Any, Dict, List, Literal, TypeAlias
+from typing import Any, Callable, Dict, List, Literal, TypeAlias
 import json
 
-from evaluator import ModelEvaluations, compute_model_evaluations
-from model_utils import make_ndcg_scorer
-from pipeline_factory import CLF_STEP
+from bayesian_search import run_bayesian_search
+from evaluator import ModelEvaluations, compute_model_evaluations, get_candidate_cv_scores
+from instrumentation import span
+from model_utils import fit_pipeline, make_fused_scorer, make_ndcg_scorer
+from pipeline_factory import CLF_STEP, VEC_STEP, create_fit_params
+from search_checkpoint import checkpoint_search, get_best_estimator
+from vectorizer_cache import cached_pipeline_scope, get_search_ngram_ranges, to_text_pipeline
 
 @dataclass
 class ModelParams:
@@ -47,24 +51,45 @@ class SearchResults:
 
 Refit: TypeAlias = Literal["neg_log_loss", "ndcg"]
 
+# Searches score every candidate on the folds evaluator.cross_validate_model uses, with train scores,
+# so the winner's ModelEvaluations come from cv_results_ (see get_best_cv_scores) without another CV
+def create_search_cv(random_state: int, n_splits: int = 5) -> StratifiedKFold:
+  return StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+
+# make_fused_scorer for successive halving, which ranks and keeps candidates by "score" only,
+# so the refit metric is reported under that name as well
+def make_halving_scorer(refit: Refit, k: int = 10) -> Callable:
+  fused_scorer = make_fused_scorer(k=k)
+
+  def _scorer(estimator, X, y):
+    scores = fused_scorer(estimator, X, y)
+    return {**scores, "score": scores[refit]}
+  return _scorer
+
+# Fold scores of the search winner for compute_model_evaluations, None if the search didn't record them.
+# A halving search over n_samples may have scored the winner on a subsample only, that's no CV of the
+# full training set either.
+def get_best_cv_scores(search: Any, n_train_rows: int) -> Dict[str, np.ndarray] | None:
+  results = search.cv_results_
+  if getattr(search, "resource", None) == "n_samples" and results["n_resources"][search.best_index_] < n_train_rows:
+    return None
+
+  return get_candidate_cv_scores(results, search.best_index_)
+
 def create_hyperparams_grid_search(estimator_pipeline: Pipeline,
   param_grid: Dict[str, List[Any]],
-  refit: TypeAlias):
+  refit: TypeAlias,
+  random_state: int):
   
-  scoring = {
-    "neg_log_loss": "neg_log_loss",
-    "accuracy": "accuracy",
-    "ndcg": make_ndcg_scorer(k=10)
-  }
-
   return GridSearchCV(
     estimator=estimator_pipeline,
     param_grid=param_grid,
-    scoring=scoring,
+    # single predict_proba per split for all metrics (accuracy, neg_log_loss, roc_auc, ndcg)
+    scoring=make_fused_scorer(k=10),
     refit=refit,
-    cv=5,
+    cv=create_search_cv(random_state),
     verbose=2,
-    return_train_score=False,
+    return_train_score=True,
     n_jobs=-1
   )
 
@@ -76,7 +101,10 @@ def create_hyperparams_random_halving_search(estimator_pipeline: Pipeline,
   min_resources: int,
   max_resources: int,
   pruning_aggressiveness_factor: int = 3):
-  
+  # experimental in sklearn, the enabling import is only paid for by halving searches
+  from sklearn.experimental import enable_halving_search_cv # noqa: F401
+  from sklearn.model_selection import HalvingRandomSearchCV
+
   return HalvingRandomSearchCV(
     estimator=estimator_pipeline,
     param_distributions=param_distr,
@@ -85,12 +113,12 @@ def create_hyperparams_random_halving_search(estimator_pipeline: Pipeline,
     resource=resource,
     min_resources=min_resources,
     max_resources=max_resources,
-    scoring=make_ndcg_scorer(k=10),
-    cv=5,
+    scoring=make_halving_scorer(refit, k=10),
+    cv=create_search_cv(random_state),
     refit=refit,
     random_state=random_state,
     verbose=2,
-    return_train_score=False,
+    return_train_score=True,
     n_jobs=-1
   )
 
@@ -101,21 +129,44 @@ def find_best_params_grid_search(pipeline: Pipeline,
   y_test: Any,
   random_state: int,
   param_grid: Dict[str, List[Any]],
-  refit: Refit) -> SearchResults:
+  refit: Refit,
+  sample_weight_train: Any = None,
+  sample_weight_test: Any = None,
+  use_vectorizer_cache: bool = True,
+  cv_n_jobs: int = 1,
+  checkpoint_path: str | None = None) -> SearchResults:
+
+  with cached_pipeline_scope(pipeline, X_train, get_search_ngram_ranges(param_grid),
+    enabled=use_vectorizer_cache) as (search_pipeline, search_X_train):
+    search = create_hyperparams_grid_search(search_pipeline, param_grid, refit=refit, random_state=random_state)
 
-  search = create_hyperparams_grid_search(pipeline, param_grid, refit=refit)
+    if checkpoint_path is not None:
+      search = checkpoint_search(search, checkpoint_path, X_train, y_train, sample_weight_train)
 
-  search.fit(X_train, y_train)
+    with span("search", rows=len(X_train)) as search_span:
+      search.fit(search_X_train, y_train, **create_fit_params(sample_weight_train))
+      search_span.count(candidates=len(search.cv_results_["params"]))
+
+    best_estimator = (
+      to_text_pipeline(get_best_estimator(search), pipeline, X_train)
+      if use_vectorizer_cache
+      else get_best_estimator(search)
+    )
 
-  model_evals = compute_model_evaluations(pipeline,
-    search.best_estimator_,
+  model_evals = compute_model_evaluations(best_estimator,
+    best_estimator,
     random_state,
     X_train,
     y_train,
     X_test,
-    y_test)
+    y_test,
+    sample_weight_train=sample_weight_train,
+    sample_weight_test=sample_weight_test,
+    use_vectorizer_cache=use_vectorizer_cache,
+    cv_n_jobs=cv_n_jobs,
+    cv_scores=get_best_cv_scores(search, len(X_train)))
   
-  return SearchResults(best_estimator=search.best_estimator_,
+  return SearchResults(best_estimator=best_estimator,
     best_score=search.best_score_,
     estimator_params=search.best_params_,
     model_evals=model_evals,
@@ -131,32 +182,191 @@ def find_best_params_random_halving_search(pipeline: Pipeline,
   resource: str,
   min_resources: int,
   max_resources: int,
-  refit: Refit) -> SearchResults:
+  refit: Refit,
+  sample_weight_train: Any = None,
+  sample_weight_test: Any = None,
+  use_vectorizer_cache: bool = True,
+  cv_n_jobs: int = 1,
+  checkpoint_path: str | None = None) -> SearchResults:
 
-  search = create_hyperparams_random_halving_search(estimator_pipeline=pipeline,
-    param_distr=param_distributions,
-    random_state=random_state,
-    resource=resource,
-    refit=refit,
-    min_resources=min_resources,
-    max_resources=max_resources)
+  with cached_pipeline_scope(pipeline, X_train, get_search_ngram_ranges(param_distributions),
+    enabled=use_vectorizer_cache) as (search_pipeline, search_X_train):
+    search = create_hyperparams_random_halving_search(estimator_pipeline=search_pipeline,
+      param_distr=param_distributions,
+      random_state=random_state,
+      resource=resource,
+      refit=refit,
+      min_resources=min_resources,
+      max_resources=max_resources)
 
-  search.fit(X_train, y_train)
+    if checkpoint_path is not None:
+      search = checkpoint_search(search, checkpoint_path, X_train, y_train, sample_weight_train)
 
-  model_evals = compute_model_evaluations(pipeline,
-    search.best_estimator_,
+    with span("search", rows=len(X_train)) as search_span:
+      search.fit(search_X_train, y_train, **create_fit_params(sample_weight_train))
+      search_span.count(candidates=len(search.cv_results_["params"]))
+
+    best_estimator = (
+      to_text_pipeline(get_best_estimator(search), pipeline, X_train)
+      if use_vectorizer_cache
+      else get_best_estimator(search)
+    )
+
+  model_evals = compute_model_evaluations(best_estimator,
+    best_estimator,
     random_state,
     X_train,
     y_train,
     X_test,
-    y_test)
+    y_test,
+    sample_weight_train=sample_weight_train,
+    sample_weight_test=sample_weight_test,
+    use_vectorizer_cache=use_vectorizer_cache,
+    cv_n_jobs=cv_n_jobs,
+    cv_scores=get_best_cv_scores(search, len(X_train)))
   
-  return SearchResults(best_estimator=search.best_estimator_,
+  return SearchResults(best_estimator=best_estimator,
     best_score=search.best_score_,
     estimator_params=search.best_params_,
     model_evals=model_evals,
     refit=refit)
 
+# Adaptive search (see bayesian_search.run_bayesian_search): TPE proposes candidates from param_distributions
+# and candidates whose NDCG can't catch up with the best one are stopped before finishing all CV folds.
+# Every fold of every candidate uses the same StratifiedKFold splits, so fold scores are paired.
+def find_best_params_bayesian_search(pipeline: Pipeline,
+  X_train: Any,
+  X_test: Any,
+  y_train: Any,
+  y_test: Any,
+  random_state: int,
+  param_distributions: Dict[str, Any],
+  n_candidates: int = 40,
+  n_startup: int = 10,
+  min_folds: int = 2,
+  ucb_z: float = 2.0,
+  ndcg_k: int = 10,
+  n_splits: int = 5,
+  sample_weight_train: Any = None,
+  sample_weight_test: Any = None,
+  use_vectorizer_cache: bool = True,
+  cv_n_jobs: int = 1) -> SearchResults:
+
+  with cached_pipeline_scope(pipeline, X_train, get_search_ngram_ranges(param_distributions),
+    enabled=use_vectorizer_cache) as (search_pipeline, search_X_train):
+    X_values = np.asarray(search_X_train, dtype=None if use_vectorizer_cache else object)
+    y_values = np.asarray(y_train)
+    weights = None if sample_weight_train is None else np.asarray(sample_weight_train, dtype=float)
+    folds = list(StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state).split(X_values, y_values))
+    ndcg_scorer = make_ndcg_scorer(k=ndcg_k)
+
+    def score_fold(params: Dict[str, Any], fold: int) -> float:
+      train_idx, test_idx = folds[fold]
+      fold_weights = None if weights is None else weights[train_idx]
+      estimator = clone(search_pipeline).set_params(**params)
+      estimator.fit(X_values[train_idx], y_values[train_idx], **create_fit_params(fold_weights))
+      return ndcg_scorer(estimator, X_values[test_idx], y_values[test_idx])
+
+    with span("search", rows=len(X_train), candidates=n_candidates):
+      outcome = run_bayesian_search(score_fold,
+        param_distributions,
+        n_candidates=n_candidates,
+        n_splits=n_splits,
+        random_state=random_state,
+        n_startup=n_startup,
+        min_folds=min_folds,
+        ucb_z=ucb_z)
+
+  best_estimator = fit_pipeline(clone(pipeline).set_params(**outcome.best_params), X_train, y_train, sample_weight_train)
+
+  model_evals = compute_model_evaluations(best_estimator,
+    best_estimator,
+    random_state,
+    X_train,
+    y_train,
+    X_test,
+    y_test,
+    sample_weight_train=sample_weight_train,
+    sample_weight_test=sample_weight_test,
+    use_vectorizer_cache=use_vectorizer_cache,
+    cv_n_jobs=cv_n_jobs)
+
+  return SearchResults(best_estimator=best_estimator,
+    best_score=outcome.best_score,
+    estimator_params=outcome.best_params,
+    model_evals=model_evals,
+    refit="ndcg")
+
+# Warm-started search over a sorted grid of LogisticRegression C values (regularization path).
+# Each CV fold walks the grid from the strongest to the weakest regularization and starts every fit
+# from the previous solution, so neighbouring C values only need a few extra lbfgs iterations
+# instead of a fit from scratch per candidate.
+def find_best_params_regularization_path(pipeline: Pipeline,
+  X_train: Any,
+  X_test: Any,
+  y_train: Any,
+  y_test: Any,
+  random_state: int,
+  base_params: Dict[str, Any],
+  C_values: List[float],
+  ndcg_k: int = 10,
+  n_splits: int = 5,
+  sample_weight_train: Any = None,
+  sample_weight_test: Any = None,
+  cv_n_jobs: int = 1) -> SearchResults:
+
+  path_pipeline = clone(pipeline).set_params(**base_params)
+  C_path = np.sort(np.asarray(C_values, dtype=float))
+  X_values = np.asarray(X_train, dtype=object)
+  y_values = np.asarray(y_train)
+  weights = None if sample_weight_train is None else np.asarray(sample_weight_train, dtype=float)
+
+  ndcg_at_k = make_ndcg_scorer(k=ndcg_k)
+  fold_scores = np.zeros((n_splits, len(C_path)))
+  total_iterations = 0
+
+  cv = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+  with span("search", rows=len(X_train), candidates=len(C_path)) as search_span:
+    for fold, (train_idx, test_idx) in enumerate(cv.split(X_values, y_values)):
+      vec = clone(path_pipeline.named_steps[VEC_STEP])
+      X_fold_train = vec.fit_transform(X_values[train_idx])
+      X_fold_test = vec.transform(X_values[test_idx])
+      fold_weights = None if weights is None else weights[train_idx]
+
+      clf = clone(path_pipeline.named_steps[CLF_STEP]).set_params(warm_start=True)
+      for c_idx, C in enumerate(C_path):
+        clf.set_params(C=C)
+        clf.fit(X_fold_train, y_values[train_idx], sample_weight=fold_weights)
+        total_iterations += int(np.sum(clf.n_iter_))
+        fold_scores[fold, c_idx] = ndcg_at_k(clf, X_fold_test, y_values[test_idx])
+
+      print(f"Fold {fold + 1}/{n_splits}: best C={C_path[fold_scores[fold].argmax()]:.5g} ndcg={fold_scores[fold].max():.4f}")
+    search_span.count(solver_iterations=total_iterations)
+
+  mean_scores = fold_scores.mean(axis=0)
+  best_idx = int(mean_scores.argmax())
+  print(f"Regularization path: {len(C_path) * n_splits} warm-started fits, {total_iterations} total solver iterations")
+
+  best_params = {**base_params, f"{CLF_STEP}__C": float(C_path[best_idx])}
+  best_estimator = fit_pipeline(clone(pipeline).set_params(**best_params), X_train, y_train, sample_weight_train)
+
+  model_evals = compute_model_evaluations(best_estimator,
+    best_estimator,
+    random_state,
+    X_train,
+    y_train,
+    X_test,
+    y_test,
+    sample_weight_train=sample_weight_train,
+    sample_weight_test=sample_weight_test,
+    cv_n_jobs=cv_n_jobs)
+
+  return SearchResults(best_estimator=best_estimator,
+    best_score=float(mean_scores[best_idx]),
+    estimator_params=best_params,
+    model_evals=model_evals,
+    refit="ndcg")
+
 def bump_version(version: str | None) -> str:
   if (version is None):
     return "0.0.1"
@@ -165,7 +375,20 @@ def bump_version(version: str | None) -> str:
   parts[-1] = str(int(parts[-1]) + 1)
   return ".".join(parts)
 
+# Params of different estimators don't fit each other's pipelines (e.g. kmap__* on the LR pipeline),
+# a params file is only ever overwritten by a search for the estimator it holds
+def check_params_file_estimator(filepath: str, estimator: str):
+  try:
+    with open(filepath, mode="r", encoding="utf-8") as file:
+      old_estimator = json.load(file).get("estimator")
+  except (FileNotFoundError, json.JSONDecodeError):
+    return
+
+  if old_estimator not in (None, estimator):
+    raise ValueError(f"{filepath} holds {old_estimator} params, {estimator} params can't be saved there")
+
 def save_hyperparams_to_file(filepath:str, params: ModelParams):
+  check_params_file_estimator(filepath, params.estimator)
   try:
     with open(filepath, mode="r", encoding="utf-8") as file:
       old = json.load(file)
@@ -0,0 +1,241 @@
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List
+import cProfile
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT_BYTES = 1 if sys.platform == "darwin" else 1024
+
+# Process high-water mark. resource is Unix only and data_loader imports this module, so it's imported
+# here: on Windows RSS isn't measured and reported as 0.
+def _peak_rss_mb() -> float:
+  try:
+    import resource
+  except ImportError:
+    return 0.0
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT_BYTES / 2**20
+
+# One timed stage of a run, e.g. "expansion" or "fit". counts holds the sizes the stage worked on
+# (rows, features, candidates, ...), set by the instrumented code through count().
+# peak_rss_mb is the process high-water mark at the end of the span, rss_growth_mb how much the span
+# raised it. tracemalloc_peak_mb is only measured when memory tracing is on (it slows Python code down).
+@dataclass
+class Span:
+  name: str
+  depth: int = 0
+  parent: str | None = None
+  wall_seconds: float = 0.0
+  cpu_seconds: float = 0.0
+  peak_rss_mb: float = 0.0
+  rss_growth_mb: float = 0.0
+  tracemalloc_peak_mb: float | None = None
+  profile_path: str | None = None
+  counts: Dict[str, int] = field(default_factory=dict)
+
+  def count(self, **counts: Any):
+    self.counts.update({name: int(value) for name, value in counts.items()})
+
+# Collects spans of one trainer run into a JSON report. With profile_dir set, every outermost
+# profiled span also gets a cProfile dump (<index>_<name>.prof, open with pstats or snakeviz) and
+# tracemalloc peaks are measured. cProfile can't nest, so stages inside a profiled stage show up
+# in its dump instead of getting their own.
+class RunProfiler:
+  def __init__(self, profile_dir: str | None = None, trace_memory: bool | None = None):
+    self.profile_dir = Path(profile_dir) if profile_dir is not None else None
+    self.trace_memory = self.profile_dir is not None if trace_memory is None else trace_memory
+    self.spans: List[Span] = []
+    self._stack: List[Span] = []
+    # running tracemalloc peak of every open span, tracemalloc itself only has one peak counter
+    self._memory_peaks: List[int] = []
+    self._profiling = False
+    self._started = time.perf_counter()
+    self._started_cpu = time.process_time()
+
+  @contextmanager
+  def span(self, name: str, **counts: Any) -> Iterator[Span]:
+    parent = self._stack[-1] if self._stack else None
+    record = Span(name=name, depth=len(self._stack), parent=parent.name if parent else None)
+    record.count(**counts)
+    self.spans.append(record)
+    self._stack.append(record)
+
+    profiler = None
+    if self.profile_dir is not None and not self._profiling:
+      self.profile_dir.mkdir(parents=True, exist_ok=True)
+      record.profile_path = str(self.profile_dir / f"{len(self.spans):02d}_{name}.prof")
+      profiler = cProfile.Profile()
+      self._profiling = True
+
+    if self.trace_memory:
+      if not tracemalloc.is_tracing():
+        tracemalloc.start()
+      self.save_memory_peak()
+      tracemalloc.reset_peak()
+      self._memory_peaks.append(0)
+
+    rss_before = _peak_rss_mb()
+    started = time.perf_counter()
+    started_cpu = time.process_time()
+    if profiler is not None:
+      profiler.enable()
+
+    try:
+      yield record
+    finally:
+      if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(record.profile_path)
+        self._profiling = False
+
+      record.wall_seconds = time.perf_counter() - started
+      record.cpu_seconds = time.process_time() - started_cpu
+      record.peak_rss_mb = _peak_rss_mb()
+      record.rss_growth_mb = record.peak_rss_mb - rss_before
+
+      if self.trace_memory:
+        span_peak = max(self._memory_peaks.pop(), tracemalloc.get_traced_memory()[1])
+        record.tracemalloc_peak_mb = span_peak / 2**20
+        if self._memory_peaks:
+          self._memory_peaks[-1] = max(self._memory_peaks[-1], span_peak)
+        tracemalloc.reset_peak()
+
+      self._stack.pop()
+
+  # Fold the tracemalloc peak so far into the innermost open span, before anything resets the peak
+  def save_memory_peak(self):
+    if self._memory_peaks and tracemalloc.is_tracing():
+      self._memory_peaks[-1] = max(self._memory_peaks[-1], tracemalloc.get_traced_memory()[1])
+
+  # Per stage totals over all spans with the same name, spans nested in a same-named span are not counted twice
+  def summarize_stages(self) -> Dict[str, Dict[str, float]]:
+    stages: Dict[str, Dict[str, float]] = {}
+    for record in self.spans:
+      stage = stages.setdefault(record.name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_rss_mb": 0.0})
+      stage["calls"] += 1
+      if record.parent != record.name:
+        stage["wall_seconds"] += record.wall_seconds
+        stage["cpu_seconds"] += record.cpu_seconds
+      stage["peak_rss_mb"] = max(stage["peak_rss_mb"], record.peak_rss_mb)
+    return stages
+
+  def create_report(self) -> Dict[str, Any]:
+    return {
+      "argv": sys.argv,
+      "python": platform.python_version(),
+      "platform": platform.platform(),
+      "wall_seconds": time.perf_counter() - self._started,
+      "cpu_seconds": time.process_time() - self._started_cpu,
+      "peak_rss_mb": _peak_rss_mb(),
+      "trace_memory": self.trace_memory,
+      "stages": self.summarize_stages(),
+      "spans": [asdict(record) for record in self.spans],
+    }
+
+  def save_report(self, report_path: str) -> Dict[str, Any]:
+    report = self.create_report()
+    Path(report_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+      json.dump(report, f, indent=2)
+
+    print(f"Run report saved to {report_path}")
+    for name, stage in report["stages"].items():
+      print(f"  {name:>14}: {stage['wall_seconds']:8.2f}s wall {stage['cpu_seconds']:8.2f}s cpu ({stage['calls']} calls)")
+
+    return report
+
+_active_profiler: RunProfiler | None = None
+
+def start_run_profiler(profile_dir: str | None = None, trace_memory: bool | None = None) -> RunProfiler:
+  global _active_profiler
+  _active_profiler = RunProfiler(profile_dir, trace_memory)
+  return _active_profiler
+
+def stop_run_profiler() -> RunProfiler | None:
+  global _active_profiler
+  profiler, _active_profiler = _active_profiler, None
+  if profiler is not None and profiler.trace_memory and tracemalloc.is_tracing():
+    tracemalloc.stop()
+  return profiler
+
+# Time a stage of the active run profiler. Without one (the default) the span is a detached
+# record nobody reads, so instrumented code costs next to nothing.
+@contextmanager
+def span(name: str, **counts: Any) -> Iterator[Span]:
+  if _active_profiler is None:
+    yield Span(name=name)
+    return
+
+  with _active_profiler.span(name, **counts) as record:
+    yield record
+
+@dataclass
+class MemoryPeak:
+  peak_bytes: int = 0
+
+# tracemalloc peak of a block, above the memory already traced when it started. Tracing is started and
+# stopped around the block unless it's on already (e.g. --profile), then it's left on and the open
+# span's peak is saved before the peak is reset for the block.
+@contextmanager
+def measure_memory_peak() -> Iterator[MemoryPeak]:
+  was_tracing = tracemalloc.is_tracing()
+  if not was_tracing:
+    tracemalloc.start()
+  elif _active_profiler is not None:
+    _active_profiler.save_memory_peak()
+
+  traced_before = tracemalloc.get_traced_memory()[0]
+  tracemalloc.reset_peak()
+  record = MemoryPeak()
+  try:
+    yield record
+  finally:
+    record.peak_bytes = tracemalloc.get_traced_memory()[1] - traced_before
+    if not was_tracing:
+      tracemalloc.stop()
+
+# Decorator form of span for functions that are a whole stage
+def profiled(name: str) -> Callable[[Callable], Callable]:
+  def decorate(func: Callable) -> Callable:
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+      with span(name):
+        return func(*args, **kwargs)
+    return wrapper
+  return decorate
+
+# Cumulative import time in seconds of every module imported by "import <module>" in a fresh interpreter,
+# from python -X importtime. Modules already imported by the interpreter at startup aren't listed.
+def measure_import_times(module: str) -> Dict[str, float]:
+  completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+    cwd=str(Path(__file__).parent),
+    capture_output=True,
+    text=True,
+    check=True)
+
+  import_times: Dict[str, float] = {}
+  for line in completed.stderr.splitlines():
+    if not line.startswith("import time:") or "cumulative" in line:
+      continue
+    _, cumulative_us, name = line[len("import time:"):].split("|")
+    import_times.setdefault(name.strip(), int(cumulative_us) / 1e6)
+
+  return import_times
+
+# Print the slowest imports of "import <module>", e.g. python instrumentation.py trainer
+def benchmark_import_time(module: str, top: int = 15) -> Dict[str, float]:
+  import_times = measure_import_times(module)
+  print(f"import {module}: {import_times[module]:.3f}s")
+  for name, seconds in sorted(import_times.items(), key=lambda item: -item[1])[:top]:
+    print(f"  {seconds:8.3f}s  {name}")
+  return import_times
+
+if __name__ == "__main__":
+  benchmark_import_time(sys.argv[1] if len(sys.argv) > 1 else "trainer")
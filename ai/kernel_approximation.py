@@ -0,0 +1,139 @@
+from numbers import Real
+from typing import Any, Dict
+import numpy as np
+from scipy.linalg import svd
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.metrics.pairwise import pairwise_kernels
+
+# skl2onnx has no converters for sklearn's kernel approximations, these export the two explicit
+# feature maps create_kernel_svm_pipeline uses. Both are a few dense MatMuls on the tf-idf output:
+#   Nystroem:   kernel(X, components_) @ normalization_.T
+#   RBFSampler: cos(X @ random_weights_ + random_offset_) * sqrt(2 / n_components)
+# onnx and skl2onnx are imported by the converters only, fitting a pipeline doesn't need them.
+
+# Nystroem kernels we can export, with pairwise_kernels defaults for params left unset
+# (gamma None means 1 / n_features there)
+NYSTROEM_KERNEL_DEFAULTS: Dict[str, Dict[str, Any]] = {
+  "linear": {},
+  "rbf": {"gamma": None},
+  "poly": {"gamma": None, "degree": 3, "coef0": 1},
+  "polynomial": {"gamma": None, "degree": 3, "coef0": 1},
+  "sigmoid": {"gamma": None, "coef0": 1},
+}
+
+# Nystroem that leaves out the eigen directions of the landmark kernel below rcond * largest eigenvalue.
+# Expanded training rows repeat, so landmarks sampled from them often do too and the landmark kernel
+# is singular: Nystroem then scales its null space by up to 1e6 (1 / sqrt(1e-12)). Kernel rows of
+# any query are orthogonal to that null space, so sklearn's float64 features don't change without it,
+# but the float32 ONNX model turns rounding errors into probability differences of 0.3 and more.
+class TruncatedNystroem(Nystroem):
+  _parameter_constraints: dict = {**Nystroem._parameter_constraints, "rcond": [Real]}
+
+  def __init__(self,
+    kernel="rbf",
+    *,
+    gamma=None,
+    coef0=None,
+    degree=None,
+    kernel_params=None,
+    n_components=100,
+    random_state=None,
+    n_jobs=None,
+    rcond=1e-5):
+    super().__init__(kernel=kernel,
+      gamma=gamma,
+      coef0=coef0,
+      degree=degree,
+      kernel_params=kernel_params,
+      n_components=n_components,
+      random_state=random_state,
+      n_jobs=n_jobs)
+    self.rcond = rcond
+
+  def fit(self, X, y=None):
+    super().fit(X, y)
+    basis_kernel = pairwise_kernels(self.components_,
+      metric=self.kernel,
+      filter_params=True,
+      n_jobs=self.n_jobs,
+      **self._get_kernel_params())
+    U, S, V = svd(basis_kernel)
+    kept = S > S[0] * self.rcond
+    self.normalization_ = np.dot(U[:, kept] / np.sqrt(S[kept]), V[kept])
+    return self
+
+def calculate_kernel_map_output_shapes(operator):
+  from skl2onnx.common.data_types import FloatTensorType
+  from skl2onnx.common.utils import check_input_and_output_numbers
+
+  check_input_and_output_numbers(operator, input_count_range=1, output_count_range=1)
+  n_components = operator.raw_operator.n_components
+  if isinstance(operator.raw_operator, Nystroem):
+    n_components = operator.raw_operator.components_.shape[0]
+  operator.outputs[0].type = FloatTensorType([operator.inputs[0].get_first_dimension(), n_components])
+
+# Kernel params Nystroem.transform passes to pairwise_kernels, with their defaults filled in
+def get_nystroem_kernel_params(nystroem: Nystroem) -> Dict[str, Any]:
+  if not isinstance(nystroem.kernel, str) or nystroem.kernel not in NYSTROEM_KERNEL_DEFAULTS:
+    raise ValueError(f"Nystroem kernel {nystroem.kernel!r} can't be exported to ONNX, use one of {sorted(NYSTROEM_KERNEL_DEFAULTS)}")
+
+  params = {**NYSTROEM_KERNEL_DEFAULTS[nystroem.kernel], **nystroem._get_kernel_params()}
+  if "gamma" in params and params["gamma"] is None:
+    params["gamma"] = 1.0 / nystroem.components_.shape[1]
+  return params
+
+def _add_constant(scope, container, name: str, value: Any) -> str:
+  from onnx import TensorProto
+
+  value = np.asarray(value, dtype=np.float32)
+  constant_name = scope.get_unique_variable_name(name)
+  container.add_initializer(constant_name, TensorProto.FLOAT, list(value.shape), value.ravel().tolist())
+  return constant_name
+
+def _add_node(scope, container, op_type: str, inputs, name: str) -> str:
+  output = scope.get_unique_variable_name(name)
+  container.add_node(op_type, inputs, [output], name=scope.get_unique_operator_name(op_type))
+  return output
+
+def convert_nystroem(scope, operator, container):
+  nystroem: Nystroem = operator.raw_operator
+  params = get_nystroem_kernel_params(nystroem)
+  X = operator.inputs[0].full_name
+
+  components = nystroem.components_
+  components = components.toarray() if hasattr(components, "toarray") else np.asarray(components)
+  dot = _add_node(scope, container, "MatMul", [X, _add_constant(scope, container, "nystroem_components", components.T)], "nystroem_dot")
+
+  if nystroem.kernel == "rbf":
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, row norms of X through a MatMul with ones so no opset specific ReduceSumSquare
+    squares = _add_node(scope, container, "Mul", [X, X], "nystroem_squares")
+    x_norms = _add_node(scope, container, "MatMul", [squares, _add_constant(scope, container, "nystroem_ones", np.ones((components.shape[1], 1)))], "nystroem_x_norms")
+    minus_two_dot = _add_node(scope, container, "Mul", [dot, _add_constant(scope, container, "nystroem_minus_two", -2.0)], "nystroem_minus_two_dot")
+    distances = _add_node(scope, container, "Add", [minus_two_dot, x_norms], "nystroem_partial_distances")
+    distances = _add_node(scope, container, "Add", [distances, _add_constant(scope, container, "nystroem_c_norms", (components**2).sum(axis=1)[None, :])], "nystroem_distances")
+    # rounding can make distances of near identical rows slightly negative, rbf_kernel clips them too
+    distances = _add_node(scope, container, "Max", [distances, _add_constant(scope, container, "nystroem_zero", 0.0)], "nystroem_clipped_distances")
+    scaled = _add_node(scope, container, "Mul", [distances, _add_constant(scope, container, "nystroem_minus_gamma", -params["gamma"])], "nystroem_scaled")
+    kernel = _add_node(scope, container, "Exp", [scaled], "nystroem_kernel")
+  elif nystroem.kernel == "linear":
+    kernel = dot
+  else:
+    scaled = _add_node(scope, container, "Mul", [dot, _add_constant(scope, container, "nystroem_gamma", params["gamma"])], "nystroem_scaled")
+    shifted = _add_node(scope, container, "Add", [scaled, _add_constant(scope, container, "nystroem_coef0", params["coef0"])], "nystroem_shifted")
+    if nystroem.kernel == "sigmoid":
+      kernel = _add_node(scope, container, "Tanh", [shifted], "nystroem_kernel")
+    else:
+      kernel = _add_node(scope, container, "Pow", [shifted, _add_constant(scope, container, "nystroem_degree", params["degree"])], "nystroem_kernel")
+
+  normalization = _add_constant(scope, container, "nystroem_normalization", nystroem.normalization_.T)
+  container.add_node("MatMul", [kernel, normalization], [operator.outputs[0].full_name], name=scope.get_unique_operator_name("MatMul"))
+
+def convert_rbf_sampler(scope, operator, container):
+  sampler: RBFSampler = operator.raw_operator
+  X = operator.inputs[0].full_name
+
+  projection = _add_node(scope, container, "MatMul", [X, _add_constant(scope, container, "rbf_weights", sampler.random_weights_)], "rbf_projection")
+  projection = _add_node(scope, container, "Add", [projection, _add_constant(scope, container, "rbf_offset", sampler.random_offset_)], "rbf_shifted")
+  cosine = _add_node(scope, container, "Cos", [projection], "rbf_cosine")
+  scale = _add_constant(scope, container, "rbf_scale", (2.0 / sampler.n_components) ** 0.5)
+  container.add_node("Mul", [cosine, scale], [operator.outputs[0].full_name], name=scope.get_unique_operator_name("Mul"))
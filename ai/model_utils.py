@@ -1,51 +1,435 @@
-import pandas as pd
-from skl2onnx import to_onnx
-from skl2onnx.common.data_types import StringTensorType
-from sklearn.calibration import label_binarize
-from sklearn.metrics import ndcg_score
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Sequence, Tuple
+import json
+import subprocess
+import sys
+import time
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
 from sklearn.model_selection import GridSearchCV
+from sklearn import clone
 from sklearn.pipeline import Pipeline
 
-from pipeline_factory import CLF_STEP
+from hashing_vectorizer import HashingTfidfVectorizer, convert_hashed_pipeline_to_onnx
+from instrumentation import profiled, span
+from numpy_inference import NumpyPlateRanker, compare_rankings, top_k_indices
+from pipeline_factory import CLF_STEP, KERNEL_STEP, VEC_STEP, create_fit_params, register_onnx_converters
 
-# Print query predictions against trained model
-def print_top_k(query_text: str, estimator: Pipeline, top_k: int = 5):
-  labels = estimator.named_steps[CLF_STEP].classes_
+# onnx, skl2onnx and the ONNX optimizer are imported by the export functions only
+if TYPE_CHECKING:
+  import onnx
+  from onnx_optimizer import OnnxOptimizationReport, Quantization
 
-  raw_probs = estimator.predict_proba([query_text])[0]
-  
-  probabilities = (
-    pd.DataFrame({"label": labels, "probability": raw_probs})
-      .sort_values("probability", ascending=False)
-      .reset_index(drop=True)
-  )
+# Rank a batch of queries with a single vectorize + predict_proba call.
+# Returns (n_queries, k) arrays of top labels and their probabilities, best first.
+def rank_queries(queries: List[str], estimator: Pipeline, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+  proba = estimator.predict_proba(list(queries))
+  top = top_k_indices(proba, k)
+  return estimator.classes_[top], np.take_along_axis(proba, top, axis=1)
 
-  print(f"== \"{query_text}\" ==")
-  print(probabilities.head(top_k))
+# Same as rank_queries, as one record per query
+def rank_queries_to_records(queries: List[str], estimator: Pipeline, k: int = 5) -> List[Dict[str, Any]]:
+  labels, probabilities = rank_queries(queries, estimator, k)
+  return [
+    {"query": query, "labels": query_labels.tolist(), "probabilities": query_probabilities.tolist()}
+    for query, query_labels, query_probabilities in zip(queries, labels, probabilities)
+  ]
 
+# Print query predictions against trained model. queries maps query text to number of plates to show.
+def print_top_k(queries: Dict[str, int], estimator: Pipeline):
+  labels, probabilities = rank_queries(list(queries), estimator, max(queries.values()))
 
-def export_to_onnx(estimator: Pipeline, export_path: str):
-  print(f"Exporting estimator to {export_path}...")
+  for (query_text, top_k), query_labels, query_probabilities in zip(queries.items(), labels, probabilities):
+    print(f"== \"{query_text}\" ==")
+    for rank, (label, probability) in enumerate(zip(query_labels[:top_k], query_probabilities[:top_k])):
+      print(f"{rank}  {label}  {probability:.6f}")
+
+
+# Same as estimator.fit(X, y, **create_fit_params(sample_weight)), with the vectorizer and the classifier
+# fitted one after the other so the run profiler can time them as separate stages.
+def fit_pipeline(estimator: Pipeline, X: Any, y: Any, sample_weight: Any = None) -> Pipeline:
+  with span("vectorization", rows=len(X)) as vectorization_span:
+    features = estimator[:-1].fit_transform(X, y)
+    vectorization_span.count(features=features.shape[1])
+
+  with span("fit", rows=features.shape[0], features=features.shape[1]) as fit_span:
+    fit_params = {name.split("__", 1)[1]: value for name, value in create_fit_params(sample_weight).items()}
+    estimator.steps[-1][1].fit(features, y, **fit_params)
+    fit_span.count(classes=len(estimator.classes_))
+
+  return estimator
+
+# Convert a fitted text pipeline to an ONNX graph with string input "text".
+# locale sets the StringNormalizer locale, onnxruntime defaults to en_US which isn't installed everywhere.
+def convert_to_onnx(estimator: Pipeline, locale: str | None = None) -> "onnx.ModelProto":
+  if isinstance(estimator.named_steps[VEC_STEP], HashingTfidfVectorizer):
+    # takes hashed token buckets instead of text, no StringNormalizer/locale involved
+    return convert_hashed_pipeline_to_onnx(estimator)
+
+  from skl2onnx import to_onnx
+  from skl2onnx.common.data_types import StringTensorType
+  from canonical_vectorizer import CanonicalTfidfVectorizer, add_synonyms_to_onnx_tfidf
+
+  register_onnx_converters()
 
-  onnx = to_onnx(
+  options: Dict[int, Dict[str, Any]] = {
+    # zipmap is not well supported in onnxruntime-web
+    id(estimator.named_steps[CLF_STEP]): {"zipmap": False, "output_class_labels": True}
+  }
+  if locale is not None:
+    options[id(estimator.named_steps[VEC_STEP])] = {"locale": locale}
+
+  onnx_model = to_onnx(
     estimator,
     # define inference input for onnxruntime
     initial_types=[("text", StringTensorType([None, 1]))],
-    options={
-      # zipmap is not well supported in onnxruntime-web
-      id(estimator.named_steps[CLF_STEP]): {"zipmap": False, "output_class_labels": True}
-    }
+    options=options
   )
 
-  with open(export_path, "wb") as f:
-    f.write(onnx.SerializeToString())
+  if isinstance(estimator.named_steps[VEC_STEP], CanonicalTfidfVectorizer):
+    add_synonyms_to_onnx_tfidf(onnx_model, estimator.named_steps[VEC_STEP])
+
+  return onnx_model
+
+# Export the full probability model to export_path.
+# When optimized_export_path is set, a smaller serving variant (see onnx_optimizer.optimize_onnx_model)
+# is written there as well, and compared against the full model on X_eval/y_eval if given.
+def export_to_onnx(estimator: Pipeline,
+  export_path: str,
+  locale: str | None = None,
+  optimized_export_path: str | None = None,
+  top_k: int = 10,
+  prune_threshold: float = 0.0,
+  quantization: "Quantization" = "float32",
+  X_eval: List[str] | None = None,
+  y_eval: List[str] | None = None) -> "OnnxOptimizationReport | None":
+  print(f"Exporting estimator to {export_path}...")
+
+  with span("export") as export_span:
+    onnx_model = convert_to_onnx(estimator, locale)
+    baseline_bytes = onnx_model.SerializeToString()
+
+    with open(export_path, "wb") as f:
+      f.write(baseline_bytes)
+    export_span.count(onnx_bytes=len(baseline_bytes))
 
   print("Exported to ONNX successfully")
 
+  if optimized_export_path is None:
+    return None
+
+  if isinstance(estimator.named_steps[VEC_STEP], HashingTfidfVectorizer):
+    raise ValueError("Optimized ONNX export needs the vocabulary vectorizer, hashed models are already vocabulary-free")
+
+  from onnx_optimizer import compare_onnx_models, optimize_onnx_model
+
+  print(f"Exporting optimized estimator to {optimized_export_path}...")
+  with span("export") as export_span:
+    optimized_model, report = optimize_onnx_model(onnx_model, top_k=top_k, prune_threshold=prune_threshold, quantization=quantization)
+    optimized_bytes = optimized_model.SerializeToString()
+
+    with open(optimized_export_path, "wb") as f:
+      f.write(optimized_bytes)
+    export_span.count(onnx_bytes=len(optimized_bytes))
+
+  report.baseline_bytes = len(baseline_bytes)
+  report.optimized_bytes = len(optimized_bytes)
+  if X_eval is not None and y_eval is not None:
+    compare_onnx_models(report, baseline_bytes, optimized_bytes, list(X_eval), list(y_eval))
+
+  report.print()
+  return report
+
+# Names of metrics produced by make_fused_scorer. Higher is better for all of them.
+FUSED_METRICS = ["accuracy", "neg_log_loss", "roc_auc", "ndcg"]
+
+# Derive all evaluation metrics from a single probability matrix
+# (columns ordered as classes) instead of running inference once per metric.
+def compute_proba_metrics(y_true: Any,
+  proba: np.ndarray,
+  classes: np.ndarray,
+  ndcg_k: int = 10,
+  sample_weight: Any = None) -> Dict[str, float]:
+  y_true = np.asarray(y_true)
+  y_pred = classes[proba.argmax(axis=1)]
+
+  return {
+    "accuracy": float(accuracy_score(y_true, y_pred, sample_weight=sample_weight)),
+    "neg_log_loss": -float(log_loss(y_true, proba, labels=classes, sample_weight=sample_weight)),
+    "roc_auc": float(roc_auc_score(y_true, proba, multi_class="ovr", labels=classes, sample_weight=sample_weight)),
+    "ndcg": ndcg_at_k(labels_to_indices(y_true, classes), proba, k=ndcg_k, sample_weight=sample_weight),
+  }
+
+# Multi-metric scorer for cross_validate/GridSearchCV that calls predict_proba once per split
+# and computes accuracy, log loss, OvR ROC AUC and NDCG@k from the same matrix.
+# Fold scores are unweighted: cross_validate and the searches only route sample_weight to fit,
+# scorers would need sklearn metadata routing. Holdout metrics are weighted (compute_model_evaluations),
+# searches would select params for a different objective than weighted fits, so trainer rejects
+# --dedup-rows with --use-search.
+def make_fused_scorer(k=10):
+  def _scorer(estimator, X, y):
+    proba = estimator.predict_proba(X)
+    return compute_proba_metrics(y, proba, estimator.classes_, ndcg_k=k)
+  return _scorer
+
+# Raise ValueError unless the estimator is a vocabulary vectorizer followed directly by a multinomial
+# linear classifier (LogisticRegression, SoftmaxSGDClassifier), the only pipelines whose weights the
+# npz rankers and the synthetic label benchmark can use
+def check_npz_exportable(estimator: Pipeline):
+  vec = estimator.named_steps[VEC_STEP]
+  clf = estimator.named_steps[CLF_STEP]
+
+  if KERNEL_STEP in estimator.named_steps:
+    raise ValueError("Kernel feature map pipelines aren't linear in the vectorizer features and can't be exported to npz")
+
+  if not hasattr(clf, "coef_") or clf.coef_.shape[0] != len(clf.classes_) or getattr(clf, "solver", None) == "liblinear":
+    raise ValueError(f"{clf.__class__.__name__} is not a multinomial linear classifier and can't be exported to npz")
+
+  if isinstance(vec, HashingTfidfVectorizer):
+    raise ValueError("Hashed vectorizers have no vocabulary and can't be exported to npz")
+
+  # skl2onnx is already loaded when vec is one of its vectorizers
+  from canonical_vectorizer import CanonicalTfidfVectorizer
+  if isinstance(vec, CanonicalTfidfVectorizer):
+    raise ValueError("The npz ranker doesn't canonicalize synonyms, export canonical vectorizers to ONNX instead")
+
+  if vec.analyzer != "word" or vec.binary or vec.stop_words is not None or vec.strip_accents is not None:
+    raise ValueError("Only word tokenization without stop words, accent stripping or binary tf can be exported to npz")
+
+# Vocabulary, idf and linear model weights of the estimator as the arrays of export_to_npz,
+# also accepted by NumpyPlateRanker.from_arrays without a file round trip
+def create_npz_arrays(estimator: Pipeline, dtype: Any = np.float32) -> Dict[str, np.ndarray]:
+  check_npz_exportable(estimator)
+  vec = estimator.named_steps[VEC_STEP]
+  clf = estimator.named_steps[CLF_STEP]
+
+  # TraceableTfidfVectorizer keys vocabulary by token tuples, e.g. ("white", "plate")
+  vocabulary = np.empty(len(vec.vocabulary_), dtype=object)
+  for token, idx in vec.vocabulary_.items():
+    vocabulary[idx] = " ".join(token) if isinstance(token, tuple) else token
+
+  return dict(vocabulary=vocabulary.astype(str),
+    idf=vec.idf_.astype(dtype) if vec.use_idf else np.array([], dtype=dtype),
+    coef=clf.coef_.astype(dtype),
+    intercept=clf.intercept_.astype(dtype),
+    classes=clf.classes_.astype(str),
+    token_pattern=np.array(vec.token_pattern),
+    lowercase=np.array(vec.lowercase),
+    ngram_range=np.array(vec.ngram_range),
+    sublinear_tf=np.array(vec.sublinear_tf),
+    norm=np.array(vec.norm or ""))
+
+# Export vocabulary, idf and linear model weights into a compact .npz file
+# for numpy_inference.NumpyPlateRanker (no sklearn/onnxruntime needed at serving time).
+@profiled("export")
+def export_to_npz(estimator: Pipeline, export_path: str, dtype: Any = np.float32):
+  print(f"Exporting estimator to {export_path}...")
+
+  np.savez_compressed(export_path, **create_npz_arrays(estimator, dtype))
+
+  print(f"Exported to npz successfully ({Path(export_path).stat().st_size} bytes)")
+
+# Compare cold start (imports + model load in a fresh interpreter) and per-query latency
+# of the numpy ranker against the sklearn Pipeline it was exported from.
+def benchmark_npz_inference(estimator: Pipeline, npz_path: str, queries: List[str], repeats: int = 200) -> Dict[str, float]:
+  module_dir = str(Path(__file__).parent)
+  cold_start_scripts = {
+    "numpy": (
+      "import time; started = time.perf_counter();"
+      "from numpy_inference import NumpyPlateRanker, top_k_indices;"
+      f"NumpyPlateRanker.load({str(npz_path)!r});"
+      "print(time.perf_counter() - started)"
+    ),
+    "sklearn": (
+      "import time; started = time.perf_counter();"
+      "import sklearn.pipeline, sklearn.linear_model, sklearn.feature_extraction.text, skl2onnx.sklapi;"
+      "print(time.perf_counter() - started)"
+    ),
+  }
+
+  results: Dict[str, float] = {}
+  for name, script in cold_start_scripts.items():
+    completed = subprocess.run([sys.executable, "-c", script], cwd=module_dir, capture_output=True, text=True, check=True)
+    results[f"{name}_cold_start_ms"] = float(completed.stdout.strip()) * 1000
+
+  ranker = NumpyPlateRanker.load(npz_path)
+  for name, predict_proba in [("numpy", ranker.predict_proba), ("sklearn", estimator.predict_proba)]:
+    latencies = []
+    for _ in range(repeats):
+      for query in queries:
+        started = time.perf_counter()
+        predict_proba([query])
+        latencies.append(time.perf_counter() - started)
+    results[f"{name}_query_p50_us"] = float(np.percentile(latencies, 50) * 1e6)
+
+  print(f"Cold start: numpy {results['numpy_cold_start_ms']:.1f}ms (import + load), sklearn {results['sklearn_cold_start_ms']:.1f}ms (imports only)")
+  print(f"Query latency p50: numpy {results['numpy_query_p50_us']:.1f}us, sklearn {results['sklearn_query_p50_us']:.1f}us")
+
+  return results
+
+# Copy of the fitted LR pipeline with n_labels classes: the first labels keep their weights, every
+# further label gets the weights of an existing one over randomly permuted features and its intercept
+# jittered by 0.01 (so copies don't tie), it has the same weight distribution but its own tokens.
+def create_synthetic_label_pipeline(estimator: Pipeline, n_labels: int, random_state: int = 0) -> Pipeline:
+  check_npz_exportable(estimator)
+  rng = np.random.default_rng(random_state)
+  clf = estimator.named_steps[CLF_STEP]
+  n_classes, n_features = clf.coef_.shape
+
+  sources = np.arange(n_labels) % n_classes
+  coef = clf.coef_[sources]
+  intercept = clf.intercept_[sources]
+  for label in range(n_classes, n_labels):
+    coef[label] = coef[label, rng.permutation(n_features)]
+    intercept[label] += rng.normal(scale=0.01)
+
+  synthetic_clf = clone(clf)
+  synthetic_clf.coef_ = coef
+  synthetic_clf.intercept_ = intercept
+  synthetic_clf.classes_ = np.array([str(clf.classes_[source]) if label < n_classes else f"{clf.classes_[source]}-{label}"
+    for label, source in enumerate(sources)])
+  synthetic_clf.n_features_in_ = n_features
+  return Pipeline(steps=[(VEC_STEP, estimator.named_steps[VEC_STEP]), (CLF_STEP, synthetic_clf)])
+
+def _query_p50_us(rank: Any, queries: Sequence[str], repeats: int) -> float:
+  latencies = []
+  for _ in range(repeats):
+    for query in queries:
+      started = time.perf_counter()
+      rank(query)
+      latencies.append(time.perf_counter() - started)
+  return float(np.percentile(latencies, 50) * 1e6)
+
+# Top k ranking cost as the label set grows from ~50 US states to 10k plates: Pipeline.predict_proba,
+# the dense NumpyPlateRanker and the inverted index (sparse_ranker.InvertedIndexRanker) for each
+# prune threshold, on LR pipelines with synthetic labels (create_synthetic_label_pipeline).
+# Reports single query p50 latency, batch throughput, weight bytes and, for the index, how often its
+# top k matches predict_proba's (ranks whose probabilities differ by less than atol may swap).
+# Writes the report to report_path as JSON when given.
+def benchmark_label_scaling(estimator: Pipeline,
+  queries: Sequence[str],
+  label_counts: Sequence[int] = (50, 100, 500, 1000, 5000, 10000),
+  prune_thresholds: Sequence[float] = (0.0, 0.01),
+  k: int = 10,
+  repeats: int = 3,
+  atol: float = 1e-4,
+  random_state: int = 0,
+  report_path: str | None = None) -> List[Dict[str, Any]]:
+  from sparse_ranker import InvertedIndexRanker
+
+  queries = list(queries)
+  rows: List[Dict[str, Any]] = []
+  for n_labels in label_counts:
+    synthetic = create_synthetic_label_pipeline(estimator, n_labels, random_state)
+    arrays = create_npz_arrays(synthetic, dtype=np.float64)
+    index_rankers = {f"index_{threshold:g}": InvertedIndexRanker.from_arrays(arrays, prune_threshold=threshold) for threshold in prune_thresholds}
+    rankers = {
+      "predict_proba": lambda texts, k: rank_queries(texts, synthetic, k),
+      "dense": NumpyPlateRanker.from_arrays(arrays).rank,
+      **{name: ranker.rank for name, ranker in index_rankers.items()},
+    }
+
+    for name, rank in rankers.items():
+      started = time.perf_counter()
+      rank(queries, k)
+      batch_seconds = time.perf_counter() - started
+
+      row = {
+        "n_labels": n_labels,
+        "ranker": name,
+        "query_p50_us": _query_p50_us(lambda query: rank([query], k), queries, repeats),
+        "batch_queries_per_second": len(queries) / batch_seconds,
+        "weight_bytes": synthetic.named_steps[CLF_STEP].coef_.nbytes,
+      }
+      ranker = index_rankers.get(name)
+      if ranker is not None:
+        labels, probabilities = ranker.rank(queries, k)
+        agreement = compare_rankings(synthetic.predict_proba(queries), synthetic.classes_, labels, probabilities, atol=atol)
+        row.update({
+          "prune_threshold": ranker.prune_threshold,
+          "postings": ranker.n_postings,
+          "weight_bytes": ranker.nbytes,
+          "top_k_agreement": agreement["top_k_agreement"],
+          "top_1_agreement": agreement["top_1_agreement"],
+          "max_probability_error": agreement["max_probability_error"],
+        })
+      rows.append(row)
+
+    baseline = rows[-len(rankers)]["query_p50_us"]
+    print(f"{n_labels:>6} labels: " + ", ".join(
+      f"{row['ranker']} {row['query_p50_us']:.0f}us ({baseline / row['query_p50_us']:.1f}x)"
+      + (f" top-{k} {row['top_k_agreement']:.3f}" if "top_k_agreement" in row else "")
+      for row in rows[-len(rankers):]))
+
+  if report_path is not None:
+    with open(report_path, "w", encoding="utf-8") as f:
+      json.dump({"k": k, "queries": len(queries), "rankers": rows}, f, indent=2)
+
+  return rows
+
 def make_ndcg_scorer(k=10):
   def _scorer(estimator, X, y):
     proba = estimator.predict_proba(X)
-    y_true_bin = label_binarize(y, classes=estimator.classes_)
-    k_eff = min(k, proba.shape[1])
-    return float(ndcg_score(y_true_bin, proba, k=k_eff))
-  return _scorer
\ No newline at end of file
+    return ndcg_at_k(labels_to_indices(y, estimator.classes_), proba, k=k)
+  return _scorer
+
+# Map labels to column indices of a (sorted) classes_ array. Unknown labels map to -1.
+def labels_to_indices(y: Any, classes: np.ndarray) -> np.ndarray:
+  y = np.asarray(y)
+  indices = np.searchsorted(classes, y)
+  indices = np.clip(indices, 0, len(classes) - 1)
+  return np.where(classes[indices] == y, indices, -1)
+
+# NDCG@k without building a one-hot (n_samples x n_classes) relevance matrix.
+# With a single relevant class per row, NDCG@k is 1/log2(rank + 1) when the true class ranks within
+# the top k, so only the number of classes scored above (and tied with) the true class is needed.
+# Ties are averaged the same way as sklearn.metrics.ndcg_score, so results match it exactly.
+# Graded relevance (e.g. "close" states) can be passed as a sparse (n_samples x n_classes) matrix;
+# those rows are ranked with np.argpartition over the top k only (ties broken arbitrarily).
+def ndcg_at_k(y_true_idx: np.ndarray,
+  proba: np.ndarray,
+  k: int = 10,
+  sample_weight: Any = None,
+  relevance: Any = None) -> float:
+  n_samples, n_classes = proba.shape
+  k = min(k, n_classes)
+  discounts = 1.0 / np.log2(np.arange(2, k + 2))
+
+  if relevance is not None:
+    scores = _graded_ndcg_at_k(proba, relevance, k, discounts)
+  else:
+    y_true_idx = np.asarray(y_true_idx)
+    known = y_true_idx >= 0
+    true_scores = proba[np.arange(n_samples), np.where(known, y_true_idx, 0)][:, None]
+    n_above = (proba > true_scores).sum(axis=1)
+    n_tied = (proba == true_scores).sum(axis=1)
+
+    # sum of discounts for positions 1..n (positions past k contribute nothing)
+    cumulative_discounts = np.concatenate([[0.0], np.cumsum(discounts)])
+    dcg = (
+      cumulative_discounts[np.minimum(n_above + n_tied, k)]
+      - cumulative_discounts[np.minimum(n_above, k)]
+    ) / n_tied
+    scores = np.where(known, dcg, 0.0)
+
+  return float(np.average(scores, weights=sample_weight))
+
+def _graded_ndcg_at_k(proba: np.ndarray, relevance: Any, k: int, discounts: np.ndarray) -> np.ndarray:
+  relevance = csr_matrix(relevance, dtype=np.float64)
+  n_samples = proba.shape[0]
+  rows = np.arange(n_samples)[:, None]
+
+  top_k = np.argpartition(-proba, k - 1, axis=1)[:, :k]
+  top_k = np.take_along_axis(top_k, np.argsort(-proba[rows, top_k], axis=1), axis=1)
+  dcg = (relevance[rows, top_k].toarray() * discounts).sum(axis=1)
+
+  scores = np.zeros(n_samples)
+  for row in range(n_samples):
+    gains = relevance.data[relevance.indptr[row]:relevance.indptr[row + 1]]
+    ideal_gains = np.sort(gains)[::-1][:k]
+    idcg = (ideal_gains * discounts[:len(ideal_gains)]).sum()
+    if idcg > 0:
+      scores[row] = dcg[row] / idcg
+
+  return scores
\ No newline at end of file
@@ -0,0 +1,236 @@
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, Iterator, List, Mapping, Tuple
+import argparse
+import json
+import re
+import sys
+import numpy as np
+
+# Column indices of the k highest scores per row, best first.
+# argpartition selects the top k in linear time, only those k get sorted.
+def top_k_indices(proba: np.ndarray, k: int) -> np.ndarray:
+  k = min(k, proba.shape[1])
+  top = np.argpartition(-proba, k - 1, axis=1)[:, :k]
+  order = np.argsort(-np.take_along_axis(proba, top, axis=1), axis=1, kind="stable")
+  return np.take_along_axis(top, order, axis=1)
+
+# Agreement of top k rankings (labels and probabilities, best first) with a reference probability matrix
+# over classes, e.g. an ONNX or float32 model against predict_proba. A rank counts as disagreeing only when
+# its label's reference probability differs from the reference probability at that rank by more than atol,
+# so near ties ordered differently in float32 don't count.
+def compare_rankings(expected_proba: np.ndarray,
+  classes: np.ndarray,
+  labels: np.ndarray,
+  probabilities: np.ndarray,
+  atol: float = 1e-4) -> Dict[str, Any]:
+  k = labels.shape[1]
+  expected_top = top_k_indices(expected_proba, k)
+  expected_probabilities = np.take_along_axis(expected_proba, expected_top, axis=1)
+
+  class_index = {label: idx for idx, label in enumerate(classes)}
+  top = np.vectorize(lambda label: class_index.get(label, -1), otypes=[np.int64])(labels)
+  if (top < 0).any():
+    raise ValueError("Rankings contain labels unknown to the reference classes")
+
+  rank_mismatch = np.abs(np.take_along_axis(expected_proba, top, axis=1) - expected_probabilities) > atol
+  probability_error = np.abs(probabilities - expected_probabilities)
+
+  return {
+    "queries": len(labels),
+    "top_k": k,
+    "top_k_agreement": float(1.0 - rank_mismatch.any(axis=1).mean()),
+    "top_1_agreement": float(1.0 - rank_mismatch[:, 0].mean()),
+    "max_probability_error": float(probability_error.max()),
+    "atol": atol,
+  }
+
+# Lightweight license plate ranker that only depends on numpy.
+# Reproduces TraceableTfidfVectorizer tokenization + tf-idf weighting and the multinomial
+# LogisticRegression softmax from arrays written by model_utils.export_to_npz,
+# so serving doesn't have to import sklearn/skl2onnx or spin up onnxruntime.
+class NumpyPlateRanker:
+  def __init__(self,
+    vocabulary: np.ndarray,
+    idf: np.ndarray | None,
+    coef: np.ndarray,
+    intercept: np.ndarray,
+    classes: np.ndarray,
+    token_pattern: str,
+    lowercase: bool,
+    ngram_range: Tuple[int, int],
+    sublinear_tf: bool,
+    norm: str | None):
+    self.token_index: Dict[str, int] = {str(token): idx for idx, token in enumerate(vocabulary)}
+    self.idf = idf
+    # (n_features, n_classes) so a query only touches rows of its active tokens
+    self.coef_t = np.ascontiguousarray(coef.T)
+    self.intercept = intercept
+    self.classes = classes
+    self.token_regex = re.compile(token_pattern)
+    self.lowercase = lowercase
+    self.ngram_range = ngram_range
+    self.sublinear_tf = sublinear_tf
+    self.norm = norm
+
+  # Ranker from the arrays export_to_npz writes (model_utils.create_npz_arrays), kwargs go to the constructor
+  @classmethod
+  def from_arrays(cls, model: Mapping[str, np.ndarray], **kwargs: Any) -> "NumpyPlateRanker":
+    idf = model["idf"]
+    return cls(vocabulary=model["vocabulary"],
+      idf=idf if idf.size else None,
+      coef=model["coef"],
+      intercept=model["intercept"],
+      classes=model["classes"],
+      token_pattern=str(model["token_pattern"]),
+      lowercase=bool(model["lowercase"]),
+      ngram_range=(int(model["ngram_range"][0]), int(model["ngram_range"][1])),
+      sublinear_tf=bool(model["sublinear_tf"]),
+      norm=str(model["norm"]) or None,
+      **kwargs)
+
+  @classmethod
+  def load(cls, model_path: str, **kwargs: Any) -> "NumpyPlateRanker":
+    with np.load(Path(model_path), allow_pickle=False) as model:
+      return cls.from_arrays(model, **kwargs)
+
+  def tokenize(self, text: str) -> List[str]:
+    if self.lowercase:
+      text = text.lower()
+
+    words = self.token_regex.findall(text)
+    min_n, max_n = self.ngram_range
+    tokens: List[str] = []
+    for n in range(min_n, max_n + 1):
+      tokens.extend(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+
+    return tokens
+
+  # Sparse tf-idf vector of a query as (feature indices, weights)
+  def vectorize(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+    counts: Dict[int, int] = {}
+    for token in self.tokenize(text):
+      idx = self.token_index.get(token)
+      if idx is not None:
+        counts[idx] = counts.get(idx, 0) + 1
+
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=self.intercept.dtype, count=len(counts))
+
+    if self.sublinear_tf:
+      values = np.log(values) + 1
+    if self.idf is not None:
+      values = values * self.idf[indices]
+    if self.norm == "l2" and values.size:
+      values = values / np.sqrt(np.sum(values * values))
+    elif self.norm == "l1" and values.size:
+      values = values / np.sum(np.abs(values))
+
+    return indices, values
+
+  def decision_function(self, texts: List[str]) -> np.ndarray:
+    scores = np.tile(self.intercept, (len(texts), 1))
+    for row, text in enumerate(texts):
+      indices, values = self.vectorize(text)
+      scores[row] += values @ self.coef_t[indices]
+
+    return scores
+
+  def predict_proba(self, texts: List[str]) -> np.ndarray:
+    scores = self.decision_function(texts)
+    scores -= scores.max(axis=1, keepdims=True)
+    np.exp(scores, out=scores)
+    scores /= scores.sum(axis=1, keepdims=True)
+    return scores
+
+  # sklearn-style alias, so the ranker can be used wherever a fitted estimator is expected
+  @property
+  def classes_(self) -> np.ndarray:
+    return self.classes
+
+  # Top k labels and probabilities for a batch of queries as (n_queries, k) arrays
+  def rank(self, texts: List[str], k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+    proba = self.predict_proba(texts)
+    top = top_k_indices(proba, k)
+    return self.classes[top], np.take_along_axis(proba, top, axis=1)
+
+  def top_k(self, text: str, k: int = 5) -> List[Tuple[str, float]]:
+    labels, probabilities = self.rank([text], k)
+    return [(str(label), float(probability)) for label, probability in zip(labels[0], probabilities[0])]
+
+# Read non-empty lines in batches, so arbitrarily large query logs are never fully loaded
+def iter_query_batches(lines: Iterable[str], batch_size: int) -> Iterator[List[str]]:
+  batch: List[str] = []
+  for line in lines:
+    query = line.rstrip("\r\n")
+    if not query.strip():
+      continue
+
+    batch.append(query)
+    if len(batch) >= batch_size:
+      yield batch
+      batch = []
+
+  if batch:
+    yield batch
+
+# Rank streamed queries and write one result per query as tsv (query, label:probability, ...) or jsonl
+def rank_query_stream(ranker: NumpyPlateRanker,
+  lines: Iterable[str],
+  output: IO[str],
+  k: int = 5,
+  batch_size: int = 1024,
+  output_format: str = "tsv") -> int:
+  total_queries = 0
+
+  for batch in iter_query_batches(lines, batch_size):
+    labels, probabilities = ranker.rank(batch, k)
+
+    for query, query_labels, query_probabilities in zip(batch, labels, probabilities):
+      if output_format == "jsonl":
+        output.write(json.dumps({
+          "query": query,
+          "labels": query_labels.tolist(),
+          "probabilities": [round(float(p), 6) for p in query_probabilities]
+        }) + "\n")
+      else:
+        ranked = "\t".join(f"{label}:{probability:.6f}" for label, probability in zip(query_labels, query_probabilities))
+        output.write(f"{query}\t{ranked}\n")
+
+    total_queries += len(batch)
+
+  return total_queries
+
+def parse_args() -> argparse.Namespace:
+  argument_parser = argparse.ArgumentParser(
+    prog="License Plate numpy ranker",
+    description="Rank license plates for search queries using a model exported with export_to_npz. "
+      "Queries are taken from arguments, or streamed line by line from --input (default: stdin)."
+  )
+  argument_parser.add_argument("model_path", help="path to exported .npz model")
+  argument_parser.add_argument("queries", nargs="*", help="search queries (default: read from --input)")
+  argument_parser.add_argument("--input", default="-", help="file with one query per line, - for stdin (default: -)")
+  argument_parser.add_argument("--top-k", type=int, default=5, help="number of plates to return per query")
+  argument_parser.add_argument("--batch-size", type=int, default=1024, help="number of queries scored per batch")
+  argument_parser.add_argument("--format", choices=["tsv", "jsonl"], default="tsv", help="output format (default: tsv)")
+  argument_parser.add_argument("--inverted-index", action="store_true", help="rank with sparse_ranker.InvertedIndexRanker, faster for large label sets")
+  argument_parser.add_argument("--prune-threshold", type=float, default=0.0,
+    help="with --inverted-index, drop weights below this fraction of the largest weight (default: 0, exact ranking)")
+
+  return argument_parser.parse_args()
+
+if __name__ == "__main__":
+  parsed_args = parse_args()
+  if parsed_args.inverted_index:
+    from sparse_ranker import InvertedIndexRanker
+    ranker = InvertedIndexRanker.load(parsed_args.model_path, prune_threshold=parsed_args.prune_threshold)
+  else:
+    ranker = NumpyPlateRanker.load(parsed_args.model_path)
+
+  if parsed_args.queries:
+    query_lines: Iterable[str] = parsed_args.queries
+    rank_query_stream(ranker, query_lines, sys.stdout, parsed_args.top_k, parsed_args.batch_size, parsed_args.format)
+  elif parsed_args.input == "-":
+    rank_query_stream(ranker, sys.stdin, sys.stdout, parsed_args.top_k, parsed_args.batch_size, parsed_args.format)
+  else:
+    with open(parsed_args.input, "r", encoding="utf-8") as query_file:
+      rank_query_stream(ranker, query_file, sys.stdout, parsed_args.top_k, parsed_args.batch_size, parsed_args.format)
@@ -0,0 +1,159 @@
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+import json
+import os
+import time
+import numpy as np
+from sklearn.pipeline import Pipeline
+
+from hashing_vectorizer import create_onnx_inputs
+from numpy_inference import compare_rankings, top_k_indices
+
+BENCHMARK_BATCH_SIZES = (1, 32, 1024)
+
+# Rank texts with an onnxruntime session of either the full probability graph (probabilities + class_labels)
+# or the optimized top-k graph (top_k_labels + top_k_probabilities). Texts of hashed models are hashed
+# into token buckets first.
+# Returns (n_queries, k) arrays of labels and probabilities, best first.
+def run_onnx_ranking(session: Any, texts: Sequence[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+  output_names = [output.name for output in session.get_outputs()]
+  inputs = create_onnx_inputs(session, texts)
+
+  if "top_k_labels" in output_names:
+    labels, probabilities = session.run(["top_k_labels", "top_k_probabilities"], inputs)
+    return np.asarray(labels)[:, :k], np.asarray(probabilities)[:, :k]
+
+  probabilities, class_labels = session.run(["probabilities", "class_labels"], inputs)
+  top = top_k_indices(probabilities, k)
+  return np.asarray(class_labels)[top], np.take_along_axis(probabilities, top, axis=1)
+
+# Compare ONNX rankings against Pipeline.predict_proba (see compare_rankings)
+def check_onnx_parity(estimator: Pipeline,
+  onnx_labels: np.ndarray,
+  onnx_probabilities: np.ndarray,
+  texts: Sequence[str],
+  atol: float = 1e-4) -> Dict[str, Any]:
+  return compare_rankings(estimator.predict_proba(list(texts)), estimator.classes_, onnx_labels, onnx_probabilities, atol)
+
+# Latency of replaying texts through the session in fixed size batches.
+# All batches are replayed in rounds until at least min_batches were timed, so percentiles
+# of large batch sizes aren't computed from a single sample.
+def benchmark_onnx_batches(session: Any, texts: Sequence[str], batch_size: int, k: int, min_batches: int = 20, warmup: int = 3) -> Dict[str, float]:
+  batches = [list(texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)]
+  rounds = -(-min_batches // len(batches))
+
+  for batch in batches[:warmup]:
+    run_onnx_ranking(session, batch, k)
+
+  latencies = []
+  started = time.perf_counter()
+  for _ in range(rounds):
+    for batch in batches:
+      batch_started = time.perf_counter()
+      run_onnx_ranking(session, batch, k)
+      latencies.append(time.perf_counter() - batch_started)
+  elapsed = time.perf_counter() - started
+
+  latencies_ms = np.array(latencies) * 1000
+  return {
+    "batch_size": batch_size,
+    "batches": len(latencies),
+    "p50_ms": float(np.percentile(latencies_ms, 50)),
+    "p95_ms": float(np.percentile(latencies_ms, 95)),
+    "p99_ms": float(np.percentile(latencies_ms, 99)),
+    "queries_per_second": float(rounds * len(texts) / elapsed),
+  }
+
+# Load an exported ONNX model in onnxruntime (CPU), check its rankings against the sklearn estimator
+# and measure latency/throughput for each batch size.
+# With enforce_parity, raises ValueError when top-k agreement or probability error are outside tolerance
+# (lossy variants like quantized models are only measured).
+def benchmark_onnx_model(onnx_path: str,
+  estimator: Pipeline,
+  texts: Sequence[str],
+  k: int = 10,
+  batch_sizes: Sequence[int] = BENCHMARK_BATCH_SIZES,
+  atol: float = 1e-4,
+  min_top_k_agreement: float = 1.0,
+  enforce_parity: bool = True) -> Dict[str, Any]:
+  import onnxruntime as ort
+
+  texts = list(texts)
+  session = ort.InferenceSession(str(onnx_path), providers=["CPUExecutionProvider"])
+  onnx_labels, onnx_probabilities = run_onnx_ranking(session, texts, k)
+  parity = check_onnx_parity(estimator, onnx_labels, onnx_probabilities, texts, atol)
+
+  report = {
+    "model_path": str(onnx_path),
+    "model_bytes": os.path.getsize(onnx_path),
+    "onnxruntime_version": ort.__version__,
+    "parity": parity,
+    "latency": [benchmark_onnx_batches(session, texts, batch_size, k) for batch_size in batch_sizes],
+  }
+
+  if not enforce_parity:
+    return report
+
+  if parity["top_k_agreement"] < min_top_k_agreement:
+    raise ValueError(f"ONNX top-{parity['top_k']} agreement {parity['top_k_agreement']:.4f} is below {min_top_k_agreement:.4f} for {onnx_path}")
+  if parity["max_probability_error"] > atol:
+    raise ValueError(f"ONNX probabilities differ from predict_proba by {parity['max_probability_error']:.2e} (> {atol:.0e}) for {onnx_path}")
+
+  return report
+
+# Regressions of a benchmark report against a previous run: model size growth or slower p95 latency
+# beyond the allowed ratios. Returns human readable failures (empty when within budget).
+def find_benchmark_regressions(report: Dict[str, Any],
+  baseline_report: Dict[str, Any],
+  max_size_ratio: float = 1.1,
+  max_latency_ratio: float = 1.5) -> List[str]:
+  failures = []
+
+  if report["model_bytes"] > baseline_report["model_bytes"] * max_size_ratio:
+    failures.append(f"model size {report['model_bytes']} bytes > {max_size_ratio}x baseline {baseline_report['model_bytes']} bytes")
+
+  baseline_latency = {entry["batch_size"]: entry for entry in baseline_report.get("latency", [])}
+  for entry in report["latency"]:
+    baseline_entry = baseline_latency.get(entry["batch_size"])
+    if baseline_entry is not None and entry["p95_ms"] > baseline_entry["p95_ms"] * max_latency_ratio:
+      failures.append(f"batch {entry['batch_size']} p95 {entry['p95_ms']:.3f}ms > {max_latency_ratio}x baseline {baseline_entry['p95_ms']:.3f}ms")
+
+  return failures
+
+# Print and save benchmark reports of exported ONNX models (name -> benchmark_onnx_model report) as JSON,
+# and fail when a model regressed against the same model in baseline_report_path (skipped when it doesn't exist yet).
+def save_onnx_benchmark_report(model_reports: Dict[str, Dict[str, Any]],
+  report_path: str,
+  baseline_report_path: str | None = None,
+  max_size_ratio: float = 1.1,
+  max_latency_ratio: float = 1.5) -> Dict[str, Any]:
+  report = {"models": model_reports}
+
+  for name, model_report in model_reports.items():
+    parity = model_report["parity"]
+    print(f"ONNX {name}: {model_report['model_bytes']} bytes, {parity['queries']} queries, top-{parity['top_k']} agreement {parity['top_k_agreement']:.4f}, max proba error {parity['max_probability_error']:.2e}")
+    for entry in model_report["latency"]:
+      print(f"  batch {entry['batch_size']:>5}: p50 {entry['p50_ms']:.3f}ms p95 {entry['p95_ms']:.3f}ms p99 {entry['p99_ms']:.3f}ms, {entry['queries_per_second']:.0f} queries/s")
+
+  # read the baseline first, it may be the previous run's report at the same path
+  baseline_report = None
+  if baseline_report_path is not None and os.path.exists(baseline_report_path):
+    with open(Path(baseline_report_path), "r") as f:
+      baseline_report = json.load(f)
+
+  with open(Path(report_path), "w") as f:
+    json.dump(report, f, indent=2)
+
+  print(f"ONNX benchmark report saved to {report_path}")
+
+  if baseline_report is not None:
+    failures = [
+      f"{name}: {failure}"
+      for name, model_report in model_reports.items()
+      if name in baseline_report.get("models", {})
+      for failure in find_benchmark_regressions(model_report, baseline_report["models"][name], max_size_ratio, max_latency_ratio)
+    ]
+    if failures:
+      raise ValueError("ONNX benchmark regressed against baseline:\n" + "\n".join(failures))
+
+  return report
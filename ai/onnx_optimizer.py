@@ -0,0 +1,279 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Literal, Tuple, TypeAlias
+import time
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+Quantization: TypeAlias = Literal["float32", "float16", "int8"]
+
+OPTIMIZED_OUTPUTS = ["label", "top_k_labels", "top_k_probabilities"]
+
+# Nodes that transform tf-idf features element by element.
+# Vocabulary entries can be dropped from TfIdfVectorizer when only these sit between it and the classifier.
+ELEMENTWISE_OPS = {"Identity", "Cast", "Log", "Add", "Mul", "Where", "Abs"}
+
+@dataclass
+class OnnxOptimizationReport:
+  baseline_bytes: int = 0
+  optimized_bytes: int = 0
+  folded_idf: bool = False
+  features_before: int = 0
+  features_after: int = 0
+  zeroed_weights: int = 0
+  quantization: str = "float32"
+  baseline_ndcg: float = 0.0
+  optimized_ndcg: float = 0.0
+  ndcg_delta: float = 0.0
+  baseline_latency_p50_ms: float = 0.0
+  optimized_latency_p50_ms: float = 0.0
+
+  def print(self):
+    print(f"ONNX size: {self.baseline_bytes} -> {self.optimized_bytes} bytes ({self.optimized_bytes / max(self.baseline_bytes, 1):.2%})")
+    print(f"ONNX features: {self.features_before} -> {self.features_after}, zeroed weights: {self.zeroed_weights}, idf folded: {self.folded_idf}, weights: {self.quantization}")
+    print(f"ONNX ndcg: {self.baseline_ndcg:.4f} -> {self.optimized_ndcg:.4f} (delta {self.ndcg_delta:+.4f})")
+    print(f"ONNX latency p50: {self.baseline_latency_p50_ms:.3f}ms -> {self.optimized_latency_p50_ms:.3f}ms")
+
+# Rewrite a skl2onnx text classification graph (TfIdfVectorizer -> [Mul idf] -> LinearClassifier(SOFTMAX))
+# into a smaller serving graph:
+# 1. idf scaling is folded into classifier weights when the Mul feeds the classifier directly (norm=None)
+# 2. weights below prune_threshold * max|weight| are zeroed, and vocabulary entries that end up
+#    with no weight for any class are removed from TfIdfVectorizer
+# 3. LinearClassifier is replaced by MatMul + Add + Softmax over float32/float16/int8 weight initializers
+# 4. outputs are the top-1 label plus top_k labels and probabilities, the full probability vector
+#    is only exposed when include_probabilities is set
+def optimize_onnx_model(model: onnx.ModelProto,
+  top_k: int = 10,
+  prune_threshold: float = 0.0,
+  quantization: Quantization = "float32",
+  include_probabilities: bool = False) -> Tuple[onnx.ModelProto, OnnxOptimizationReport]:
+  model = onnx.ModelProto.FromString(model.SerializeToString())
+  graph = model.graph
+  report = OnnxOptimizationReport(quantization=quantization)
+
+  clf_node = _find_single_node(graph, "LinearClassifier")
+  clf_attrs = {attr.name: helper.get_attribute_value(attr) for attr in clf_node.attribute}
+  if clf_attrs.get("post_transform", b"").decode() != "SOFTMAX":
+    raise ValueError("Only multinomial (softmax) linear classifiers can be optimized")
+
+  classes = np.array([label.decode() for label in clf_attrs["classlabels_strings"]], dtype=object)
+  intercepts = np.asarray(clf_attrs["intercepts"], dtype=np.float32)
+  # LinearClassifier stores coefficients as flattened (n_classes, n_features)
+  weights = np.asarray(clf_attrs["coefficients"], dtype=np.float32).reshape(len(classes), -1).T
+  features = clf_node.input[0]
+  report.features_before = weights.shape[0]
+
+  producers = {output: node for node in graph.node for output in node.output}
+  initializers = {init.name: init for init in graph.initializer}
+
+  # 1. fold idf into weights: W.(x * idf) == (W * idf).x
+  idf_node = producers.get(features)
+  if idf_node is not None and idf_node.op_type == "Mul" and idf_node.input[1] in initializers:
+    idf = numpy_helper.to_array(initializers[idf_node.input[1]]).astype(np.float32).ravel()
+    if idf.shape[0] == weights.shape[0]:
+      weights = weights * idf[:, None]
+      features = idf_node.input[0]
+      report.folded_idf = True
+
+  # 2. prune tiny weights and drop vocabulary entries without any weight left
+  if prune_threshold > 0:
+    small = np.abs(weights) < prune_threshold * np.abs(weights).max()
+    report.zeroed_weights = int(small.sum())
+    weights[small] = 0.0
+
+    tfidf_node = _find_single_node(graph, "TfIdfVectorizer")
+    keep = np.abs(weights).sum(axis=1) > 0
+    if not keep.all() and _is_elementwise_path(producers, initializers, tfidf_node.output[0], features):
+      _prune_tfidf_vocabulary(tfidf_node, keep)
+      weights = weights[keep]
+
+  report.features_after = weights.shape[0]
+
+  # 3./4. replace classifier head (LinearClassifier and the Normalizer applied to its probabilities)
+  replaced_outputs = set(clf_node.output)
+  kept_nodes = [
+    node for node in graph.node
+    if not replaced_outputs.intersection(node.output)
+      and not (node.op_type == "Normalizer" and node.input[0] in replaced_outputs)
+  ]
+  del graph.node[:]
+  graph.node.extend(kept_nodes)
+  graph.node.extend(_create_classifier_head(graph, features, weights, intercepts, classes, top_k, quantization))
+
+  outputs = [*OPTIMIZED_OUTPUTS, "probabilities"] if include_probabilities else OPTIMIZED_OUTPUTS
+  del graph.output[:]
+  graph.output.extend([
+    helper.make_tensor_value_info("label", TensorProto.STRING, [None]),
+    helper.make_tensor_value_info("top_k_labels", TensorProto.STRING, [None, min(top_k, len(classes))]),
+    helper.make_tensor_value_info("top_k_probabilities", TensorProto.FLOAT, [None, min(top_k, len(classes))]),
+  ])
+  if include_probabilities:
+    graph.output.append(helper.make_tensor_value_info("probabilities", TensorProto.FLOAT, [None, len(classes)]))
+
+  del graph.value_info[:]
+  _remove_dead_nodes(graph, outputs)
+  onnx.checker.check_model(model)
+
+  return model, report
+
+def _find_single_node(graph: onnx.GraphProto, op_type: str) -> onnx.NodeProto:
+  nodes = [node for node in graph.node if node.op_type == op_type]
+  if len(nodes) != 1:
+    raise ValueError(f"Expected exactly one {op_type} node, found {len(nodes)}")
+  return nodes[0]
+
+def _is_elementwise_path(producers: Dict[str, onnx.NodeProto], initializers: Dict[str, Any], source: str, target: str) -> bool:
+  current = target
+  while current != source:
+    node = producers.get(current)
+    if node is None or node.op_type not in ELEMENTWISE_OPS:
+      return False
+    # follow the non-constant input
+    inputs = [name for name in node.input if name and name not in initializers]
+    if len(inputs) != 1:
+      return False
+    current = inputs[0]
+  return True
+
+# Remove n-grams of dropped features from TfIdfVectorizer and renumber the remaining output columns
+def _prune_tfidf_vocabulary(node: onnx.NodeProto, keep: np.ndarray):
+  attrs = {attr.name: helper.get_attribute_value(attr) for attr in node.attribute}
+  pool = list(attrs["pool_strings"])
+  ngram_counts = list(attrs["ngram_counts"])
+  ngram_indexes = list(attrs["ngram_indexes"])
+  pool_weights = list(attrs.get("weights", []))
+  new_index = np.cumsum(keep) - 1
+
+  new_pool: List[bytes] = []
+  new_counts: List[int] = []
+  new_indexes: List[int] = []
+  new_weights: List[float] = []
+  ngram_position = 0
+
+  for gram_length, start in enumerate(ngram_counts, start=1):
+    end = ngram_counts[gram_length] if gram_length < len(ngram_counts) else len(pool)
+    new_counts.append(len(new_pool))
+
+    for offset in range(start, end, gram_length):
+      old_index = ngram_indexes[ngram_position]
+      if keep[old_index]:
+        new_pool.extend(pool[offset:offset + gram_length])
+        new_indexes.append(int(new_index[old_index]))
+        if pool_weights:
+          new_weights.append(pool_weights[ngram_position])
+      ngram_position += 1
+
+  replaced = {"pool_strings": new_pool, "ngram_counts": new_counts, "ngram_indexes": new_indexes}
+  if pool_weights:
+    replaced["weights"] = new_weights
+
+  kept_attrs = [attr for attr in node.attribute if attr.name not in replaced]
+  del node.attribute[:]
+  node.attribute.extend(kept_attrs)
+  node.attribute.extend(helper.make_attribute(name, value) for name, value in replaced.items())
+
+def _create_classifier_head(graph: onnx.GraphProto,
+  features: str,
+  weights: np.ndarray,
+  intercepts: np.ndarray,
+  classes: np.ndarray,
+  top_k: int,
+  quantization: Quantization) -> List[onnx.NodeProto]:
+  nodes: List[onnx.NodeProto] = []
+
+  def add_initializer(name: str, value: np.ndarray):
+    graph.initializer.append(numpy_helper.from_array(value, name=name))
+
+  if quantization == "float16":
+    add_initializer("opt_weights_fp16", weights.astype(np.float16))
+    nodes.append(helper.make_node("Cast", ["opt_weights_fp16"], ["opt_weights"], to=TensorProto.FLOAT, name="opt_weights_cast"))
+  elif quantization == "int8":
+    # symmetric per-class quantization
+    scales = (np.abs(weights).max(axis=0) / 127.0).astype(np.float32)
+    scales[scales == 0] = 1.0
+    add_initializer("opt_weights_int8", np.round(weights / scales).clip(-127, 127).astype(np.int8))
+    add_initializer("opt_weights_scale", scales)
+    add_initializer("opt_weights_zero_point", np.zeros(len(scales), dtype=np.int8))
+    nodes.append(helper.make_node("DequantizeLinear",
+      ["opt_weights_int8", "opt_weights_scale", "opt_weights_zero_point"],
+      ["opt_weights"],
+      axis=1,
+      name="opt_weights_dequantize"))
+  else:
+    add_initializer("opt_weights", weights.astype(np.float32))
+
+  add_initializer("opt_intercepts", intercepts)
+  add_initializer("opt_classes", classes)
+  add_initializer("opt_top_k", np.array([min(top_k, len(classes))], dtype=np.int64))
+
+  nodes.extend([
+    helper.make_node("MatMul", [features, "opt_weights"], ["opt_scores"], name="opt_matmul"),
+    helper.make_node("Add", ["opt_scores", "opt_intercepts"], ["opt_logits"], name="opt_add_intercepts"),
+    helper.make_node("Softmax", ["opt_logits"], ["probabilities"], axis=1, name="opt_softmax"),
+    helper.make_node("ArgMax", ["probabilities"], ["opt_label_index"], axis=1, keepdims=0, name="opt_argmax"),
+    helper.make_node("Gather", ["opt_classes", "opt_label_index"], ["label"], axis=0, name="opt_label"),
+    helper.make_node("TopK", ["probabilities", "opt_top_k"], ["top_k_probabilities", "opt_top_k_indices"], axis=1, name="opt_top_k_node"),
+    helper.make_node("Gather", ["opt_classes", "opt_top_k_indices"], ["top_k_labels"], axis=0, name="opt_top_k_labels"),
+  ])
+
+  return nodes
+
+def _remove_dead_nodes(graph: onnx.GraphProto, outputs: List[str]):
+  required = set(outputs)
+  live_nodes: List[onnx.NodeProto] = []
+
+  for node in reversed(graph.node):
+    if any(output in required for output in node.output):
+      live_nodes.append(node)
+      required.update(name for name in node.input if name)
+
+  del graph.node[:]
+  graph.node.extend(reversed(live_nodes))
+
+  live_initializers = [init for init in graph.initializer if init.name in required]
+  del graph.initializer[:]
+  graph.initializer.extend(live_initializers)
+
+# NDCG@k of an ONNX model on labelled queries and its single query p50 latency under onnxruntime (CPU).
+# Works for both the full probability graph (probabilities + class_labels outputs)
+# and the optimized top-k graph.
+def evaluate_onnx_model(model_bytes: bytes, X: List[str], y: List[str], ndcg_k: int = 10, latency_queries: int = 200) -> Tuple[float, float]:
+  import onnxruntime as ort
+
+  session = ort.InferenceSession(model_bytes, providers=["CPUExecutionProvider"])
+  input_name = session.get_inputs()[0].name
+  output_names = [output.name for output in session.get_outputs()]
+  texts = np.array(list(X), dtype=object).reshape(-1, 1)
+
+  if "top_k_labels" in output_names:
+    ranked_labels = session.run(["top_k_labels"], {input_name: texts})[0]
+  else:
+    probabilities, class_labels = session.run(["probabilities", "class_labels"], {input_name: texts})
+    ranked_labels = np.asarray(class_labels)[np.argsort(-probabilities, axis=1, kind="stable")]
+
+  ranked_labels = ranked_labels[:, :ndcg_k]
+  hits = ranked_labels == np.asarray(list(y), dtype=object)[:, None]
+  discounts = 1.0 / np.log2(np.arange(2, ranked_labels.shape[1] + 2))
+  ndcg = float((hits * discounts).sum(axis=1).mean())
+
+  latencies = []
+  for text in texts[:latency_queries]:
+    started = time.perf_counter()
+    session.run(None, {input_name: text.reshape(1, 1)})
+    latencies.append(time.perf_counter() - started)
+
+  return ndcg, float(np.percentile(latencies, 50) * 1000)
+
+# Fill size, NDCG and latency fields of an optimization report by running both models on holdout data
+def compare_onnx_models(report: OnnxOptimizationReport,
+  baseline_bytes: bytes,
+  optimized_bytes: bytes,
+  X: List[str],
+  y: List[str],
+  ndcg_k: int = 10) -> OnnxOptimizationReport:
+  report.baseline_bytes = len(baseline_bytes)
+  report.optimized_bytes = len(optimized_bytes)
+  report.baseline_ndcg, report.baseline_latency_p50_ms = evaluate_onnx_model(baseline_bytes, X, y, ndcg_k)
+  report.optimized_ndcg, report.optimized_latency_p50_ms = evaluate_onnx_model(optimized_bytes, X, y, ndcg_k)
+  report.ndcg_delta = report.optimized_ndcg - report.baseline_ndcg
+  return report
@@ -1,52 +1,187 @@
-from skl2onnx.sklapi import TraceableTfidfVectorizer # required for ONNX export!
-from skl2onnx import update_registered_converter
-from skl2onnx.shape_calculators.text_vectorizer import calculate_sklearn_text_vectorizer_output_shapes
-from skl2onnx.operator_converters.tfidf_vectoriser import convert_sklearn_tfidf_vectoriser
+from functools import cache
+import numpy as np
 from sklearn.linear_model import LogisticRegression
 from sklearn.pipeline import Pipeline
-from sklearn.svm import SVC
-from sklearn.calibration import CalibratedClassifierCV
+from typing import Any, Dict, List
+from hashing_vectorizer import HashingTfidfVectorizer
+from softmax_classifier import SoftmaxSGDClassifier
 
 VEC_STEP = "vec"
 CLF_STEP = "clf"
+# explicit kernel feature map between vectorizer and classifier, see create_kernel_svm_pipeline
+KERNEL_STEP = "kmap"
 
-def create_vectorizer():
-  # We need to use TraceableTfidfVectorizer from skl2onnx so we can convert
-  # vectorizer to ONNX later. See https://github.com/scikit-learn/scikit-learn/issues/13733
+KERNEL_FEATURE_MAPS = ["nystroem", "rbf-sampler"]
+
+# Feature and weight dtypes pipelines can be trained in, see create_dtype_params
+PIPELINE_DTYPES = {"float64": np.float64, "float32": np.float32}
+
+# lbfgs is only run in float64 by sklearn, it copies float32 features to float64 on every fit.
+# newton-cg solves the same L2 regularized problem on float32 features as they are.
+FLOAT32_SOLVERS = {"lbfgs": "newton-cg"}
+
+# Pipeline.fit params routing per-row training weights to the classifier step.
+# Both LogisticRegression and CalibratedClassifierCV accept sample_weight.
+def create_fit_params(sample_weight: Any = None) -> Dict[str, Any]:
+  if sample_weight is None:
+    return {}
+
+  return {f"{CLF_STEP}__sample_weight": sample_weight}
+
+# Register ONNX converters of the custom estimators used in our pipelines with skl2onnx.
+# Registrations are process-wide, so this runs once, right before the first conversion.
+@cache
+def register_onnx_converters():
+  from skl2onnx import update_registered_converter
+  from skl2onnx.operator_converters.linear_classifier import convert_sklearn_linear_classifier
+  from skl2onnx.operator_converters.tfidf_vectoriser import convert_sklearn_tfidf_vectoriser
+  from skl2onnx.shape_calculators.linear_classifier import calculate_linear_classifier_output_shapes
+  from skl2onnx.shape_calculators.text_vectorizer import calculate_sklearn_text_vectorizer_output_shapes
+  from skl2onnx.sklapi import TraceableTfidfVectorizer
+  from sklearn.kernel_approximation import RBFSampler
+  from canonical_vectorizer import CanonicalTfidfVectorizer
+  from kernel_approximation import TruncatedNystroem, calculate_kernel_map_output_shapes, convert_nystroem, convert_rbf_sampler
+
+  text_vectorizer_options = {
+    "tokenexp": None,
+    "separators": None,
+    "nan": [True, False],
+    "keep_empty_string": [True, False],
+    "locale": None,
+  }
+  for vectorizer_class, alias in [
+    (TraceableTfidfVectorizer, "Skl2onnxTraceableTfidfVectorizer"),
+    (CanonicalTfidfVectorizer, "Skl2onnxCanonicalTfidfVectorizer"),
+  ]:
+    update_registered_converter(
+      vectorizer_class,
+      alias,
+      calculate_sklearn_text_vectorizer_output_shapes,
+      convert_sklearn_tfidf_vectoriser,
+      options=text_vectorizer_options,
+    )
+
+  # coef_/intercept_ of SoftmaxSGDClassifier follow LogisticRegression, so the linear classifier converter applies as is
   update_registered_converter(
-    TraceableTfidfVectorizer,
-    "Skl2onnxTraceableTfidfVectorizer",
-    calculate_sklearn_text_vectorizer_output_shapes,
-    convert_sklearn_tfidf_vectoriser,
+    SoftmaxSGDClassifier,
+    "SoftmaxSGDClassifier",
+    calculate_linear_classifier_output_shapes,
+    convert_sklearn_linear_classifier,
     options={
-      "tokenexp": None,
-      "separators": None,
-      "nan": [True, False],
-      "keep_empty_string": [True, False],
-      "locale": None,
+      "zipmap": [True, False, "columns"],
+      "nocl": [True, False],
+      "output_class_labels": [False, True],
+      "raw_scores": [True, False],
     },
   )
 
+  update_registered_converter(TruncatedNystroem, "TruncatedNystroem", calculate_kernel_map_output_shapes, convert_nystroem)
+  update_registered_converter(RBFSampler, "SklearnRBFSampler", calculate_kernel_map_output_shapes, convert_rbf_sampler)
+
+def create_vectorizer(dtype: Any = np.float64):
+  # We need to use TraceableTfidfVectorizer from skl2onnx so we can convert
+  # vectorizer to ONNX later. See https://github.com/scikit-learn/scikit-learn/issues/13733
+  # Imported here: skl2onnx (and onnx with it) takes about half a second to import,
+  # paths that never build a vocabulary vectorizer shouldn't pay for it.
+  from skl2onnx.sklapi import TraceableTfidfVectorizer
+
   return TraceableTfidfVectorizer(
     lowercase=True,
     token_pattern=r"[a-z0-9-]+", # word tokenization (words only no spaces)
     stop_words=None,
+    sublinear_tf=True,
+    dtype=dtype)
+
+# create_vectorizer that maps synonyms to canonical tokens in sklearn and in the exported ONNX model
+# (see canonical_vectorizer.py), so training rows don't need synonym expansion
+def create_canonical_vectorizer(synonyms: Dict[str, List[str]], dtype: Any = np.float64):
+  from canonical_vectorizer import CanonicalTfidfVectorizer
+
+  return CanonicalTfidfVectorizer(
+    synonyms=synonyms,
+    lowercase=True,
+    token_pattern=r"[a-z0-9-]+",
+    stop_words=None,
+    sublinear_tf=True,
+    dtype=dtype)
+
+# Fixed size alternative to create_vectorizer: tokens are hashed into n_buckets features
+# instead of a vocabulary (see hashing_vectorizer.py)
+def create_hashing_vectorizer(n_buckets: int) -> HashingTfidfVectorizer:
+  return HashingTfidfVectorizer(
+    n_buckets=n_buckets,
+    lowercase=True,
+    token_pattern=r"[a-z0-9-]+",
     sublinear_tf=True)
 
-# Train data set using Logistic Regression
-def create_lr_pipeline() -> Pipeline:
+# Pipeline params, or a search space of them, for a pipeline trained in dtype:
+# with float32 every LogisticRegression solver that would cast features to float64 is swapped
+# for one that keeps them (FLOAT32_SOLVERS), so tuned lbfgs params can be reused as they are.
+def create_dtype_params(params: Dict[str, Any], dtype: Any) -> Dict[str, Any]:
+  solver_param = f"{CLF_STEP}__solver"
+  if np.dtype(dtype) != np.float32 or solver_param not in params:
+    return params
+
+  solvers = params[solver_param]
+  return {
+    **params,
+    solver_param: [FLOAT32_SOLVERS.get(solver, solver) for solver in solvers] if isinstance(solvers, list) else FLOAT32_SOLVERS.get(solvers, solvers),
+  }
+
+# Inverse of create_dtype_params for params found by a search in dtype: the swapped solver goes back to
+# the one float64 runs use (newton-cg -> lbfgs), so saved params load into either dtype.
+def restore_dtype_params(params: Dict[str, Any], dtype: Any) -> Dict[str, Any]:
+  solver_param = f"{CLF_STEP}__solver"
+  if np.dtype(dtype) != np.float32 or solver_param not in params:
+    return params
+
+  original_solvers = {solver: original for original, solver in FLOAT32_SOLVERS.items()}
+  return {**params, solver_param: original_solvers.get(params[solver_param], params[solver_param])}
+
+# Train data set using Logistic Regression.
+# hash_buckets switches the vocabulary vectorizer for a hashing one with that many buckets,
+# canonical_synonyms for one that canonicalizes these synonyms.
+# dtype float32 keeps tf-idf features and LR weights in float32 (half the bytes of the float64 default)
+# through fit, CV and search; set params through create_dtype_params to keep it that way.
+def create_lr_pipeline(hash_buckets: int | None = None,
+  canonical_synonyms: Dict[str, List[str]] | None = None,
+  dtype: Any = np.float64) -> Pipeline:
+  if hash_buckets is not None and canonical_synonyms is not None:
+    raise ValueError("Synonym canonicalization needs the vocabulary vectorizer, it can't be combined with hash_buckets")
+  if hash_buckets is not None and np.dtype(dtype) != np.float64:
+    raise ValueError("The hashing vectorizer only produces float64 features, it can't be combined with dtype")
+
   # see https://scikit-learn.org/stable/modules/generated/sklearn.linear_model.LogisticRegression.html
   clf = LogisticRegression(
     penalty="l2",
+    solver=FLOAT32_SOLVERS["lbfgs"] if np.dtype(dtype) == np.float32 else "lbfgs",
     n_jobs=-1)
 
+  if hash_buckets is not None:
+    vec = create_hashing_vectorizer(hash_buckets)
+  elif canonical_synonyms is not None:
+    vec = create_canonical_vectorizer(canonical_synonyms, dtype=dtype)
+  else:
+    vec = create_vectorizer(dtype=dtype)
+
   return Pipeline(steps=[
-    (VEC_STEP, create_vectorizer()),
+    (VEC_STEP, vec),
     (CLF_STEP, clf)
   ])
 
-def create_svm_pipeline() -> Pipeline:
-  
+# Same model as create_lr_pipeline, trained with minibatch Adam on the sparse tf-idf matrix
+# with early stopping on validation ndcg (see softmax_classifier.py)
+def create_softmax_sgd_pipeline() -> Pipeline:
+  return Pipeline(steps=[
+    (VEC_STEP, create_vectorizer()),
+    (CLF_STEP, SoftmaxSGDClassifier())
+  ])
+
+# libsvm/liblinear fit in float64 whatever the dtype, float32 only halves the features of CV and search folds
+def create_svm_pipeline(dtype: Any = np.float64) -> Pipeline:
+  from sklearn.calibration import CalibratedClassifierCV
+  from sklearn.svm import SVC
+
   clf = CalibratedClassifierCV(
     estimator=SVC(
       cache_size=2048,
@@ -57,7 +192,40 @@ def create_svm_pipeline() -> Pipeline:
   )
 
   return Pipeline(steps=[
-    (VEC_STEP, create_vectorizer()),
+    (VEC_STEP, create_vectorizer(dtype=dtype)),
     (CLF_STEP, clf)
   ])
 
+
+# SVM-family alternative to create_svm_pipeline that stays small enough to serve: the kernel is
+# approximated by an explicit feature_map with n_components features (Nystroem samples training rows
+# as landmarks, RBFSampler uses random Fourier features), followed by one linear SVM and a single
+# sigmoid calibration fitted on its cross validated decision values (ensemble=False).
+# gamma=0.3 suits l2 normalized tf-idf rows (squared distances in [0, 2]), the sklearn default
+# 1 / n_features makes every kernel value close to 1.
+# The exported model is the feature map plus one linear layer instead of an ensemble of
+# support vector sets, see kernel_approximation.py for the ONNX converters.
+def create_kernel_svm_pipeline(feature_map: str = "nystroem", n_components: int = 300, dtype: Any = np.float64) -> Pipeline:
+  from sklearn.calibration import CalibratedClassifierCV
+  from sklearn.kernel_approximation import RBFSampler
+  from sklearn.svm import LinearSVC
+  from kernel_approximation import TruncatedNystroem
+
+  if feature_map == "nystroem":
+    kmap = TruncatedNystroem(kernel="rbf", gamma=0.3, n_components=n_components)
+  elif feature_map == "rbf-sampler":
+    kmap = RBFSampler(gamma=0.3, n_components=n_components)
+  else:
+    raise ValueError(f"Unknown kernel feature map {feature_map}, expected one of {KERNEL_FEATURE_MAPS}")
+
+  clf = CalibratedClassifierCV(
+    estimator=LinearSVC(),
+    method="sigmoid",
+    ensemble=False
+  )
+
+  return Pipeline(steps=[
+    (VEC_STEP, create_vectorizer(dtype=dtype)),
+    (KERNEL_STEP, kmap),
+    (CLF_STEP, clf)
+  ])
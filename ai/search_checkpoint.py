@@ -0,0 +1,188 @@
+from typing import Any, Callable
+import hashlib
+import json
+import sqlite3
+import time
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+
+# Scores of every (candidate, fold, resource) fit of a hyperparam search persisted in SQLite.
+# Rows are keyed by the fit (data hash, candidate params incl. resource, training fold rows)
+# and the scored fold, so an interrupted or repeated search over the same data can skip
+# every fit that was already scored. Safe to use from joblib worker processes:
+# each process opens its own connection, the connection is never pickled.
+class SearchCheckpointStore:
+  def __init__(self, path: str):
+    self.path = path
+    self._connection: sqlite3.Connection | None = None
+
+  def _connect(self) -> sqlite3.Connection:
+    if self._connection is None:
+      self._connection = sqlite3.connect(self.path, timeout=60)
+      self._connection.execute("PRAGMA journal_mode=WAL")
+      self._connection.execute("""
+        CREATE TABLE IF NOT EXISTS search_scores (
+          fit_key TEXT NOT NULL,
+          score_key TEXT NOT NULL,
+          data_key TEXT NOT NULL,
+          params TEXT NOT NULL,
+          scores TEXT NOT NULL,
+          created REAL NOT NULL,
+          PRIMARY KEY (fit_key, score_key)
+        )""")
+      self._connection.commit()
+    return self._connection
+
+  def __getstate__(self):
+    return {"path": self.path}
+
+  def __setstate__(self, state):
+    self.path = state["path"]
+    self._connection = None
+
+  def has_fit(self, fit_key: str) -> bool:
+    row = self._connect().execute("SELECT 1 FROM search_scores WHERE fit_key = ? LIMIT 1", (fit_key,)).fetchone()
+    return row is not None
+
+  def get_scores(self, fit_key: str, score_key: str) -> Any:
+    row = self._connect().execute(
+      "SELECT scores FROM search_scores WHERE fit_key = ? AND score_key = ?", (fit_key, score_key)).fetchone()
+    return None if row is None else json.loads(row[0])
+
+  def put_scores(self, fit_key: str, score_key: str, data_key: str, params: str, scores: Any):
+    connection = self._connect()
+    connection.execute("INSERT OR REPLACE INTO search_scores VALUES (?, ?, ?, ?, ?, ?)",
+      (fit_key, score_key, data_key, params, json.dumps(scores), time.time()))
+    connection.commit()
+
+  def count(self, data_key: str | None = None) -> int:
+    if data_key is None:
+      return self._connect().execute("SELECT COUNT(*) FROM search_scores").fetchone()[0]
+    return self._connect().execute("SELECT COUNT(*) FROM search_scores WHERE data_key = ?", (data_key,)).fetchone()[0]
+
+def hash_values(*values: Any) -> str:
+  digest = hashlib.blake2b(digest_size=16)
+  for value in values:
+    array = np.asarray(value)
+    if array.dtype == object or array.dtype.kind in "US":
+      digest.update("\x1f".join(map(str, array.ravel())).encode("utf-8"))
+    else:
+      digest.update(array.dtype.str.encode())
+      digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(b"\x1e")
+  return digest.hexdigest()
+
+# Stable text form of an estimator's (deep) params. Nested estimators are described by their own
+# flattened params, dtypes by their dtype string (float32 and float64 fits get different keys),
+# dicts (e.g. class_weight) by their items, other objects (e.g. the vectorizer's token count cache)
+# only by type so the key doesn't depend on memory addresses.
+def _params_key(estimator: BaseEstimator) -> str:
+  return json.dumps({name: _stable_value(value) for name, value in estimator.get_params(deep=True).items()}, sort_keys=True)
+
+def _stable_value(value: Any) -> Any:
+  if value is None or isinstance(value, (str, bool, int, float)):
+    return value
+  if isinstance(value, (tuple, list)):
+    return [_stable_value(item) for item in value]
+  if isinstance(value, np.generic):
+    return value.item()
+  if isinstance(value, dict):
+    # json.dumps(sort_keys=True) sorts the nested keys too
+    return {str(key): _stable_value(item) for key, item in value.items()}
+  if isinstance(value, np.dtype) or value in (bool, int, float, complex) or (isinstance(value, type) and issubclass(value, np.generic)):
+    return np.dtype(value).str
+  if isinstance(value, type):
+    return f"{value.__module__}.{value.__qualname__}"
+  return type(value).__name__
+
+# Search estimator wrapper that skips fits already scored in the checkpoint store.
+# Candidate params are routed to the wrapped pipeline, so the search param space stays unchanged
+# ("clf__C", "vec__use_idf", ...). A skipped fit is only carried out later if the scorer
+# asks for a prediction that isn't in the store.
+class CheckpointedEstimator(ClassifierMixin, BaseEstimator):
+  def __init__(self, estimator: BaseEstimator | None = None, store: SearchCheckpointStore | None = None, data_key: str = ""):
+    self.estimator = estimator
+    self.store = store
+    self.data_key = data_key
+
+  def get_params(self, deep=True):
+    params = super().get_params(deep=deep)
+    if deep and self.estimator is not None:
+      params.update(self.estimator.get_params(deep=True))
+    return params
+
+  def set_params(self, **params):
+    own_params = {name: value for name, value in params.items() if name in ("estimator", "store", "data_key")}
+    estimator_params = {name: value for name, value in params.items() if name not in own_params}
+    super().set_params(**own_params)
+    if estimator_params:
+      self.estimator.set_params(**estimator_params)
+    return self
+
+  def fit(self, X, y, **fit_params):
+    self.params_key_ = _params_key(self.estimator)
+    self.fit_key_ = hash_values(self.data_key, self.params_key_, X, y, *fit_params.values())
+    self.fit_skipped_ = self.store.has_fit(self.fit_key_)
+    self._fit_args = (X, y, fit_params) if self.fit_skipped_ else None
+
+    if not self.fit_skipped_:
+      self.estimator.fit(X, y, **fit_params)
+    return self
+
+  # Wrapped estimator, fitted on first use if its fit was skipped
+  def fitted_estimator(self) -> BaseEstimator:
+    if self.fit_skipped_:
+      X, y, fit_params = self._fit_args
+      self.estimator.fit(X, y, **fit_params)
+      self.fit_skipped_ = False
+      self._fit_args = None
+    return self.estimator
+
+  @property
+  def classes_(self) -> np.ndarray:
+    return self.fitted_estimator().classes_
+
+  def predict(self, X):
+    return self.fitted_estimator().predict(X)
+
+  def predict_proba(self, X):
+    return self.fitted_estimator().predict_proba(X)
+
+# Scorer wrapper that serves scores of a CheckpointedEstimator from the store, and stores new ones.
+class CheckpointedScorer:
+  def __init__(self, scorer: Callable, store: SearchCheckpointStore):
+    self.scorer = scorer
+    self.store = store
+
+  def __call__(self, estimator: CheckpointedEstimator, X, y, **kwargs):
+    score_key = hash_values(X, y, *kwargs.values())
+    scores = self.store.get_scores(estimator.fit_key_, score_key)
+
+    if scores is None:
+      scores = self.scorer(estimator.fitted_estimator(), X, y, **kwargs)
+      scores = {name: float(value) for name, value in scores.items()} if isinstance(scores, dict) else float(scores)
+      self.store.put_scores(estimator.fit_key_, score_key, estimator.data_key, estimator.params_key_, scores)
+
+    return scores
+
+# Make a configured GridSearchCV/HalvingRandomSearchCV checkpoint every scored fit into checkpoint_path.
+# data_key identifies the training data (texts, labels, weights): fold rows are addressed
+# by position, so results are only reused by runs over the same data.
+def checkpoint_search(search: Any, checkpoint_path: str, X: Any, y: Any, sample_weight: Any = None) -> Any:
+  store = SearchCheckpointStore(checkpoint_path)
+  data_key = hash_values(X, y, [] if sample_weight is None else sample_weight)
+  print(f"Search checkpoint {checkpoint_path}: {store.count(data_key)} stored scores for this data")
+
+  search.estimator = CheckpointedEstimator(search.estimator, store, data_key)
+  search.scoring = CheckpointedScorer(search.scoring, store)
+  return search
+
+# Best estimator of a (possibly checkpointed) search
+def get_best_estimator(search: Any) -> Any:
+  best_estimator = search.best_estimator_
+
+  if isinstance(best_estimator, CheckpointedEstimator):
+    print(f"Search checkpoint: {best_estimator.store.count(best_estimator.data_key)} stored scores for this data")
+    return best_estimator.fitted_estimator()
+
+  return best_estimator
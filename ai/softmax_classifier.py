@@ -0,0 +1,234 @@
+from typing import Dict, Literal, Tuple, TypeAlias
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.special import softmax
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.utils.class_weight import compute_class_weight
+from sklearn.utils.validation import check_array, check_is_fitted
+
+Optimizer: TypeAlias = Literal["adam", "sgd"]
+
+# Multinomial logistic regression trained with minibatch Adam/SGD directly on the CSR tf-idf matrix.
+# Cost per minibatch is proportional to its non-zeros times the number of classes: gradients,
+# L2 decay and optimizer state are only updated for the feature rows the minibatch touches
+# (lazy updates), so an epoch doesn't scale with vocabulary x labels like a full batch solver does.
+# Objective: weighted mean cross entropy + alpha / 2 * ||coef||^2, i.e. alpha ~ 1 / (C * n_samples) of LogisticRegression.
+# coef_/intercept_ have LogisticRegression's shapes and meaning, so skl2onnx converts it as a linear classifier.
+class SoftmaxSGDClassifier(ClassifierMixin, BaseEstimator):
+  def __init__(self,
+    alpha: float = 1e-5,
+    optimizer: Optimizer = "adam",
+    learning_rate: float = 0.03,
+    momentum: float = 0.9,
+    batch_size: int = 256,
+    max_epochs: int = 100,
+    early_stopping: bool = True,
+    validation_fraction: float = 0.1,
+    n_iter_no_change: int = 5,
+    ndcg_k: int = 10,
+    tol: float = 1e-4,
+    class_weight: Dict[str, float] | str | None = None,
+    random_state: int | None = None):
+    self.alpha = alpha
+    self.optimizer = optimizer
+    self.learning_rate = learning_rate
+    self.momentum = momentum
+    self.batch_size = batch_size
+    self.max_epochs = max_epochs
+    self.early_stopping = early_stopping
+    self.validation_fraction = validation_fraction
+    self.n_iter_no_change = n_iter_no_change
+    self.ndcg_k = ndcg_k
+    self.tol = tol
+    self.class_weight = class_weight
+    self.random_state = random_state
+
+  def fit(self, X, y, sample_weight=None):
+    X, y, sample_weight = self._validate(X, y, sample_weight)
+    self._init_state(np.unique(y), X.shape[1])
+    self._rng = np.random.default_rng(self.random_state)
+
+    weights = sample_weight * self._class_weights(y, sample_weight)
+    train_idx, val_idx = self._split_validation(y)
+    if val_idx is not None:
+      X_val, y_val, w_val = X[val_idx], y[val_idx], weights[val_idx]
+      X, y, weights = X[train_idx], y[train_idx], weights[train_idx]
+
+    self.validation_scores_ = []
+    self.best_validation_score_ = None
+    best_state, n_no_change = None, 0
+
+    for epoch in range(self.max_epochs):
+      self._run_epoch(X, y, weights)
+      self.n_iter_ = epoch + 1
+
+      if val_idx is None:
+        continue
+
+      score = self._validation_ndcg(X_val, y_val, w_val)
+      self.validation_scores_.append(score)
+      if self.best_validation_score_ is None or score > self.best_validation_score_ + self.tol:
+        self.best_validation_score_ = score
+        best_state = (self._weights.copy(), self._intercept.copy())
+        n_no_change = 0
+      else:
+        n_no_change += 1
+        if n_no_change >= self.n_iter_no_change:
+          break
+
+    if best_state is not None:
+      self._weights, self._intercept = best_state
+    self._update_public_weights()
+    return self
+
+  # One pass of minibatch updates over X, e.g. over each chunk of a streamed training set.
+  # classes must be given on the first call; class_weight="balanced" needs the full label distribution
+  # and is only supported by fit.
+  def partial_fit(self, X, y, classes=None, sample_weight=None):
+    X, y, sample_weight = self._validate(X, y, sample_weight)
+
+    if not hasattr(self, "_weights"):
+      if classes is None:
+        raise ValueError("classes must be passed on the first call to partial_fit")
+      if self.class_weight == "balanced":
+        raise ValueError("class_weight='balanced' is not supported by partial_fit, pass a dict of class weights")
+      self._init_state(np.unique(classes), X.shape[1])
+      self._rng = np.random.default_rng(self.random_state)
+      self.n_iter_ = 0
+    elif X.shape[1] != self.n_features_in_:
+      raise ValueError(f"X has {X.shape[1]} features, the classifier was trained on {self.n_features_in_}")
+
+    if not np.isin(y, self.classes_).all():
+      raise ValueError(f"partial_fit got labels outside of classes: {np.setdiff1d(y, self.classes_)[:5]}")
+
+    self._run_epoch(X, y, sample_weight * self._class_weights(y, sample_weight))
+    self.n_iter_ += 1
+    self._update_public_weights()
+    return self
+
+  def decision_function(self, X):
+    check_is_fitted(self, "coef_")
+    X = check_array(X, accept_sparse="csr", dtype=np.float64)
+    scores = np.asarray(X @ self.coef_.T) + self.intercept_
+    return scores.ravel() if scores.shape[1] == 1 else scores
+
+  def predict_proba(self, X):
+    scores = self.decision_function(X)
+    if scores.ndim == 1:
+      # binary coef_ is half the logit difference, see _update_public_weights
+      scores = np.column_stack([-scores, scores])
+    return softmax(scores, axis=1)
+
+  def predict(self, X):
+    return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+  def _validate(self, X, y, sample_weight) -> Tuple[csr_matrix, np.ndarray, np.ndarray]:
+    if self.optimizer not in ("adam", "sgd"):
+      raise ValueError(f"Unknown optimizer '{self.optimizer}', expected 'adam' or 'sgd'")
+    X = csr_matrix(check_array(X, accept_sparse="csr", dtype=np.float64))
+    y = np.asarray(y)
+    if X.shape[0] != len(y):
+      raise ValueError(f"X has {X.shape[0]} rows but y has {len(y)} labels")
+    sample_weight = np.ones(len(y)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+    return X, y, sample_weight
+
+  def _init_state(self, classes: np.ndarray, n_features: int):
+    self.classes_ = classes
+    self.n_features_in_ = n_features
+    # (n_features, n_classes), i.e. coef_ transposed, so the rows a minibatch touches are contiguous.
+    # Keeps one column per class, also for 2 classes.
+    self._weights = np.zeros((n_features, len(classes)))
+    self._intercept = np.zeros(len(classes))
+    self._first_moment = np.zeros_like(self._weights)
+    self._second_moment = np.zeros_like(self._weights)
+    self._intercept_first_moment = np.zeros_like(self._intercept)
+    self._intercept_second_moment = np.zeros_like(self._intercept)
+    # per feature number of optimizer steps, for Adam's bias correction of lazily updated rows
+    self._feature_steps = np.zeros(n_features, dtype=np.int64)
+    self._steps = 0
+
+  # "balanced" counts labels by sample weight like LogisticRegression, so weighted deduplicated rows
+  # get the class weights of the rows they stand for
+  def _class_weights(self, y: np.ndarray, sample_weight: np.ndarray) -> np.ndarray:
+    if self.class_weight is None:
+      return np.ones(len(y))
+    if self.class_weight == "balanced":
+      class_weights = compute_class_weight("balanced", classes=self.classes_, y=y, sample_weight=sample_weight)
+    else:
+      class_weights = np.array([self.class_weight.get(label, 1.0) for label in self.classes_])
+    return class_weights[np.searchsorted(self.classes_, y)]
+
+  def _split_validation(self, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray | None]:
+    n_validation = int(round(self.validation_fraction * len(y))) if self.early_stopping else 0
+    if n_validation == 0:
+      return np.arange(len(y)), None
+
+    permutation = self._rng.permutation(len(y))
+    return permutation[n_validation:], permutation[:n_validation]
+
+  def _run_epoch(self, X: csr_matrix, y: np.ndarray, weights: np.ndarray):
+    y_idx = np.searchsorted(self.classes_, y)
+    order = self._rng.permutation(X.shape[0])
+
+    for start in range(0, len(order), self.batch_size):
+      batch = order[start:start + self.batch_size]
+      self._step(X[batch], y_idx[batch], weights[batch])
+
+  def _step(self, X_batch: csr_matrix, y_batch: np.ndarray, w_batch: np.ndarray):
+    total_weight = w_batch.sum()
+    if total_weight <= 0:
+      return
+
+    # only the feature rows present in the minibatch get a gradient
+    features, active_indices = np.unique(X_batch.indices, return_inverse=True)
+    X_active = csr_matrix((X_batch.data, active_indices, X_batch.indptr), shape=(X_batch.shape[0], len(features)))
+    weights_active = self._weights[features]
+
+    proba = softmax(np.asarray(X_active @ weights_active) + self._intercept, axis=1)
+    proba[np.arange(len(y_batch)), y_batch] -= 1.0
+    residuals = proba * (w_batch / total_weight)[:, None]
+
+    weights_grad = np.asarray(X_active.T @ residuals) + self.alpha * weights_active
+    intercept_grad = residuals.sum(axis=0)
+
+    self._steps += 1
+    self._feature_steps[features] += 1
+
+    if self.optimizer == "sgd":
+      velocity = self.momentum * self._first_moment[features] + weights_grad
+      self._first_moment[features] = velocity
+      self._weights[features] = weights_active - self.learning_rate * velocity
+      self._intercept_first_moment = self.momentum * self._intercept_first_moment + intercept_grad
+      self._intercept -= self.learning_rate * self._intercept_first_moment
+      return
+
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    first = beta1 * self._first_moment[features] + (1 - beta1) * weights_grad
+    second = beta2 * self._second_moment[features] + (1 - beta2) * weights_grad ** 2
+    self._first_moment[features] = first
+    self._second_moment[features] = second
+    steps = self._feature_steps[features][:, None]
+    self._weights[features] = weights_active - self.learning_rate * (first / (1 - beta1 ** steps)) / (
+      np.sqrt(second / (1 - beta2 ** steps)) + eps)
+
+    self._intercept_first_moment = beta1 * self._intercept_first_moment + (1 - beta1) * intercept_grad
+    self._intercept_second_moment = beta2 * self._intercept_second_moment + (1 - beta2) * intercept_grad ** 2
+    self._intercept -= self.learning_rate * (self._intercept_first_moment / (1 - beta1 ** self._steps)) / (
+      np.sqrt(self._intercept_second_moment / (1 - beta2 ** self._steps)) + eps)
+
+  def _validation_ndcg(self, X: csr_matrix, y: np.ndarray, weights: np.ndarray) -> float:
+    # imported here, model_utils imports pipeline_factory which imports this module
+    from model_utils import labels_to_indices, ndcg_at_k
+
+    proba = softmax(np.asarray(X @ self._weights) + self._intercept, axis=1)
+    return ndcg_at_k(labels_to_indices(y, self.classes_), proba, k=self.ndcg_k, sample_weight=weights)
+
+  def _update_public_weights(self):
+    if len(self.classes_) == 2:
+      # softmax([a, b]) == softmax([-(b - a) / 2, (b - a) / 2]): one row like LogisticRegression,
+      # the linear classifier ONNX converter expands it back to [-z, z] + softmax
+      self.coef_ = ((self._weights[:, 1] - self._weights[:, 0]) / 2)[None, :]
+      self.intercept_ = np.array([(self._intercept[1] - self._intercept[0]) / 2])
+    else:
+      self.coef_ = np.ascontiguousarray(self._weights.T)
+      self.intercept_ = self._intercept.copy()
@@ -0,0 +1,119 @@
+from typing import Any, List, Tuple
+import numpy as np
+
+from numpy_inference import NumpyPlateRanker
+
+# Queries with fewer postings than n_classes / SPARSE_POSTINGS_RATIO only score the classes they touch.
+# Sorting postings costs more per posting than a vectorized pass over all classes costs per class,
+# this is about where the two cross on the synthetic label benchmark (model_utils.benchmark_label_scaling).
+SPARSE_POSTINGS_RATIO = 32
+
+# NumpyPlateRanker that stores the LR weights as an inverted index: per token, the classes with a
+# non-zero (after pruning) weight and those weights, in CSR layout (postings_ptr, postings_class,
+# postings_weight). A query only reads the postings of its 2-6 active tokens and the top k comes from
+# argpartition, so no (n_queries, n_classes) matrix is materialized, sorted or normalized per batch.
+#
+# prune_threshold drops weights below that fraction of the largest absolute weight (like the ONNX
+# optimizer's prune threshold), 0 only drops exact zeros and ranks exactly like predict_proba.
+# L2 regularized LR weights are dense, a query's postings then cover every class and it's scored in
+# one pass over the classes. Only when they cover few classes (heavy pruning, many labels) are just
+# the touched classes scored: the others score their intercept, so the best of them come from the
+# classes in descending intercept order, and the softmax denominator is the precomputed exp sum of
+# all intercepts corrected for the touched classes.
+class InvertedIndexRanker(NumpyPlateRanker):
+  def __init__(self, *args: Any, prune_threshold: float = 0.0, **kwargs: Any):
+    super().__init__(*args, **kwargs)
+    if prune_threshold < 0 or prune_threshold >= 1:
+      raise ValueError(f"prune_threshold must be in [0, 1), got {prune_threshold}")
+
+    coef_t = self.coef_t
+    kept = np.abs(coef_t) > prune_threshold * np.abs(coef_t).max(initial=0)
+    self.prune_threshold = prune_threshold
+    self.postings_ptr = np.concatenate([[0], np.cumsum(kept.sum(axis=1))]).astype(np.int64)
+    self.postings_class = np.nonzero(kept)[1].astype(np.int32)
+    self.postings_weight = coef_t[kept]
+    # the dense matrix isn't used for scoring anymore
+    self.coef_t = None
+
+    self.intercept_order = np.argsort(-self.intercept, kind="stable")
+    self.intercept_max = self.intercept[self.intercept_order[0]]
+    self.intercept_exp_sum = np.exp(self.intercept - self.intercept_max).sum()
+
+  @property
+  def n_postings(self) -> int:
+    return len(self.postings_class)
+
+  @property
+  def nbytes(self) -> int:
+    return self.postings_ptr.nbytes + self.postings_class.nbytes + self.postings_weight.nbytes + self.intercept_order.nbytes
+
+  # Postings of a query's features as (start, end, value) triples
+  def _query_postings(self, text: str) -> List[Tuple[int, int, float]]:
+    indices, values = self.vectorize(text)
+    return list(zip(self.postings_ptr[indices].tolist(), self.postings_ptr[indices + 1].tolist(), values.tolist()))
+
+  # Add value * weights of the postings to scores over all classes
+  def _add_postings(self, scores: np.ndarray, postings: List[Tuple[int, int, float]]):
+    n_classes = len(self.classes)
+    for start, end, value in postings:
+      if end - start == n_classes:
+        # nothing pruned, classes are in order
+        scores += value * self.postings_weight[start:end]
+      else:
+        scores[self.postings_class[start:end]] += value * self.postings_weight[start:end]
+
+  def decision_function(self, texts: List[str]) -> np.ndarray:
+    scores = np.tile(self.intercept, (len(texts), 1))
+    for row, text in enumerate(texts):
+      self._add_postings(scores[row], self._query_postings(text))
+
+    return scores
+
+  # Top k class indices and probabilities of a single query, best first
+  def rank_indices(self, text: str, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+    k = min(k, len(self.classes))
+    postings = self._query_postings(text)
+    if sum(end - start for start, end, _ in postings) * SPARSE_POSTINGS_RATIO < len(self.classes):
+      return self._rank_touched(postings, k)
+
+    # the query's postings cover a good part of the classes anyway, one dense pass over them is cheaper
+    scores = self.intercept.copy()
+    self._add_postings(scores, postings)
+
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    exp_scores = np.exp(scores - scores[top[0]])
+    return top, exp_scores[top] / exp_scores.sum()
+
+  # rank_indices scoring only the classes the query has postings for plus the k best untouched intercepts
+  def _rank_touched(self, postings: List[Tuple[int, int, float]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    if postings:
+      touched, inverse = np.unique(np.concatenate([self.postings_class[start:end] for start, end, _ in postings]), return_inverse=True)
+      contributions = np.concatenate([self.postings_weight[start:end] * value for start, end, value in postings])
+      touched_scores = self.intercept[touched] + np.bincount(inverse, weights=contributions, minlength=len(touched))
+    else:
+      touched, touched_scores = self.intercept_order[:0], self.intercept[:0]
+
+    # at most len(touched) of the best intercepts were touched, so k untouched ones are among the next k
+    best_intercepts = self.intercept_order[:k + len(touched)]
+    untouched = best_intercepts[~np.isin(best_intercepts, touched, assume_unique=True)][:k]
+    candidates = np.concatenate([touched, untouched])
+    candidate_scores = np.concatenate([touched_scores, self.intercept[untouched]])
+
+    top = np.argpartition(-candidate_scores, k - 1)[:k]
+    top = top[np.argsort(-candidate_scores[top], kind="stable")]
+
+    shift = max(self.intercept_max, candidate_scores[top[0]])
+    # clipped, the difference is rounding noise when the query touched (almost) every class
+    untouched_exp_sum = max(self.intercept_exp_sum * np.exp(self.intercept_max - shift) - np.exp(self.intercept[touched] - shift).sum(), 0.0)
+    exp_sum = untouched_exp_sum + np.exp(touched_scores - shift).sum()
+    return candidates[top], np.exp(candidate_scores[top] - shift) / exp_sum
+
+  def rank(self, texts: List[str], k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+    k = min(k, len(self.classes))
+    top = np.empty((len(texts), k), dtype=np.int64)
+    probabilities = np.empty((len(texts), k), dtype=self.intercept.dtype)
+    for row, text in enumerate(texts):
+      top[row], probabilities[row] = self.rank_indices(text, k)
+
+    return self.classes[top], probabilities
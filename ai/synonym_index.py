@@ -0,0 +1,241 @@
+from collections import OrderedDict
+from itertools import product
+from math import prod
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+import json
+import time
+import numpy as np
+
+TokenIds = Tuple[int, ...]
+
+# Seed of the combinations kept when a phrase has more synonym variants than max_variants
+VARIANT_SAMPLE_SEED = 500
+
+# Read a word -> synonyms mapping, e.g. {"middle": ["center"], "plate": ["background"]}
+def load_synonyms(synonyms_path: str | Path) -> Dict[str, List[str]]:
+  with Path(synonyms_path).open("r", encoding="utf-8") as file:
+    synonyms = json.load(file)
+
+  if not isinstance(synonyms, dict):
+    raise ValueError(f"Synonyms file {synonyms_path} must contain a json object of word -> list of synonyms")
+
+  for word, word_synonyms in synonyms.items():
+    if not isinstance(word_synonyms, list) or not all(isinstance(synonym, str) and synonym for synonym in word_synonyms):
+      raise ValueError(f"Synonyms of '{word}' in {synonyms_path} must be a list of non-empty strings")
+    if word in word_synonyms:
+      raise ValueError(f"'{word}' is listed as its own synonym in {synonyms_path}")
+
+  return synonyms
+
+# Positions into each word's variants (0 - the word itself) of the synonym combinations kept for a phrase,
+# in cartesian product order. Over max_variants the phrase itself is kept plus combinations drawn
+# uniformly from the rest with a fixed seed, so a capped phrase isn't only varied in its last words
+# and the same phrase always gets the same combinations.
+def iter_variant_positions(sizes: List[int], max_variants: int | None = None) -> Iterator[TokenIds]:
+  n_combinations = prod(sizes)
+  if max_variants is None or n_combinations <= max_variants:
+    return product(*[range(size) for size in sizes])
+  if max_variants < 1:
+    raise ValueError(f"max_variants must be at least 1, got {max_variants}")
+
+  rng = np.random.default_rng(VARIANT_SAMPLE_SEED)
+  sampled = np.sort(rng.choice(n_combinations - 1, size=max_variants - 1, replace=False)) + 1
+  positions = np.unravel_index(np.concatenate([[0], sampled]), sizes)
+  return zip(*[word_positions.tolist() for word_positions in positions])
+
+# Synonyms compiled into a token id index. Words are interned into ids once, and every id maps to the
+# ids of itself followed by its synonyms, so phrases are expanded as integer tuples (cartesian product
+# of the per-word variant ids) and turned back into strings only when rows are emitted.
+# Expansions are cached per (phrase, max_variants) and key variants per description key: the same
+# phrases ("light blue", "white", ...) repeat across many plates and are expanded only once.
+# Both caches keep the cache_size most recently used entries. Words outside the synonyms are interned
+# as they're seen, so an index lives for one load (see data_loader.iter_weighted_training_rows).
+class SynonymIndex:
+  def __init__(self, synonyms: Dict[str, List[str]], cache_size: int = 4096):
+    self.synonyms = synonyms
+    self.tokens: List[str] = []
+    self.token_ids: Dict[str, int] = {}
+    self._variants: List[TokenIds] = []
+    for word, word_synonyms in synonyms.items():
+      word_id = self.intern(word)
+      self._variants[word_id] = (word_id, *[self.intern(synonym) for synonym in word_synonyms])
+    self.cache_size = cache_size
+    self._phrase_variants: OrderedDict = OrderedDict()
+    self._key_variants: OrderedDict = OrderedDict()
+    self._canonical_tokens: Dict[str, str] | None = None
+
+  @classmethod
+  def from_file(cls, synonyms_path: str | Path) -> "SynonymIndex":
+    return cls(load_synonyms(synonyms_path))
+
+  def intern(self, token: str) -> int:
+    token_id = self.token_ids.get(token)
+    if token_id is None:
+      token_id = len(self.tokens)
+      self.token_ids[token] = token_id
+      self.tokens.append(token)
+      self._variants.append((token_id,))
+    return token_id
+
+  # Ids of the token itself followed by its synonyms
+  def variants(self, token_id: int) -> TokenIds:
+    return self._variants[token_id]
+
+  def encode(self, phrase: str) -> TokenIds:
+    return tuple(self.intern(word) for word in phrase.split(" "))
+
+  def decode(self, token_ids: TokenIds) -> str:
+    return " ".join([self.tokens[token_id] for token_id in token_ids])
+
+  # Synonym variants of a phrase as token id tuples, in cartesian product order, at most max_variants
+  # (see iter_variant_positions)
+  def expand_ids(self, phrase_ids: TokenIds, max_variants: int | None = None) -> Iterator[TokenIds]:
+    phrase_variants = [self.variants(token_id) for token_id in phrase_ids]
+    for positions in iter_variant_positions([len(word_variants) for word_variants in phrase_variants], max_variants):
+      yield tuple(word_variants[position] for word_variants, position in zip(phrase_variants, positions))
+
+  def _cached(self, cache: OrderedDict, key: Any, expand: Callable[[], List[str]]) -> List[str]:
+    expanded = cache.get(key)
+    if expanded is not None:
+      cache.move_to_end(key)
+      return expanded
+
+    expanded = expand()
+    cache[key] = expanded
+    if len(cache) > self.cache_size:
+      cache.popitem(last=False)
+    return expanded
+
+  def expand_phrase(self, phrase: str, max_variants: int | None = None) -> List[str]:
+    return self._cached(self._phrase_variants,
+      (phrase, max_variants),
+      lambda: [self.decode(variant_ids) for variant_ids in self.expand_ids(self.encode(phrase), max_variants)])
+
+  def expand_key(self, desc_key: str) -> List[str]:
+    return self._cached(self._key_variants,
+      desc_key,
+      lambda: [self.tokens[token_id] for token_id in self.variants(self.intern(desc_key))])
+
+  # synonym -> the word it is listed under, e.g. "center" -> "middle". Tokens that aren't synonyms
+  # are their own canonical token and are left out. Synonym chains and synonyms listed under
+  # several words have no single canonical token and are rejected.
+  def canonical_tokens(self) -> Dict[str, str]:
+    if self._canonical_tokens is None:
+      canonical: Dict[str, str] = {}
+      for word, word_synonyms in self.synonyms.items():
+        for synonym in word_synonyms:
+          if synonym in self.synonyms:
+            raise ValueError(f"'{synonym}' is a synonym of '{word}' and has synonyms of its own, it has no canonical token")
+          if canonical.get(synonym, word) != word:
+            raise ValueError(f"'{synonym}' is a synonym of both '{canonical[synonym]}' and '{word}', it has no canonical token")
+          canonical[synonym] = word
+      self._canonical_tokens = canonical
+    return self._canonical_tokens
+
+  def canonicalize_phrase(self, phrase: str) -> str:
+    canonical = self.canonical_tokens()
+    return " ".join([canonical.get(word, word) for word in phrase.split(" ")])
+
+# Reference expansion with per word synonym dict lookups, as create_training_text did before the index.
+# Only used as the baseline of benchmark_synonym_expansion.
+def iter_training_text_with_lookups(plate_descriptions: Dict[str, str],
+  synonyms: Dict[str, List[str]],
+  max_phrase_variants: int | None = None) -> Iterator[str]:
+  for desc_key, desc_val in plate_descriptions.items():
+    if not isinstance(desc_val, str):
+      continue
+
+    desk_key_variants = [desc_key, *synonyms.get(desc_key, [])]
+
+    for raw_phrase in (p.strip() for p in desc_val.split(",") if p.strip()):
+      phrase_variants_parts = [[word, *synonyms.get(word, [])] for word in raw_phrase.split(" ")]
+
+      for positions in iter_variant_positions([len(parts) for parts in phrase_variants_parts], max_phrase_variants):
+        phrase = " ".join([parts[position] for parts, position in zip(phrase_variants_parts, positions)])
+        yield phrase
+
+        for desk_key_variant in desk_key_variants:
+          yield f"{desk_key_variant} {phrase}"
+          yield f"{phrase} {desk_key_variant}"
+
+# Enlarge a list of plate descriptions scale times: every copy gets phrases drawn from all descriptions
+# of the same key (so phrase repetition across plates is kept, like in the real data) plus a few
+# made-up words, some of which get synonyms added to the returned mapping.
+def create_synthetic_descriptions(descriptions: List[Dict[str, str]],
+  synonyms: Dict[str, List[str]],
+  scale: int,
+  random_state: int = 500) -> Tuple[List[Dict[str, str]], Dict[str, List[str]]]:
+  rng = np.random.default_rng(random_state)
+  phrases_by_key: Dict[str, List[str]] = {}
+  for description in descriptions:
+    for desc_key, desc_val in description.items():
+      if isinstance(desc_val, str):
+        phrases_by_key.setdefault(desc_key, []).extend(p.strip() for p in desc_val.split(",") if p.strip())
+
+  synthetic_synonyms = dict(synonyms)
+  made_up_words = [f"word{idx}" for idx in range(max(scale, 10))]
+  for word in made_up_words[::5]:
+    synthetic_synonyms[word] = [f"{word}-alt{idx}" for idx in range(2)]
+
+  synthetic = []
+  for _ in range(scale):
+    for description in descriptions:
+      synthetic_description = {}
+      for desc_key, desc_val in description.items():
+        if not isinstance(desc_val, str):
+          continue
+        n_phrases = len(desc_val.split(","))
+        phrases = list(rng.choice(phrases_by_key[desc_key], size=n_phrases))
+        phrases.append(f"{rng.choice(made_up_words)} {rng.choice(phrases_by_key[desc_key])}")
+        synthetic_description[desc_key] = ", ".join(phrases)
+      synthetic.append(synthetic_description)
+
+  return synthetic, synthetic_synonyms
+
+# Time the synonym index expansion against per word dict lookups on a synthetically enlarged
+# description set, check both produce the same rows and report rows per second.
+def benchmark_synonym_expansion(descriptions: List[Dict[str, str]],
+  synonyms: Dict[str, List[str]],
+  scale: int = 100,
+  max_phrase_variants: int | None = None,
+  repeats: int = 3) -> Dict[str, float]:
+  # imported here, data_loader builds its default index from this module
+  from data_loader import iter_training_text
+
+  synthetic, synthetic_synonyms = create_synthetic_descriptions(descriptions, synonyms, scale)
+
+  def _expand_with_lookups() -> List[str]:
+    return [text for description in synthetic for text in iter_training_text_with_lookups(description, synthetic_synonyms, max_phrase_variants)]
+
+  def _expand_with_index() -> List[str]:
+    # fresh index per run, so its expansion caches are warmed up within the timed run
+    synonym_index = SynonymIndex(synthetic_synonyms)
+    return [text for description in synthetic for text in iter_training_text(description, max_phrase_variants, synonym_index)]
+
+  def _best_time(expand: Callable[[], List[str]]) -> Tuple[float, List[str]]:
+    timings, rows = [], []
+    for _ in range(repeats):
+      started = time.perf_counter()
+      rows = expand()
+      timings.append(time.perf_counter() - started)
+    return min(timings), rows
+
+  lookup_seconds, lookup_rows = _best_time(_expand_with_lookups)
+  index_seconds, index_rows = _best_time(_expand_with_index)
+  if lookup_rows != index_rows:
+    raise ValueError("Synonym index expansion differs from the per word lookup expansion")
+
+  report = {
+    "descriptions": len(synthetic),
+    "rows": len(index_rows),
+    "lookup_seconds": lookup_seconds,
+    "index_seconds": index_seconds,
+    "lookup_rows_per_second": len(lookup_rows) / lookup_seconds,
+    "index_rows_per_second": len(index_rows) / index_seconds,
+    "speedup": lookup_seconds / index_seconds,
+  }
+  print(f"Synonym expansion of {report['descriptions']} descriptions ({report['rows']} rows): "
+    f"lookups {lookup_seconds:.3f}s, index {index_seconds:.3f}s, speedup {report['speedup']:.2f}x")
+
+  return report
@@ -0,0 +1,88 @@
+import unittest
+import sys, os
+import numpy as np
+from scipy.stats import loguniform, uniform
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from bayesian_search import TPESampler, fold_difference_ucb, run_bayesian_search
+from hyperparam_manager import find_best_params_bayesian_search
+from pipeline_factory import create_lr_pipeline
+
+class TestBayesianSearch(unittest.TestCase):
+  def test_will_concentrate_proposals_near_optimum(self):
+    param_distributions = {"C": loguniform(1e-5, 1e3), "kind": ["a", "b", "c"]}
+
+    def score_fold(params, fold):
+      return -abs(np.log10(params["C"]) - 1.0) - (0.0 if params["kind"] == "b" else 0.5)
+
+    outcome = run_bayesian_search(score_fold, param_distributions, n_candidates=40, n_splits=1, random_state=500)
+
+    self.assertEqual("b", outcome.best_params["kind"])
+    self.assertLess(abs(np.log10(outcome.best_params["C"]) - 1.0), 0.3)
+    late_proposals = [trial.params for trial in outcome.trials[-10:]]
+    self.assertGreater(sum(params["kind"] == "b" for params in late_proposals), 5)
+
+  def test_will_stop_candidates_that_cant_beat_incumbent(self):
+    fold_offsets = [0.0, 0.05, -0.05, 0.02, -0.02]
+
+    def score_fold(params, fold):
+      return (0.8 if params["good"] else 0.5) + fold_offsets[fold]
+
+    outcome = run_bayesian_search(score_fold, {"good": [True, False]}, n_candidates=6, n_splits=5, random_state=1, n_startup=6)
+
+    for trial in outcome.trials:
+      if not trial.params["good"] and trial is not outcome.trials[0]:
+        self.assertTrue(trial.pruned)
+        self.assertEqual(2, len(trial.fold_scores))
+    self.assertTrue(outcome.best_params["good"])
+    self.assertLess(outcome.n_fits, 6 * 5)
+
+  def test_will_widen_bound_with_fewer_folds(self):
+    differences = np.array([-0.01, -0.02])
+
+    self.assertGreater(fold_difference_ucb(differences, 5, 2.0, 0.005), fold_difference_ucb(np.append(differences, [-0.015, -0.01]), 5, 2.0, 0.005))
+    self.assertAlmostEqual(-0.012, fold_difference_ucb(np.append(differences, [-0.015, -0.01, -0.005]), 5, 2.0, 0.005))
+
+  def test_will_not_repeat_categorical_candidates(self):
+    sampler = TPESampler({"a": [1, 2], "b": ["x", "y"]}, random_state=0, n_startup=2)
+    trials = []
+
+    for _ in range(4):
+      params = sampler.suggest(trials)
+      trials.append((params, float(params["a"])))
+
+    self.assertEqual(4, len({(params["a"], params["b"]) for params, _ in trials}))
+
+  def test_will_not_model_pruned_trials_as_good(self):
+    sampler = TPESampler({"x": uniform(0, 10)}, random_state=0, n_startup=2, gamma=0.5)
+    # pruned trials have no final score, they must not pull proposals towards x=9
+    trials = [({"x": x}, -abs(x - 1.0)) for x in [0.5, 1.0, 1.5, 4.0, 5.0, 6.0]] + [({"x": 9.0}, None), ({"x": 9.5}, None)]
+
+    proposals = [sampler.suggest(trials)["x"] for _ in range(8)]
+
+    self.assertLess(max(proposals), 3.0)
+    with self.assertRaises(ValueError):
+      run_bayesian_search(lambda params, fold: 0.0, {"a": [1, 2]}, n_candidates=0)
+
+  def test_will_return_search_results_for_pipeline(self):
+    colors = ["red", "green", "blue"]
+    shades = ["light", "dark", "solid", "fade", "bright", "dim", "pale", "deep", "soft", "neon"]
+    X = [f"{color} {shade} plate" for color in colors for shade in shades]
+    y = [color for color in colors for _ in shades]
+
+    uut_results = find_best_params_bayesian_search(pipeline=create_lr_pipeline(),
+      X_train=X,
+      X_test=X,
+      y_train=y,
+      y_test=y,
+      random_state=500,
+      param_distributions={"clf__C": loguniform(0.01, 100), "vec__use_idf": [True, False]},
+      n_candidates=6,
+      n_startup=3)
+
+    self.assertIn("clf__C", uut_results.estimator_params)
+    self.assertEqual("LogisticRegression", uut_results.to_model_params().estimator)
+    self.assertEqual(uut_results.estimator_params["clf__C"], uut_results.best_estimator.named_steps["clf"].C)
+
+if __name__ == '__main__':
+  unittest.main()
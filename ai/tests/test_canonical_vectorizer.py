@@ -0,0 +1,56 @@
+import unittest
+import sys, os
+import numpy as np
+import onnxruntime as ort
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from data_loader import create_training_text
+from model_utils import convert_to_onnx
+from pipeline_factory import VEC_STEP, create_lr_pipeline
+from synonym_index import SynonymIndex
+
+synonyms = {"middle": ["center"], "line": ["strip", "stripe"], "plate": ["background"]}
+
+X = ["solid white plate", "white middle line", "red line", "blue plate", "green background", "red stripe top"]
+y = ["us-ca", "us-ks", "us-ks", "us-nv", "us-vt", "us-ks"]
+
+class TestCanonicalVectorizer(unittest.TestCase):
+  def test_will_reject_synonyms_without_canonical_token(self):
+    with self.assertRaises(ValueError):
+      SynonymIndex({"line": ["strip"], "strip": ["band"]}).canonical_tokens()
+    with self.assertRaises(ValueError):
+      SynonymIndex({"line": ["strip"], "band": ["strip"]}).canonical_tokens()
+
+    self.assertEqual("white middle line plate", SynonymIndex(synonyms).canonicalize_phrase("white center stripe background"))
+
+  def test_will_create_canonical_training_text_without_synonym_product(self):
+    description = {"plate": "white center stripe"}
+
+    self.assertEqual(
+      ["white middle line", "plate white middle line", "white middle line plate"],
+      create_training_text(description, canonicalize_synonyms=True))
+    # expansion with synonyms.json: 2 x 4 phrase variants, each alone and with both key variants on either side
+    self.assertEqual(8 * 5, len(create_training_text({"plate": "white middle line"})))
+
+  def test_will_canonicalize_synonyms_in_sklearn_and_onnx(self):
+    for ngram_range in [(1, 1), (1, 2)]:
+      estimator = create_lr_pipeline(canonical_synonyms=synonyms).set_params(vec__ngram_range=ngram_range).fit(X, y)
+      vocabulary = estimator.named_steps[VEC_STEP].vocabulary_
+      self.assertNotIn(("center",), vocabulary)
+      self.assertNotIn(("background",), vocabulary)
+
+      queries = ["white center strip", "green plate", "blue background", "red Stripe top", "yellow"]
+      canonical_queries = ["white middle line", "green plate", "blue plate", "red line top", "yellow"]
+      expected = estimator.predict_proba(canonical_queries)
+      np.testing.assert_allclose(expected, estimator.predict_proba(queries))
+
+      session = ort.InferenceSession(convert_to_onnx(estimator, locale="C.UTF-8").SerializeToString())
+      _, probabilities = session.run(None, {"text": np.array(queries).reshape(-1, 1)})[:2]
+      np.testing.assert_allclose(expected, probabilities, atol=1e-5)
+
+  def test_will_not_combine_canonicalization_with_hashing(self):
+    with self.assertRaises(ValueError):
+      create_lr_pipeline(hash_buckets=256, canonical_synonyms=synonyms)
+
+if __name__ == '__main__':
+  unittest.main()
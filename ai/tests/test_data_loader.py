@@ -1,8 +1,10 @@
 import unittest
 import sys, os
+import json
+import tempfile
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from data_loader import RawTrainingDataRow, transform_to_training_rows
+from data_loader import RawTrainingDataRow, create_training_text, iter_raw_data, load_training_rows, transform_to_training_rows, transform_to_weighted_training_rows
 
 class TestDataLoaderMethods(unittest.TestCase):
   def test_will_produce_correct_row_columns(self):
@@ -58,5 +60,95 @@ class TestDataLoaderMethods(unittest.TestCase):
     self.assertIn("middle test", uut_texts)
     self.assertIn("center test", uut_texts)
 
+  def test_will_stream_raw_data_across_chunks(self):
+    raw_items = [
+      {"key": "sample", "version": "default", "weight": 1.0, "description": {"plate": "ignored"}},
+      {"key": "us-ca", "version": "default", "weight": 1.0, "description": {"plate": "solid white"}},
+      {"key": "us-nv", "version": "v2", "weight": 2.0, "description": {"top": "blue, light blue"}}
+    ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      data_path = os.path.join(temp_dir, "data.json")
+      with open(data_path, "w", encoding="utf-8") as file:
+        json.dump(raw_items, file, indent=2)
+
+      uut_rows = list(iter_raw_data(data_path, chunk_size=7))
+
+    self.assertEqual([RawTrainingDataRow(**item) for item in raw_items], uut_rows)
+
+  def test_will_load_same_rows_as_transform(self):
+    raw_items = [
+      {"key": "us-ca", "version": "default", "weight": 1.0, "description": {"plate": "solid white"}},
+      {"key": "us-nv", "version": "default", "weight": 2.0, "description": {"middle": "blue line"}}
+    ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      data_path = os.path.join(temp_dir, "data.json")
+      with open(data_path, "w", encoding="utf-8") as file:
+        json.dump(raw_items, file)
+
+      streamed_rows = load_training_rows(data_path)
+
+    expected_rows = transform_to_weighted_training_rows([RawTrainingDataRow(**item) for item in raw_items], dedup=False)
+    self.assertEqual(expected_rows.values.tolist(), streamed_rows.values.tolist())
+    self.assertEqual(["label", "text", "weight"], [*streamed_rows])
+
+  def test_will_reject_misplaced_commas_when_streaming(self):
+    item = json.dumps({"key": "us-ca", "version": "default", "weight": 1.0, "description": {"plate": "solid white"}})
+
+    for malformed in [f"[,{item}]", f"[{item},,{item}]", f"[{item},]", f"[{item} {item}]", "[,]"]:
+      with tempfile.TemporaryDirectory() as temp_dir:
+        data_path = os.path.join(temp_dir, "data.json")
+        with open(data_path, "w", encoding="utf-8") as file:
+          file.write(malformed)
+
+        with self.assertRaises(ValueError, msg=malformed):
+          list(iter_raw_data(data_path, chunk_size=4))
+
+  def test_will_collapse_duplicate_rows_into_weights(self):
+    test_data = RawTrainingDataRow(key="test-key",
+      version="test-ver",
+      weight=1.0,
+      description={
+        "top": "test phrase, test phrase"
+      })
+
+    uut_rows = transform_to_weighted_training_rows([test_data])
+
+    self.assertEqual(["label", "text", "weight"], [*uut_rows])
+    self.assertEqual(3, len(uut_rows))
+    self.assertEqual([2.0, 2.0, 2.0], uut_rows["weight"].tolist())
+    self.assertEqual(len(transform_to_training_rows([test_data])), uut_rows["weight"].sum())
+
+  def test_will_carry_raw_row_weights(self):
+    test_data = [
+      RawTrainingDataRow(key="us-ca", version="default", weight=1.0, description={"plate": "white"}),
+      RawTrainingDataRow(key="us-ca", version="v2", weight=2.5, description={"plate": "white"}),
+      RawTrainingDataRow(key="us-nv", version="default", weight=0.0, description={"plate": "white"})
+    ]
+
+    uut_rows = transform_to_weighted_training_rows(test_data)
+
+    self.assertEqual({"us-ca"}, set(uut_rows["label"]))
+    self.assertEqual([3.5] * 5, uut_rows["weight"].tolist())
+
+  def test_will_reject_duplicate_key_versions(self):
+    test_data = [
+      RawTrainingDataRow(key="us-ca", version="default", weight=1.0, description={"plate": "white"}),
+      RawTrainingDataRow(key="us-ca", version="default", weight=1.0, description={"plate": "gold"})
+    ]
+
+    with self.assertRaises(ValueError):
+      transform_to_weighted_training_rows(test_data)
+
+  def test_will_cap_phrase_variants(self):
+    # "middle line plate" expands into 2 * 4 * 2 = 16 phrase variants
+    uncapped_texts = create_training_text({"top": "middle line plate"})
+    capped_texts = create_training_text({"top": "middle line plate"}, max_phrase_variants=2)
+
+    self.assertEqual(16 * 3, len(uncapped_texts))
+    self.assertEqual(2 * 3, len(capped_texts))
+    self.assertIn("middle line plate", capped_texts)
+
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file
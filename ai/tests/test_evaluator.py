@@ -0,0 +1,75 @@
+import unittest
+import sys, os
+import numpy as np
+import onnxruntime as ort
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from sklearn.metrics import get_scorer
+from evaluator import compare_float32_mode, cross_validate_model
+from model_utils import convert_to_onnx, make_fused_scorer, make_ndcg_scorer
+from pipeline_factory import CLF_STEP, VEC_STEP, create_dtype_params, create_lr_pipeline, restore_dtype_params
+
+colors = ["red", "green", "blue"]
+shades = ["light", "dark", "solid", "fade", "bright", "dim", "pale", "deep", "soft", "neon"]
+X = [f"{color} {shade} plate" for color in colors for shade in shades]
+y = [color for color in colors for _ in shades]
+
+class TestEvaluator(unittest.TestCase):
+  def test_will_produce_same_cv_scores_in_parallel(self):
+    serial_scores = cross_validate_model(create_lr_pipeline(), X, y, random_state=500, n_jobs=1)
+    parallel_scores = cross_validate_model(create_lr_pipeline(), X, y, random_state=500, n_jobs=2)
+
+    for metric in ["test_accuracy", "test_neg_log_loss", "test_roc_auc", "test_ndcg", "train_ndcg"]:
+      np.testing.assert_allclose(serial_scores[metric], parallel_scores[metric])
+
+  def test_will_match_individual_scorers_with_fused_scorer(self):
+    estimator = create_lr_pipeline().fit(X, y)
+
+    fused_scores = make_fused_scorer(k=10)(estimator, X, y)
+
+    self.assertAlmostEqual(get_scorer("accuracy")(estimator, X, y), fused_scores["accuracy"])
+    self.assertAlmostEqual(get_scorer("neg_log_loss")(estimator, X, y), fused_scores["neg_log_loss"])
+    self.assertAlmostEqual(get_scorer("roc_auc_ovr")(estimator, X, y), fused_scores["roc_auc"])
+    self.assertAlmostEqual(make_ndcg_scorer(k=10)(estimator, X, y), fused_scores["ndcg"])
+
+  def test_will_train_and_score_in_float32(self):
+    estimator = create_lr_pipeline(dtype=np.float32).fit(X, y)
+
+    self.assertEqual(np.float32, estimator.named_steps[VEC_STEP].transform(X).dtype)
+    self.assertEqual(np.float32, estimator.named_steps[CLF_STEP].coef_.dtype)
+    self.assertEqual(np.float32, estimator.predict_proba(X).dtype)
+
+    float64_scores = make_fused_scorer(k=10)(create_lr_pipeline().fit(X, y), X, y)
+    for metric, score in make_fused_scorer(k=10)(estimator, X, y).items():
+      self.assertAlmostEqual(float64_scores[metric], score, places=3, msg=metric)
+
+    session = ort.InferenceSession(convert_to_onnx(estimator, locale="C.UTF-8").SerializeToString())
+    probabilities = session.run(None, {"text": np.array(X).reshape(-1, 1)})[1]
+    np.testing.assert_allclose(estimator.predict_proba(X), probabilities, atol=1e-5)
+
+  def test_will_swap_float64_solvers_for_float32(self):
+    params = {f"{CLF_STEP}__solver": "lbfgs", f"{CLF_STEP}__C": 1.0}
+    self.assertEqual(params, create_dtype_params(params, np.float64))
+    self.assertEqual("newton-cg", create_dtype_params(params, np.float32)[f"{CLF_STEP}__solver"])
+    self.assertEqual(["newton-cg", "saga"], create_dtype_params({f"{CLF_STEP}__solver": ["lbfgs", "saga"]}, np.float32)[f"{CLF_STEP}__solver"])
+    # searched float32 params are saved with the solver float64 runs use
+    self.assertEqual(params, restore_dtype_params(create_dtype_params(params, np.float32), np.float32))
+    self.assertEqual({f"{CLF_STEP}__solver": "saga"}, restore_dtype_params({f"{CLF_STEP}__solver": "saga"}, np.float32))
+
+    with self.assertRaises(ValueError):
+      create_lr_pipeline(hash_buckets=256, dtype=np.float32)
+
+  def test_will_compare_float32_with_float64_rankings(self):
+    report = compare_float32_mode({f"{CLF_STEP}__solver": "lbfgs"}, X, y, X[::3], y[::3], random_state=500, k=3)
+
+    self.assertEqual(["float64", "float32"], [row["dtype"] for row in report["models"]])
+    self.assertEqual(["lbfgs", "newton-cg"], [row["solver"] for row in report["models"]])
+    float64_row, float32_row = report["models"]
+    self.assertEqual(float64_row["feature_value_bytes"], 2 * float32_row["feature_value_bytes"])
+    self.assertEqual(float64_row["weight_bytes"], 2 * float32_row["weight_bytes"])
+    self.assertAlmostEqual(0.0, report["holdout_ndcg_10_delta"], places=3)
+    self.assertEqual(["float32_vs_float64", "float64_vs_converged", "float32_vs_converged"], list(report["ranking_parity"]))
+    self.assertEqual(1.0, report["ranking_parity"]["float32_vs_float64"]["top_k_agreement"])
+
+if __name__ == '__main__':
+  unittest.main()
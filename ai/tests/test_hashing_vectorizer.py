@@ -0,0 +1,68 @@
+import unittest
+import sys, os
+import numpy as np
+import onnxruntime as ort
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from hashing_vectorizer import fnv1a_32, hash_token_buckets
+from model_utils import convert_to_onnx
+from onnx_benchmark import check_onnx_parity, run_onnx_ranking
+from pipeline_factory import VEC_STEP, create_lr_pipeline, create_vectorizer
+
+X = [
+  "solid white plate", "white background", "red top white middle", "red line",
+  "blue bottom", "light blue top", "green plate", "solid green background",
+  "yellow sun", "yellow fade", "black bear", "grizzly bear"
+]
+y = ["us-ca", "us-ca", "us-ks", "us-ks", "us-nv", "us-nv", "us-vt", "us-vt", "us-ak", "us-ak", "us-ak", "us-ak"]
+
+class TestHashingVectorizer(unittest.TestCase):
+  def test_will_hash_with_reference_fnv1a(self):
+    # reference values of the 32 bit FNV-1a spec
+    self.assertEqual(0x811C9DC5, fnv1a_32(""))
+    self.assertEqual(0xE40C292C, fnv1a_32("a"))
+    self.assertEqual(0xBF9CF968, fnv1a_32("foobar"))
+
+    buckets = hash_token_buckets(["Red top", ""], n_buckets=64, token_pattern=r"[a-z0-9-]+", lowercase=True, ngram_range=(1, 2))
+    self.assertEqual([[fnv1a_32("red") % 64, fnv1a_32("top") % 64, fnv1a_32("red top") % 64], [-1, -1, -1]], buckets.tolist())
+
+  def test_will_match_vocabulary_tfidf_without_collisions(self):
+    params = {"ngram_range": (1, 2), "sublinear_tf": True, "norm": "l2"}
+    vocabulary_vec = create_vectorizer().set_params(**params).fit(X)
+    hashing_vec = create_lr_pipeline(hash_buckets=1 << 20).named_steps[VEC_STEP].set_params(**params).fit(X)
+
+    self.assertEqual(0.0, hashing_vec.collision_rate_)
+    self.assertEqual(len(vocabulary_vec.vocabulary_), hashing_vec.n_tokens_)
+
+    # out of vocabulary tokens still get a bucket (and count towards the norm), so only compare training texts
+    expected = vocabulary_vec.transform(X).toarray()
+    actual = hashing_vec.transform(X)
+    for token, column in vocabulary_vec.vocabulary_.items():
+      bucket = fnv1a_32(" ".join(token) if isinstance(token, tuple) else token) % (1 << 20)
+      np.testing.assert_allclose(expected[:, column], actual[:, bucket].toarray().ravel())
+
+  def test_will_report_collisions(self):
+    vec = create_lr_pipeline(hash_buckets=4).named_steps[VEC_STEP].fit(X)
+
+    report = vec.get_collision_report()
+
+    self.assertEqual(4, report["n_buckets"])
+    self.assertEqual(18, report["n_tokens"])
+    self.assertEqual(1.0, report["collision_rate"])
+    self.assertEqual((len(X), 4), vec.transform(X).shape)
+
+  def test_will_export_hashed_pipeline_to_onnx(self):
+    for params in [{"vec__sublinear_tf": False, "vec__norm": None}, {"vec__sublinear_tf": True, "vec__norm": "l2", "vec__ngram_range": (1, 2)}]:
+      estimator = create_lr_pipeline(hash_buckets=64).set_params(**params).fit(X, y)
+      texts = X + ["green background", "yellow bear", "unknown words only", ""]
+
+      session = ort.InferenceSession(convert_to_onnx(estimator).SerializeToString())
+      labels, probabilities = run_onnx_ranking(session, texts, k=3)
+      parity = check_onnx_parity(estimator, labels, probabilities, texts)
+
+      self.assertEqual("64", session.get_modelmeta().custom_metadata_map["n_buckets"])
+      self.assertEqual(1.0, parity["top_k_agreement"])
+      self.assertLess(parity["max_probability_error"], 1e-5)
+
+if __name__ == '__main__':
+  unittest.main()
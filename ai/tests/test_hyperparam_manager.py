@@ -1,10 +1,15 @@
 import unittest
 import sys, os
 import json
+import tempfile
+from unittest import mock
+import numpy as np
 
-from evaluator import ModelEvaluations
-from hyperparam_manager import SearchResults, bump_version
+import evaluator
+from evaluator import ModelEvaluations, compute_model_evaluations
+from hyperparam_manager import ModelParams, SearchResults, bump_version, find_best_params_grid_search, find_best_params_random_halving_search, find_best_params_regularization_path, load_hyperparams_from_file, save_hyperparams_to_file
 from pipeline_factory import CLF_STEP, create_lr_pipeline, create_svm_pipeline
+from search_checkpoint import SearchCheckpointStore
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 class TestHyperparamManager(unittest.TestCase):
@@ -34,6 +39,108 @@ class TestHyperparamManager(unittest.TestCase):
 
     self.assertEqual("SVC", actual_model_params.estimator)
 
+  def test_will_pick_best_c_from_regularization_path(self):
+    colors = ["red", "green", "blue"]
+    X = [f"{color} {shade} plate" for color in colors for shade in ["light", "dark", "solid", "fade", "bright", "dim"]]
+    y = [color for color in colors for _ in range(6)]
+    C_values = [0.01, 1.0, 100.0]
+
+    uut_results = find_best_params_regularization_path(pipeline=create_lr_pipeline(),
+      X_train=X,
+      X_test=X,
+      y_train=y,
+      y_test=y,
+      random_state=500,
+      base_params={"clf__max_iter": 1000},
+      C_values=C_values,
+      n_splits=2)
+
+    self.assertIn(uut_results.estimator_params["clf__C"], C_values)
+    self.assertEqual(1000, uut_results.estimator_params["clf__max_iter"])
+    self.assertEqual("LogisticRegression", uut_results.to_model_params().estimator)
+
+  def test_will_resume_search_from_checkpoint(self):
+    colors = ["red", "green", "blue"]
+    shades = ["light", "dark", "solid", "fade", "bright", "dim", "pale", "deep", "soft", "neon"]
+    X = [f"{color} {shade} plate" for color in colors for shade in shades]
+    y = [color for color in colors for _ in shades]
+    param_grid = {"clf__C": [0.1, 10.0], "vec__use_idf": [True, False]}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      checkpoint_path = os.path.join(temp_dir, "search.sqlite")
+      search_args = dict(pipeline=create_lr_pipeline(), X_train=X, X_test=X, y_train=y, y_test=y, random_state=500, refit="ndcg", checkpoint_path=checkpoint_path)
+
+      first_results = find_best_params_grid_search(param_grid=param_grid, **search_args)
+      stored_after_first = SearchCheckpointStore(checkpoint_path).count()
+      second_results = find_best_params_grid_search(param_grid=param_grid, **search_args)
+      stored_after_second = SearchCheckpointStore(checkpoint_path).count()
+      extended_results = find_best_params_grid_search(param_grid={**param_grid, "clf__C": [0.1, 10.0, 1000.0]}, **search_args)
+      stored_after_extended = SearchCheckpointStore(checkpoint_path).count()
+
+    # 4 candidates x 5 folds x train and test scores, resumed run adds nothing, extended grid only scores the 2 new candidates
+    self.assertEqual(40, stored_after_first)
+    self.assertEqual(stored_after_first, stored_after_second)
+    self.assertEqual(60, stored_after_extended)
+    self.assertEqual(first_results.estimator_params, second_results.estimator_params)
+    self.assertAlmostEqual(first_results.best_score, second_results.best_score)
+    self.assertGreaterEqual(extended_results.best_score, first_results.best_score)
+
+  def test_will_not_share_checkpoint_scores_between_dtypes_or_class_weights(self):
+    colors = ["red", "green", "blue"]
+    shades = ["light", "dark", "solid", "fade", "bright", "dim", "pale", "deep", "soft", "neon"]
+    X = [f"{color} {shade} plate" for color in colors for shade in shades]
+    y = [color for color in colors for _ in shades]
+    param_grid = {"vec__dtype": [np.float32, np.float64], "clf__class_weight": [{"red": 2.0}, {"red": 5.0}]}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      checkpoint_path = os.path.join(temp_dir, "search.sqlite")
+      find_best_params_grid_search(pipeline=create_lr_pipeline(), param_grid=param_grid, X_train=X, X_test=X, y_train=y, y_test=y,
+        random_state=500, refit="ndcg", checkpoint_path=checkpoint_path)
+      stored = SearchCheckpointStore(checkpoint_path).count()
+
+    # 4 candidates x 5 folds x train and test scores, none of them reuses another candidate's scores
+    self.assertEqual(40, stored)
+
+  def test_will_reuse_search_cv_scores_for_model_evaluations(self):
+    colors = ["red", "green", "blue"]
+    shades = ["light", "dark", "solid", "fade", "bright", "dim", "pale", "deep", "soft", "neon"]
+    X = [f"{color} {shade} plate" for color in colors for shade in shades]
+    y = [color for color in colors for _ in shades]
+    search_args = dict(pipeline=create_lr_pipeline(), X_train=X, X_test=X, y_train=y, y_test=y, random_state=500, refit="ndcg")
+
+    with mock.patch.object(evaluator, "cross_validate_model", wraps=evaluator.cross_validate_model) as cross_validate_model:
+      grid_results = find_best_params_grid_search(param_grid={"clf__C": [0.01, 10.0], "vec__use_idf": [True, False]}, **search_args)
+      halving_results = find_best_params_random_halving_search(param_distributions={"clf__C": [0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0, 30.0, 100.0]},
+        resource="clf__max_iter",
+        min_resources=10,
+        max_resources=90,
+        **search_args)
+      self.assertEqual(0, cross_validate_model.call_count)
+
+      # same folds as a separate CV of the winner
+      for results in [grid_results, halving_results]:
+        evals = compute_model_evaluations(results.best_estimator, results.best_estimator, 500, X, y, X, y)
+        self.assertEqual(evals.cv_folds, results.model_evals.cv_folds)
+        self.assertAlmostEqual(evals.cv_ndcg_test_mean, results.model_evals.cv_ndcg_test_mean)
+        self.assertAlmostEqual(evals.cv_ndcg_train_mean, results.model_evals.cv_ndcg_train_mean)
+        self.assertAlmostEqual(evals.cv_ll_mean, results.model_evals.cv_ll_mean)
+        self.assertAlmostEqual(evals.cv_roc_auc_test_std, results.model_evals.cv_roc_auc_test_std)
+        self.assertAlmostEqual(results.best_score, results.model_evals.cv_ndcg_test_mean)
+      self.assertEqual(2, cross_validate_model.call_count)
+
+  def test_will_not_overwrite_params_of_another_estimator(self):
+    lr_params = ModelParams(estimator="LogisticRegression", refit="ndcg", best_params={"vec__ngram_range": [1, 1], "clf__C": 1.0}, final_evals=ModelEvaluations())
+    svm_params = ModelParams(estimator="LinearSVC", refit="ndcg", best_params={"vec__ngram_range": [1, 1], "kmap__gamma": 0.1}, final_evals=ModelEvaluations())
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      params_path = os.path.join(temp_dir, "training_params.json")
+      save_hyperparams_to_file(params_path, lr_params)
+      save_hyperparams_to_file(params_path, lr_params)
+
+      with self.assertRaises(ValueError):
+        save_hyperparams_to_file(params_path, svm_params)
+      self.assertEqual({"vec__ngram_range": (1, 1), "clf__C": 1.0}, load_hyperparams_from_file(params_path))
+
   def test_will_create_default_version(self):
     test_json = json.loads('{}')
     old_version = test_json.get("version")
@@ -0,0 +1,55 @@
+import unittest
+import sys, os
+from unittest import mock
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import skl2onnx
+from instrumentation import measure_import_times
+from model_utils import convert_to_onnx
+from pipeline_factory import create_lr_pipeline, create_softmax_sgd_pipeline, register_onnx_converters
+
+# Import budgets in seconds. Measured ~1.6s for trainer (almost all of it sklearn, which itself
+# imports scipy.stats and pandas) and ~0.15s for numpy_inference on a single core sandbox.
+TRAINER_IMPORT_BUDGET = 3.0
+NUMPY_INFERENCE_IMPORT_BUDGET = 0.6
+
+# Only needed to export, search with halving or train an SVM, never by importing the trainer
+TRAINER_LAZY_MODULES = [
+  "skl2onnx",
+  "onnx",
+  "onnxruntime",
+  "sklearn.calibration",
+  "sklearn.experimental.enable_halving_search_cv",
+]
+
+X = ["solid white plate", "white background", "red line", "blue bottom"]
+y = ["us-ca", "us-ca", "us-ks", "us-nv"]
+
+class TestImportTime(unittest.TestCase):
+  def test_will_import_trainer_within_budget_without_export_modules(self):
+    import_times = measure_import_times("trainer")
+
+    self.assertEqual([], [module for module in TRAINER_LAZY_MODULES if module in import_times])
+    self.assertLess(import_times["trainer"], TRAINER_IMPORT_BUDGET)
+
+  def test_will_import_numpy_inference_without_sklearn(self):
+    import_times = measure_import_times("numpy_inference")
+
+    self.assertEqual([], [module for module in import_times if module.split(".")[0] in ("sklearn", "scipy", "onnx")])
+    self.assertLess(import_times["numpy_inference"], NUMPY_INFERENCE_IMPORT_BUDGET)
+
+  def test_will_register_onnx_converters_once(self):
+    register_onnx_converters.cache_clear()
+
+    with mock.patch.object(skl2onnx, "update_registered_converter", wraps=skl2onnx.update_registered_converter) as update_registered_converter:
+      estimators = [create_lr_pipeline().fit(X, y), create_softmax_sgd_pipeline().set_params(clf__early_stopping=False).fit(X, y)]
+      self.assertEqual(0, update_registered_converter.call_count)
+
+      for estimator in estimators + estimators:
+        convert_to_onnx(estimator, locale="C.UTF-8")
+
+    # TraceableTfidfVectorizer, CanonicalTfidfVectorizer, SoftmaxSGDClassifier, Nystroem and RBFSampler
+    self.assertEqual(5, update_registered_converter.call_count)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import sys, os
+import json
+import pstats
+import tempfile
+import tracemalloc
+from unittest import mock
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from instrumentation import _peak_rss_mb, measure_memory_peak, span, start_run_profiler, stop_run_profiler
+from model_utils import fit_pipeline
+from pipeline_factory import create_fit_params, create_lr_pipeline
+
+X = ["solid white plate", "white background", "red top white middle", "red line", "blue bottom", "light blue top"]
+y = ["us-ca", "us-ca", "us-ks", "us-ks", "us-nv", "us-nv"]
+
+class TestInstrumentation(unittest.TestCase):
+  def tearDown(self):
+    stop_run_profiler()
+
+  def test_will_record_nested_spans_with_counts(self):
+    profiler = start_run_profiler(trace_memory=True)
+
+    with span("search", rows=10) as search_span:
+      with span("fit") as fit_span:
+        buffer = np.ones(2**20)
+        fit_span.count(features=buffer.size)
+      del buffer
+      search_span.count(candidates=3)
+
+    stop_run_profiler()
+    search, fit = profiler.spans
+
+    self.assertEqual({"rows": 10, "candidates": 3}, search.counts)
+    self.assertEqual(("fit", 1, "search", {"features": 2**20}), (fit.name, fit.depth, fit.parent, fit.counts))
+    self.assertGreaterEqual(search.wall_seconds, fit.wall_seconds)
+    # the 8MB array allocated by the inner span counts towards the outer span's peak too
+    self.assertGreater(fit.tracemalloc_peak_mb, 7.9)
+    self.assertGreaterEqual(search.tracemalloc_peak_mb, fit.tracemalloc_peak_mb)
+    self.assertEqual({"search", "fit"}, set(profiler.summarize_stages()))
+
+  def test_will_measure_memory_peak_without_stopping_profiler_tracing(self):
+    with measure_memory_peak() as peak:
+      buffer = np.ones(2**20)
+    del buffer
+    self.assertGreater(peak.peak_bytes, 2**23 - 2**16)
+    self.assertFalse(tracemalloc.is_tracing())
+
+    profiler = start_run_profiler(trace_memory=True)
+    with span("fit"):
+      buffer = np.ones(2**21)
+      del buffer
+      with measure_memory_peak() as peak:
+        buffer = np.ones(2**20)
+      del buffer
+      self.assertTrue(tracemalloc.is_tracing())
+
+    stop_run_profiler()
+    self.assertLess(peak.peak_bytes, 2**24)
+    # the 16MB allocated before the measured block still counts towards the span's peak
+    self.assertGreater(profiler.spans[0].tracemalloc_peak_mb, 15.9)
+
+  def test_will_report_no_rss_without_resource_module(self):
+    self.assertGreater(_peak_rss_mb(), 0)
+    # e.g. Windows, which has no resource module
+    with mock.patch.dict(sys.modules, {"resource": None}):
+      self.assertEqual(0.0, _peak_rss_mb())
+
+  def test_will_dump_cprofile_per_outermost_stage_and_save_report(self):
+    with tempfile.TemporaryDirectory() as profile_dir:
+      profiler = start_run_profiler(profile_dir=profile_dir)
+      estimator = fit_pipeline(create_lr_pipeline(), X, y)
+      with span("cv"):
+        with span("fit"):
+          pass
+      stop_run_profiler()
+
+      report_path = os.path.join(profile_dir, "run_report.json")
+      profiler.save_report(report_path)
+      with open(report_path, "r", encoding="utf-8") as file:
+        report = json.load(file)
+
+      self.assertEqual(["vectorization", "fit", "cv", "fit"], [record["name"] for record in report["spans"]])
+      self.assertEqual({"rows": 6, "features": len(estimator.named_steps["vec"].vocabulary_), "classes": 3}, report["spans"][1]["counts"])
+      self.assertEqual(2, report["stages"]["fit"]["calls"])
+      self.assertIsNone(report["spans"][3]["profile_path"])
+      self.assertGreater(pstats.Stats(report["spans"][1]["profile_path"]).total_calls, 0)
+      self.assertTrue(os.path.exists(report["spans"][2]["profile_path"]))
+
+  def test_will_fit_same_pipeline_as_pipeline_fit(self):
+    weights = np.array([1.0, 2.0, 1.0, 0.5, 1.0, 3.0])
+    expected = create_lr_pipeline().fit(X, y, **create_fit_params(weights))
+
+    with span("detached") as record:
+      estimator = fit_pipeline(create_lr_pipeline(), X, y, weights)
+
+    self.assertEqual({}, record.counts)
+    np.testing.assert_allclose(expected.predict_proba(X), estimator.predict_proba(X))
+
+if __name__ == '__main__':
+  unittest.main()
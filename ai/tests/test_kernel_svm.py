@@ -0,0 +1,56 @@
+import unittest
+import sys, os
+import numpy as np
+import onnxruntime as ort
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from model_utils import convert_to_onnx, fit_pipeline
+from pipeline_factory import CLF_STEP, KERNEL_STEP, create_kernel_svm_pipeline
+
+X = [
+  "solid white plate", "white background", "white middle line", "plain white", "white top",
+  "red line", "red top white middle", "red stripe", "red bottom line", "dark red",
+  "blue bottom", "light blue top", "blue plate", "blue background", "blue middle stripe",
+]
+y = ["us-ca"] * 5 + ["us-ks"] * 5 + ["us-nv"] * 5
+
+queries = ["white plate", "red middle line", "blue", "green", "white red blue stripe"]
+
+def create_fitted_pipeline(feature_map: str, **params):
+  pipeline = create_kernel_svm_pipeline(feature_map, n_components=12).set_params(
+    **{f"{KERNEL_STEP}__random_state": 0, f"{CLF_STEP}__cv": 2},
+    **params)
+  return fit_pipeline(pipeline, X, y, np.linspace(0.5, 2.0, len(X)))
+
+def run_onnx(estimator, texts):
+  session = ort.InferenceSession(convert_to_onnx(estimator, locale="C.UTF-8").SerializeToString())
+  labels, probabilities = session.run(None, {"text": np.array(texts).reshape(-1, 1)})[:2]
+  return labels, probabilities
+
+class TestKernelSvm(unittest.TestCase):
+  def test_will_export_feature_maps_to_onnx(self):
+    for feature_map, params in [
+      ("nystroem", {}),
+      ("nystroem", {f"{KERNEL_STEP}__kernel": "poly", f"{KERNEL_STEP}__degree": 2, f"{KERNEL_STEP}__gamma": None}),
+      ("nystroem", {f"{KERNEL_STEP}__kernel": "sigmoid", f"{KERNEL_STEP}__coef0": 0}),
+      ("rbf-sampler", {"vec__norm": None, "vec__sublinear_tf": False, f"{KERNEL_STEP}__gamma": 0.05}),
+    ]:
+      estimator = create_fitted_pipeline(feature_map, **params)
+      # a single calibrated linear SVM, not a per fold ensemble
+      self.assertEqual(1, len(estimator.named_steps[CLF_STEP].calibrated_classifiers_))
+
+      expected = estimator.predict_proba(queries)
+      labels, probabilities = run_onnx(estimator, queries)
+      np.testing.assert_allclose(expected, probabilities, atol=1e-4, err_msg=f"{feature_map} {params}")
+      self.assertEqual(list(estimator.predict(queries)), list(labels))
+
+  def test_will_reject_unknown_feature_maps_and_kernels(self):
+    with self.assertRaises(ValueError):
+      create_kernel_svm_pipeline("fourier")
+
+    estimator = create_fitted_pipeline("nystroem", **{f"{KERNEL_STEP}__kernel": "laplacian"})
+    with self.assertRaises(ValueError):
+      convert_to_onnx(estimator, locale="C.UTF-8")
+
+if __name__ == '__main__':
+  unittest.main()
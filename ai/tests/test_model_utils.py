@@ -0,0 +1,63 @@
+import unittest
+import sys, os
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from scipy.sparse import csr_matrix
+from sklearn.metrics import ndcg_score
+from sklearn.preprocessing import label_binarize
+from model_utils import labels_to_indices, ndcg_at_k, rank_queries
+from pipeline_factory import create_lr_pipeline
+
+class TestModelUtils(unittest.TestCase):
+  def test_will_match_sklearn_ndcg_for_single_relevant_label(self):
+    rng = np.random.default_rng(500)
+    classes = np.array([f"us-{i:02d}" for i in range(20)])
+    proba = rng.random((200, 20))
+    # introduce ties around the true class
+    proba[:50, :5] = 0.5
+    y = classes[rng.integers(0, 20, 200)]
+    weights = rng.random(200)
+
+    for k in [1, 3, 10, 50]:
+      expected = ndcg_score(label_binarize(y, classes=classes), proba, k=min(k, 20), sample_weight=weights)
+      actual = ndcg_at_k(labels_to_indices(y, classes), proba, k=k, sample_weight=weights)
+      self.assertAlmostEqual(expected, actual)
+
+  def test_will_score_unknown_labels_as_zero(self):
+    classes = np.array(["us-ca", "us-nv"])
+
+    y_idx = labels_to_indices(["us-ca", "us-xx"], classes)
+
+    self.assertEqual([0, -1], y_idx.tolist())
+    self.assertEqual(0.5, ndcg_at_k(y_idx, np.array([[0.9, 0.1], [0.2, 0.8]]), k=2))
+
+  def test_will_match_sklearn_ndcg_for_graded_relevance(self):
+    rng = np.random.default_rng(500)
+    proba = rng.random((30, 8))
+    relevance = np.zeros((30, 8))
+    relevance[np.arange(30), rng.integers(0, 8, 30)] = 1.0
+    # "close" labels get partial credit
+    relevance[np.arange(30), rng.integers(0, 8, 30)] += 0.5
+
+    expected = ndcg_score(relevance, proba, k=3)
+    actual = ndcg_at_k(None, proba, k=3, relevance=csr_matrix(relevance))
+
+    self.assertAlmostEqual(expected, actual)
+
+  def test_will_rank_query_batch_by_probability(self):
+    X = ["solid white plate", "red line", "blue bottom", "green plate", "yellow sun", "black bear"]
+    y = ["us-ca", "us-ks", "us-nv", "us-vt", "us-ak", "us-ak"]
+    queries = ["green plate", "white", "yellow bear"]
+    estimator = create_lr_pipeline().fit(X, y)
+
+    labels, probabilities = rank_queries(queries, estimator, k=3)
+
+    proba = estimator.predict_proba(queries)
+    expected_top = np.argsort(-proba, axis=1)[:, :3]
+    self.assertEqual((3, 3), labels.shape)
+    self.assertEqual(estimator.classes_[expected_top].tolist(), labels.tolist())
+    np.testing.assert_allclose(np.take_along_axis(proba, expected_top, axis=1), probabilities)
+
+if __name__ == '__main__':
+  unittest.main()
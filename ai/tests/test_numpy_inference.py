@@ -0,0 +1,77 @@
+import unittest
+import sys, os
+import io
+import json
+import tempfile
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from model_utils import export_to_npz
+from numpy_inference import NumpyPlateRanker, rank_query_stream
+from pipeline_factory import create_lr_pipeline, create_svm_pipeline
+
+X = [
+  "solid white plate", "white background", "red top white middle", "red line",
+  "blue bottom", "light blue top", "green plate", "solid green background",
+  "yellow sun", "yellow fade", "black bear", "grizzly bear"
+]
+y = ["us-ca", "us-ca", "us-ks", "us-ks", "us-nv", "us-nv", "us-vt", "us-vt", "us-ak", "us-ak", "us-ak", "us-ak"]
+queries = ["Solid WHITE plate", "green background", "blue-white", "unknown words only", "yellow bear bear"]
+
+class TestNumpyInference(unittest.TestCase):
+  def test_will_match_pipeline_predict_proba(self):
+    vec_settings = [
+      {"vec__ngram_range": (1, 1), "vec__use_idf": True, "vec__sublinear_tf": False, "vec__norm": None},
+      {"vec__ngram_range": (1, 2), "vec__use_idf": True, "vec__sublinear_tf": True, "vec__norm": "l2"},
+      {"vec__ngram_range": (1, 1), "vec__use_idf": False, "vec__sublinear_tf": True, "vec__norm": "l1"},
+    ]
+
+    for settings in vec_settings:
+      estimator = create_lr_pipeline().set_params(**settings).fit(X, y)
+
+      with tempfile.TemporaryDirectory() as temp_dir:
+        model_path = os.path.join(temp_dir, "model.npz")
+        export_to_npz(estimator, model_path, dtype=np.float64)
+        ranker = NumpyPlateRanker.load(model_path)
+
+      np.testing.assert_allclose(estimator.predict_proba(queries), ranker.predict_proba(queries), atol=1e-10)
+      self.assertEqual(list(estimator.classes_), list(ranker.classes))
+
+  def test_will_rank_top_k_like_pipeline(self):
+    estimator = create_lr_pipeline().fit(X, y)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      model_path = os.path.join(temp_dir, "model.npz")
+      export_to_npz(estimator, model_path)
+      ranker = NumpyPlateRanker.load(model_path)
+
+    expected_order = estimator.classes_[np.argsort(-estimator.predict_proba(["green plate"])[0])][:3]
+    actual_top_k = ranker.top_k("green plate", k=3)
+
+    self.assertEqual(list(expected_order), [label for label, _ in actual_top_k])
+
+  def test_will_rank_streamed_queries_in_batches(self):
+    estimator = create_lr_pipeline().fit(X, y)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      model_path = os.path.join(temp_dir, "model.npz")
+      export_to_npz(estimator, model_path)
+      ranker = NumpyPlateRanker.load(model_path)
+
+    output = io.StringIO()
+    total_queries = rank_query_stream(ranker, iter(["green plate\n", "\n", "black bear\n", "red\n"]), output, k=2, batch_size=2, output_format="jsonl")
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    self.assertEqual(3, total_queries)
+    self.assertEqual(["green plate", "black bear", "red"], [record["query"] for record in records])
+    self.assertEqual([label for label, _ in ranker.top_k("black bear", k=2)], records[1]["labels"])
+
+  def test_will_reject_non_linear_classifier(self):
+    estimator = create_svm_pipeline().set_params(clf__cv=2).fit(X, y)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      with self.assertRaises(ValueError):
+        export_to_npz(estimator, os.path.join(temp_dir, "model.npz"))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import sys, os
+import json
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from model_utils import convert_to_onnx
+from onnx_benchmark import benchmark_onnx_model, save_onnx_benchmark_report
+from pipeline_factory import create_lr_pipeline
+
+X = [
+  "solid white plate", "white background", "red top white middle", "red line",
+  "blue bottom", "light blue top", "green plate", "solid green background",
+  "yellow sun", "yellow fade", "black bear", "grizzly bear"
+]
+y = ["us-ca", "us-ca", "us-ks", "us-ks", "us-nv", "us-nv", "us-vt", "us-vt", "us-ak", "us-ak", "us-ak", "us-ak"]
+queries = X + ["green background", "blue top", "yellow bear", "unknown words only"]
+
+def export_model(estimator, temp_dir):
+  model_path = os.path.join(temp_dir, "model.onnx")
+  with open(model_path, "wb") as f:
+    f.write(convert_to_onnx(estimator, locale="C.UTF-8").SerializeToString())
+  return model_path
+
+class TestOnnxBenchmark(unittest.TestCase):
+  def test_will_report_parity_and_latency(self):
+    estimator = create_lr_pipeline().set_params(vec__sublinear_tf=False).fit(X, y)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      model_path = export_model(estimator, temp_dir)
+      report_path = os.path.join(temp_dir, "benchmark.json")
+      save_onnx_benchmark_report({"full": benchmark_onnx_model(model_path, estimator, queries, k=3, batch_sizes=[1, 4])}, report_path)
+
+      with open(report_path, "r") as f:
+        report = json.load(f)["models"]["full"]
+
+    self.assertEqual(1.0, report["parity"]["top_k_agreement"])
+    self.assertLess(report["parity"]["max_probability_error"], 1e-4)
+    self.assertEqual([1, 4], [entry["batch_size"] for entry in report["latency"]])
+    self.assertTrue(all(entry["p50_ms"] <= entry["p99_ms"] for entry in report["latency"]))
+
+  def test_will_fail_on_ranking_mismatch(self):
+    estimator = create_lr_pipeline().set_params(vec__sublinear_tf=False).fit(X, y)
+    other_estimator = create_lr_pipeline().set_params(vec__sublinear_tf=False).fit(X, y[::-1])
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      model_path = export_model(other_estimator, temp_dir)
+
+      with self.assertRaises(ValueError):
+        benchmark_onnx_model(model_path, estimator, queries, k=3, batch_sizes=[1])
+
+  def test_will_fail_on_regression_against_baseline(self):
+    estimator = create_lr_pipeline().set_params(vec__sublinear_tf=False).fit(X, y)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      model_report = benchmark_onnx_model(export_model(estimator, temp_dir), estimator, queries, k=3, batch_sizes=[1])
+      baseline_path = os.path.join(temp_dir, "baseline.json")
+      with open(baseline_path, "w") as f:
+        json.dump({"models": {"full": {**model_report, "model_bytes": model_report["model_bytes"] // 2}}}, f)
+
+      with self.assertRaises(ValueError):
+        save_onnx_benchmark_report({"full": model_report}, os.path.join(temp_dir, "benchmark.json"), baseline_path)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import sys, os
+import numpy as np
+import onnxruntime as ort
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from model_utils import convert_to_onnx
+from onnx_optimizer import optimize_onnx_model
+from pipeline_factory import create_lr_pipeline
+
+X = [
+  "solid white plate", "white background", "red top white middle", "red line",
+  "blue bottom", "light blue top", "green plate", "solid green background",
+  "yellow sun", "yellow fade", "black bear", "grizzly bear"
+]
+y = ["us-ca", "us-ca", "us-ks", "us-ks", "us-nv", "us-nv", "us-vt", "us-vt", "us-ak", "us-ak", "us-ak", "us-ak"]
+queries = ["solid white plate", "green background", "blue top", "yellow bear"]
+
+def run_model(model, output_names):
+  session = ort.InferenceSession(model.SerializeToString(), providers=["CPUExecutionProvider"])
+  return session.run(output_names, {"text": np.array(queries, dtype=object).reshape(-1, 1)})
+
+class TestOnnxOptimizer(unittest.TestCase):
+  def test_will_match_pipeline_top_k(self):
+    # skl2onnx exports sublinear_tf as log(tf + 1) instead of log(tf) + 1, so compare on raw counts
+    estimator = create_lr_pipeline().set_params(vec__norm=None, vec__use_idf=True, vec__sublinear_tf=False).fit(X, y)
+
+    model, report = optimize_onnx_model(convert_to_onnx(estimator, locale="C.UTF-8"), top_k=3, include_probabilities=True)
+    labels, top_k_labels, top_k_probabilities, probabilities = run_model(model, ["label", "top_k_labels", "top_k_probabilities", "probabilities"])
+
+    proba = estimator.predict_proba(queries)
+    expected_top = np.argsort(-proba, axis=1)[:, :3]
+    self.assertTrue(report.folded_idf)
+    self.assertEqual(estimator.predict(queries).tolist(), labels.tolist())
+    self.assertEqual(estimator.classes_[expected_top].tolist(), top_k_labels.tolist())
+    np.testing.assert_allclose(np.take_along_axis(proba, expected_top, axis=1), top_k_probabilities, atol=1e-5)
+    np.testing.assert_allclose(proba, probabilities, atol=1e-5)
+
+  def test_will_keep_normalized_features_unfolded(self):
+    estimator = create_lr_pipeline().set_params(vec__norm="l2").fit(X, y)
+    baseline = convert_to_onnx(estimator, locale="C.UTF-8")
+
+    model, report = optimize_onnx_model(baseline, top_k=2)
+    top_k_labels, = run_model(model, ["top_k_labels"])
+    baseline_proba, class_labels = run_model(baseline, ["probabilities", "class_labels"])
+
+    self.assertFalse(report.folded_idf)
+    self.assertEqual(class_labels[np.argsort(-baseline_proba, axis=1)[:, :2]].tolist(), top_k_labels.tolist())
+
+  def test_will_shrink_quantized_and_pruned_model(self):
+    estimator = create_lr_pipeline().set_params(vec__norm=None).fit(X, y)
+    baseline = convert_to_onnx(estimator, locale="C.UTF-8")
+
+    float16_model, _ = optimize_onnx_model(baseline, quantization="float16")
+    int8_model, report = optimize_onnx_model(baseline, prune_threshold=0.2, quantization="int8")
+    top_label = run_model(int8_model, ["label"])[0]
+
+    self.assertLess(len(int8_model.SerializeToString()), len(baseline.SerializeToString()))
+    self.assertLess(len(float16_model.SerializeToString()), len(baseline.SerializeToString()))
+    self.assertGreater(report.zeroed_weights, 0)
+    self.assertLessEqual(report.features_after, report.features_before)
+    self.assertEqual(estimator.predict(queries[:1]).tolist(), top_label[:1].tolist())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import sys, os
+import numpy as np
+import onnxruntime as ort
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from sklearn.linear_model import LogisticRegression
+from model_utils import convert_to_onnx
+from onnx_benchmark import check_onnx_parity, run_onnx_ranking
+from pipeline_factory import CLF_STEP, VEC_STEP, create_softmax_sgd_pipeline
+from softmax_classifier import SoftmaxSGDClassifier
+
+X = [
+  "solid white plate", "white background", "red top white middle", "red line",
+  "blue bottom", "light blue top", "green plate", "solid green background",
+  "yellow sun", "yellow fade", "black bear", "grizzly bear"
+]
+y = ["us-ca", "us-ca", "us-ks", "us-ks", "us-nv", "us-nv", "us-vt", "us-vt", "us-ak", "us-ak", "us-ak", "us-ak"]
+
+def create_pipeline(**params):
+  defaults = {"vec__sublinear_tf": False, "clf__early_stopping": False, "clf__max_epochs": 200, "clf__batch_size": 4, "clf__random_state": 500}
+  return create_softmax_sgd_pipeline().set_params(**{**defaults, **params})
+
+class TestSoftmaxClassifier(unittest.TestCase):
+  def test_will_keep_logistic_regression_shapes_and_export_to_onnx(self):
+    estimator = create_pipeline().fit(X, y)
+    classifier = estimator.named_steps[CLF_STEP]
+    n_features = len(estimator.named_steps[VEC_STEP].vocabulary_)
+
+    self.assertEqual((5, n_features), classifier.coef_.shape)
+    self.assertEqual((5,), classifier.intercept_.shape)
+    self.assertEqual(y, estimator.predict(X).tolist())
+
+    texts = X + ["green background", "yellow bear"]
+    session = ort.InferenceSession(convert_to_onnx(estimator, locale="C.UTF-8").SerializeToString())
+    labels, probabilities = run_onnx_ranking(session, texts, k=3)
+    parity = check_onnx_parity(estimator, labels, probabilities, texts)
+
+    self.assertEqual(1.0, parity["top_k_agreement"])
+    self.assertLess(parity["max_probability_error"], 1e-4)
+
+  def test_will_match_logistic_regression_probabilities_for_two_classes(self):
+    X_binary, y_binary = X[:4], y[:4]
+    estimator = create_pipeline().fit(X_binary, y_binary)
+    classifier = estimator.named_steps[CLF_STEP]
+
+    # sklearn's binary convention: one row, P(classes_[1]) = sigmoid(2 * coef_ x + 2 * intercept_)
+    features = estimator.named_steps[VEC_STEP].transform(X_binary)
+    logits = 2 * (features @ classifier.coef_.T).ravel() + 2 * classifier.intercept_[0]
+    self.assertEqual((1, features.shape[1]), classifier.coef_.shape)
+    np.testing.assert_allclose(1 / (1 + np.exp(-logits)), estimator.predict_proba(X_binary)[:, 1])
+
+    reference = LogisticRegression().fit(features, y_binary)
+    self.assertEqual(reference.predict(features).tolist(), classifier.predict(features).tolist())
+
+  def test_will_continue_training_with_partial_fit(self):
+    vectorizer = create_pipeline().named_steps[VEC_STEP].fit(X)
+    features = vectorizer.transform(X)
+    classifier = SoftmaxSGDClassifier(batch_size=4, random_state=500)
+
+    with self.assertRaises(ValueError):
+      classifier.partial_fit(features[:6], y[:6])
+
+    classes = np.unique(y)
+    losses = []
+    for _ in range(30):
+      for start in range(0, len(X), 6):
+        classifier.partial_fit(features[start:start + 6], y[start:start + 6], classes=classes)
+      proba = classifier.predict_proba(features)
+      losses.append(-np.mean(np.log(proba[np.arange(len(y)), np.searchsorted(classes, y)])))
+
+    self.assertEqual(60, classifier.n_iter_)
+    self.assertLess(losses[-1], losses[0] / 2)
+    self.assertEqual(y, classifier.predict(features).tolist())
+
+  def test_will_balance_weighted_rows_like_repeated_rows(self):
+    features = create_pipeline().named_steps[VEC_STEP].fit(X).transform(X)
+    repeats = np.array([3, 1, 2, 1, 1, 1, 1, 1, 1, 1, 1, 1])
+    # one minibatch per epoch, so both fits take the same steps
+    params = dict(class_weight="balanced", batch_size=100, max_epochs=20, early_stopping=False, random_state=500)
+
+    repeated = SoftmaxSGDClassifier(**params).fit(features[np.repeat(np.arange(len(y)), repeats)], np.repeat(y, repeats))
+    weighted = SoftmaxSGDClassifier(**params).fit(features, y, sample_weight=repeats)
+
+    np.testing.assert_allclose(repeated.coef_, weighted.coef_, rtol=1e-7, atol=1e-10)
+    np.testing.assert_allclose(repeated.intercept_, weighted.intercept_, rtol=1e-7, atol=1e-10)
+
+  def test_will_stop_early_and_keep_best_validation_ndcg(self):
+    rng = np.random.default_rng(500)
+    colors = ["red", "green", "blue", "white", "black", "yellow"]
+    X_noisy = [f"{color} {rng.choice(colors)} plate {rng.integers(100)}" for color in colors for _ in range(30)]
+    y_noisy = [color for color in colors for _ in range(30)]
+
+    estimator = create_pipeline(clf__early_stopping=True, clf__validation_fraction=0.2, clf__n_iter_no_change=3).fit(X_noisy, y_noisy)
+    classifier = estimator.named_steps[CLF_STEP]
+
+    self.assertLess(classifier.n_iter_, 200)
+    self.assertEqual(classifier.n_iter_, len(classifier.validation_scores_))
+    self.assertEqual(max(classifier.validation_scores_), classifier.best_validation_score_)
+
+if __name__ == '__main__':
+  unittest.main()
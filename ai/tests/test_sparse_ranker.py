@@ -0,0 +1,84 @@
+import unittest
+import sys, os
+import tempfile
+from unittest import mock
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import sparse_ranker
+from model_utils import benchmark_label_scaling, create_npz_arrays, create_synthetic_label_pipeline, export_to_npz, rank_queries
+from sparse_ranker import InvertedIndexRanker
+from pipeline_factory import create_kernel_svm_pipeline, create_lr_pipeline, create_svm_pipeline
+
+X = [
+  "solid white plate", "white background", "red top white middle", "red line",
+  "blue bottom", "light blue top", "green plate", "solid green background",
+  "yellow sun", "yellow fade", "black bear", "grizzly bear"
+]
+y = ["us-ca", "us-ca", "us-ks", "us-ks", "us-nv", "us-nv", "us-vt", "us-vt", "us-ak", "us-ak", "us-ak", "us-ak"]
+queries = ["Solid WHITE plate", "green background", "blue-white", "unknown words only", "yellow bear bear"]
+
+class TestSparseRanker(unittest.TestCase):
+  def test_will_rank_like_pipeline_on_both_scoring_paths(self):
+    estimator = create_synthetic_label_pipeline(create_lr_pipeline().fit(X, y), 40)
+    expected_labels, expected_probabilities = rank_queries(queries, estimator, k=7)
+    ranker = InvertedIndexRanker.from_arrays(create_npz_arrays(estimator, dtype=np.float64))
+
+    # 0 scores every query in one pass over the classes, a huge ratio only scores the touched classes
+    for ratio in [0, 10**9]:
+      with mock.patch.object(sparse_ranker, "SPARSE_POSTINGS_RATIO", ratio):
+        labels, probabilities = ranker.rank(queries, k=7)
+
+      self.assertEqual(expected_labels.tolist(), labels.tolist(), msg=f"ratio {ratio}")
+      np.testing.assert_allclose(expected_probabilities, probabilities, atol=1e-10, err_msg=f"ratio {ratio}")
+
+    np.testing.assert_allclose(estimator.predict_proba(queries), ranker.predict_proba(queries), atol=1e-10)
+
+  def test_will_prune_small_weights(self):
+    estimator = create_lr_pipeline().fit(X, y)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      model_path = os.path.join(temp_dir, "model.npz")
+      export_to_npz(estimator, model_path, dtype=np.float64)
+      full = InvertedIndexRanker.load(model_path)
+      pruned = InvertedIndexRanker.load(model_path, prune_threshold=0.5)
+
+    coef = estimator.named_steps["clf"].coef_
+    self.assertEqual(np.count_nonzero(coef), full.n_postings)
+    self.assertEqual(np.count_nonzero(np.abs(coef) > 0.5 * np.abs(coef).max()), pruned.n_postings)
+
+    # ranks are consistent with the pruned weights on both scoring paths
+    for ratio in [0, 10**9]:
+      with mock.patch.object(sparse_ranker, "SPARSE_POSTINGS_RATIO", ratio):
+        _, probabilities = pruned.rank(queries, k=len(estimator.classes_))
+      np.testing.assert_allclose(np.sort(pruned.predict_proba(queries), axis=1)[:, ::-1], probabilities, atol=1e-10)
+
+    with self.assertRaises(ValueError):
+      InvertedIndexRanker.from_arrays(create_npz_arrays(estimator), prune_threshold=1.0)
+
+  def test_will_benchmark_label_counts(self):
+    estimator = create_lr_pipeline().fit(X, y)
+
+    rows = benchmark_label_scaling(estimator, queries, label_counts=[5, 30], prune_thresholds=[0.0], k=3, repeats=1)
+
+    self.assertEqual([(5, "predict_proba"), (5, "dense"), (5, "index_0"), (30, "predict_proba"), (30, "dense"), (30, "index_0")],
+      [(row["n_labels"], row["ranker"]) for row in rows])
+    self.assertEqual([1.0, 1.0], [row["top_k_agreement"] for row in rows if row["ranker"] == "index_0"])
+
+  def test_will_reject_non_linear_pipelines_before_benchmarking(self):
+    estimators = [
+      create_svm_pipeline().set_params(clf__cv=2).fit(X, y),
+      create_kernel_svm_pipeline(n_components=20).set_params(clf__cv=2).fit(X, y),
+      create_lr_pipeline(hash_buckets=1 << 8).fit(X, y),
+    ]
+
+    for estimator in estimators:
+      with mock.patch.object(sparse_ranker.InvertedIndexRanker, "from_arrays") as from_arrays:
+        with self.assertRaises(ValueError):
+          benchmark_label_scaling(estimator, queries, label_counts=[5], k=3, repeats=1)
+        with self.assertRaises(ValueError):
+          create_synthetic_label_pipeline(estimator, 5)
+      from_arrays.assert_not_called()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import sys, os
+import json
+import tempfile
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from data_loader import iter_training_text, synonyms_lkp
+from synonym_index import SynonymIndex, create_synthetic_descriptions, iter_training_text_with_lookups, load_synonyms
+
+descriptions = [
+  {"plate": "solid white, white middle line", "text": "red", "graphic": "none"},
+  {"plate": "light blue lines", "background": "white", "text": "black, blue"},
+]
+
+class TestSynonymIndex(unittest.TestCase):
+  def test_will_load_synonyms_and_reject_invalid_files(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      synonyms_path = os.path.join(temp_dir, "synonyms.json")
+      for invalid in (["middle"], {"middle": "center"}, {"middle": [""]}, {"middle": ["middle"]}):
+        with open(synonyms_path, "w", encoding="utf-8") as file:
+          json.dump(invalid, file)
+        with self.assertRaises(ValueError):
+          load_synonyms(synonyms_path)
+
+      with open(synonyms_path, "w", encoding="utf-8") as file:
+        json.dump({"middle": ["center"]}, file)
+      self.assertEqual(["middle", "center"], SynonymIndex.from_file(synonyms_path).expand_phrase("middle"))
+
+  def test_will_expand_same_rows_as_lookups(self):
+    synthetic, synthetic_synonyms = create_synthetic_descriptions(descriptions, synonyms_lkp, scale=5)
+    synonym_index = SynonymIndex(synthetic_synonyms)
+
+    for description in descriptions + synthetic:
+      for max_phrase_variants in (None, 2):
+        self.assertEqual(
+          list(iter_training_text_with_lookups(description, synthetic_synonyms, max_phrase_variants)),
+          list(iter_training_text(description, max_phrase_variants, synonym_index)))
+
+  def test_will_round_trip_token_ids(self):
+    synonym_index = SynonymIndex({"line": ["strip", "stripe"]})
+    phrase_ids = synonym_index.encode("white line")
+
+    self.assertEqual("white line", synonym_index.decode(phrase_ids))
+    self.assertEqual(synonym_index.token_ids["line"], phrase_ids[1])
+    self.assertEqual(["white line", "white strip", "white stripe"],
+      [synonym_index.decode(variant_ids) for variant_ids in synonym_index.expand_ids(phrase_ids)])
+    capped = synonym_index.expand_phrase("white line", 2)
+    self.assertEqual("white line", capped[0])
+    self.assertIn(capped[1], ["white strip", "white stripe"])
+    self.assertEqual(["plate"], synonym_index.expand_key("plate"))
+
+  def test_will_keep_most_recent_expansions_only(self):
+    synonym_index = SynonymIndex({"line": ["strip"]}, cache_size=2)
+
+    white = synonym_index.expand_phrase("white line")
+    red = synonym_index.expand_phrase("red line")
+    self.assertIs(white, synonym_index.expand_phrase("white line"))
+    synonym_index.expand_phrase("blue line")
+
+    # "red line" was the least recently used and is expanded again
+    self.assertIs(white, synonym_index.expand_phrase("white line"))
+    self.assertIsNot(red, synonym_index.expand_phrase("red line"))
+    self.assertEqual(["red line", "red strip"], synonym_index.expand_phrase("red line"))
+
+  def test_will_sample_capped_variants_across_all_words(self):
+    # 2 * 4 * 2 = 16 variants, the first 8 in product order would all keep "middle"
+    synonym_index = SynonymIndex(synonyms_lkp)
+    capped = synonym_index.expand_phrase("middle line plate", 8)
+
+    self.assertEqual(8, len(set(capped)))
+    self.assertEqual("middle line plate", capped[0])
+    self.assertTrue(any(phrase.startswith("center ") for phrase in capped))
+    self.assertEqual(capped, SynonymIndex(synonyms_lkp).expand_phrase("middle line plate", 8))
+
+    with self.assertRaises(ValueError):
+      synonym_index.expand_phrase("middle line plate", 0)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import sys, os
+import tempfile
+from pathlib import Path
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from data_loader import RawTrainingDataRow, transform_to_weighted_training_rows
+from pipeline_factory import CLF_STEP, VEC_STEP, create_lr_pipeline
+from training_cache import TrainingRowCache, fit_vectorizer_from_token_counts, save_classifier_state, warm_start_classifier
+
+raw_data = [
+  RawTrainingDataRow(key="us-ca", version="1", weight=1.0, description={"plate": "solid white"}),
+  RawTrainingDataRow(key="us-ks", version="1", weight=2.0, description={"top": "red line", "plate": "white"}),
+  RawTrainingDataRow(key="us-vt", version="1", weight=1.0, description={"plate": "solid green"}),
+  RawTrainingDataRow(key="sample", version="1", weight=1.0, description={"plate": "sample"}),
+]
+
+class TestTrainingCache(unittest.TestCase):
+  def test_will_reuse_unchanged_rows_from_disk(self):
+    vectorizer = create_lr_pipeline().named_steps[VEC_STEP]
+    changed_data = [*raw_data[:2], RawTrainingDataRow(key="us-vt", version="1", weight=1.0, description={"plate": "solid green", "bottom": "white"})]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      first_cache = TrainingRowCache.load(temp_dir)
+      first_cache.update(raw_data, vectorizer)
+      first_cache.save()
+
+      second_cache = TrainingRowCache.load(temp_dir)
+      training_rows = second_cache.update(changed_data, vectorizer)
+
+    self.assertEqual((2, 1, 1), (second_cache.reused_rows, second_cache.expanded_rows, second_cache.removed_rows))
+    self.assertTrue(training_rows.equals(transform_to_weighted_training_rows(changed_data, dedup=False)))
+    self.assertEqual(len(training_rows), len(second_cache.token_counts))
+
+  def test_will_fit_vectorizer_like_raw_texts(self):
+    for params in [{"vec__ngram_range": (1, 1), "vec__norm": None}, {"vec__ngram_range": (1, 2), "vec__sublinear_tf": True}, {"vec__use_idf": False}]:
+      vectorizer = create_lr_pipeline().set_params(**params).named_steps[VEC_STEP]
+      expected_vectorizer = create_lr_pipeline().set_params(**params).named_steps[VEC_STEP]
+
+      with tempfile.TemporaryDirectory() as temp_dir:
+        cache = TrainingRowCache.load(temp_dir)
+        training_rows = cache.update(raw_data, vectorizer)
+
+      features = fit_vectorizer_from_token_counts(vectorizer, cache.token_counts_for(range(1, len(training_rows))))
+      expected_features = expected_vectorizer.fit_transform(training_rows["text"][1:])
+
+      self.assertEqual(expected_vectorizer.vocabulary_, vectorizer.vocabulary_)
+      if vectorizer.use_idf:
+        np.testing.assert_allclose(expected_vectorizer.idf_, vectorizer.idf_)
+      np.testing.assert_allclose(expected_features.toarray(), features.toarray())
+      np.testing.assert_allclose(expected_features.toarray(), vectorizer.transform(training_rows["text"][1:]).toarray())
+
+  def test_will_warm_start_from_remapped_coefficients(self):
+    pipeline = create_lr_pipeline().fit(["white plate", "red line", "green plate"], ["us-ca", "us-ks", "us-vt"])
+    classifier = pipeline.named_steps[CLF_STEP]
+    features = sorted(pipeline.named_steps[VEC_STEP].vocabulary_, key=pipeline.named_steps[VEC_STEP].vocabulary_.get)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      state_path = Path(temp_dir) / "classifier_state.npz"
+      save_classifier_state(state_path, classifier, features)
+
+      new_classifier = create_lr_pipeline().named_steps[CLF_STEP]
+      warm_started = warm_start_classifier(new_classifier, state_path, ["us-ak", "us-ca", "us-ks", "us-vt"], [("blue",), *features])
+
+    self.assertTrue(warm_started)
+    self.assertEqual((4, len(features) + 1), new_classifier.coef_.shape)
+    np.testing.assert_allclose(classifier.coef_, new_classifier.coef_[1:, 1:])
+    np.testing.assert_allclose(classifier.intercept_, new_classifier.intercept_[1:])
+    self.assertFalse(new_classifier.coef_[0].any() or new_classifier.coef_[:, 0].any())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import sys, os
+import pickle
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from sklearn import clone
+from pipeline_factory import VEC_STEP, create_lr_pipeline
+from vectorizer_cache import cached_pipeline_scope, create_cached_pipeline, to_text_pipeline
+
+corpus = [
+  "solid white plate",
+  "red top white middle",
+  "blue bottom",
+  "green plate",
+  "light blue top white bottom",
+  "red line"
+]
+labels = ["us-ca", "us-ks", "us-nv", "us-vt", "us-ak", "us-ks"]
+
+class TestVectorizerCache(unittest.TestCase):
+  def test_will_match_text_vectorizer_on_fold(self):
+    for dtype in [np.float64, np.float32]:
+      pipeline = create_lr_pipeline(dtype=dtype)
+      pipeline.set_params(vec__ngram_range=(1, 2), vec__use_idf=True, vec__norm=None)
+      cached_pipeline, indices = create_cached_pipeline(pipeline, corpus)
+      train_idx, test_idx = indices[:4], indices[4:]
+
+      text_vec = clone(pipeline.named_steps[VEC_STEP]).fit([corpus[i] for i in train_idx])
+      cached_vec = cached_pipeline.named_steps[VEC_STEP].fit(train_idx)
+
+      expected = text_vec.transform([corpus[i] for i in test_idx])
+      actual = cached_vec.transform(test_idx)
+
+      self.assertEqual((dtype, dtype), (expected.dtype, actual.dtype))
+      np.testing.assert_allclose(expected.toarray(), actual.toarray())
+
+  def test_will_reuse_cached_matrices_for_same_params_and_fold(self):
+    cached_pipeline, indices = create_cached_pipeline(create_lr_pipeline(), corpus)
+    cache = cached_pipeline.named_steps[VEC_STEP].cache
+
+    first = clone(cached_pipeline.named_steps[VEC_STEP]).fit_transform(indices[:3])
+    second = clone(cached_pipeline.named_steps[VEC_STEP]).fit_transform(indices[:3])
+
+    self.assertIs(first, second)
+    self.assertEqual(2, cache.hits)
+    with self.assertRaises(ValueError):
+      first.data[0] = 0.0
+
+  def test_will_close_cache_when_scope_ends(self):
+    with cached_pipeline_scope(create_lr_pipeline(), corpus, [(1, 2)]) as (cached_pipeline, indices):
+      cache = cached_pipeline.named_steps[VEC_STEP].cache
+      cached_pipeline.fit(indices, labels)
+
+      # workers get the warmed count matrices but not the corpus
+      worker_cache = pickle.loads(pickle.dumps(cache))
+      self.assertIsNone(worker_cache.corpus)
+      self.assertEqual(cache.counts((1, 2)).shape, worker_cache.counts((1, 2)).shape)
+      with self.assertRaises(ValueError):
+        worker_cache.counts((2, 2))
+
+    self.assertIsNone(cache.corpus)
+    with self.assertRaises(ValueError):
+      cache.counts((1, 1))
+
+    with cached_pipeline_scope(create_lr_pipeline(), corpus, enabled=False) as (pipeline, X):
+      self.assertIs(corpus, X)
+
+  def test_will_convert_fitted_cached_pipeline_to_text_pipeline(self):
+    pipeline = create_lr_pipeline()
+    cached_pipeline, indices = create_cached_pipeline(pipeline, corpus)
+    cached_estimator = cached_pipeline.fit(indices, labels)
+
+    text_estimator = to_text_pipeline(cached_estimator, pipeline, corpus)
+
+    np.testing.assert_allclose(
+      cached_estimator.predict_proba(indices),
+      text_estimator.predict_proba(corpus))
+
+if __name__ == '__main__':
+  unittest.main()
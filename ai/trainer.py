@@ -5,107 +5,439 @@ import numpy as np
 from sklearn.model_selection import train_test_split
 import os
 import argparse
-from scipy.stats import loguniform
 
+from sklearn import clone
 from sklearn.pipeline import Pipeline
 
-from data_loader import read_raw_data, transform_to_training_rows
-from evaluator import compute_model_evaluations
-from hyperparam_manager import find_best_params_random_halving_search, load_hyperparams_from_file, save_hyperparams_to_file
-from model_utils import export_to_onnx, print_top_k
-from pipeline_factory import CLF_STEP, VEC_STEP, create_lr_pipeline, create_svm_pipeline;
+from data_loader import load_training_rows, read_raw_data, synonyms_lkp, transform_to_weighted_training_rows
+from evaluator import benchmark_cross_validation, compare_float32_mode, compare_hashing_vectorizers, compare_synonym_canonicalization, compute_model_evaluations
+from hyperparam_manager import SearchResults, check_params_file_estimator, find_best_params_bayesian_search, find_best_params_random_halving_search, find_best_params_regularization_path, load_hyperparams_from_file, save_hyperparams_to_file
+from instrumentation import span, start_run_profiler, stop_run_profiler
+from model_utils import benchmark_label_scaling, benchmark_npz_inference, compute_proba_metrics, export_to_npz, export_to_onnx, fit_pipeline, print_top_k
+from onnx_benchmark import benchmark_onnx_model, save_onnx_benchmark_report
+from synonym_index import benchmark_synonym_expansion
+from pipeline_factory import CLF_STEP, KERNEL_FEATURE_MAPS, KERNEL_STEP, PIPELINE_DTYPES, VEC_STEP, create_dtype_params, create_kernel_svm_pipeline, restore_dtype_params, create_lr_pipeline, create_softmax_sgd_pipeline, create_svm_pipeline;
+from training_cache import TrainingRowCache, fit_vectorizer_from_token_counts, save_classifier_state, warm_start_classifier
+
+# query -> number of top plates to show
+SANITY_CHECK_QUERIES = {
+  "red top white middle blue bottom": 5,
+  "solid white plate": 5,
+  "green top": 5,
+  "green top white bottom": 5,
+  "blue white plate": 5,
+  "green background": 3,
+  "green plate": 3,
+  "solid green background": 3,
+  "solid green plate": 3,
+  "solid green": 3,
+}
 
 def main(use_search: bool,
   training_data_path: str,
   training_params_path: str,
-  onnx_export_path: str):
+  onnx_export_path: str,
+  use_streaming: bool = False,
+  dedup_rows: bool = False,
+  max_phrase_variants: int | None = None,
+  search_mode: str = "halving",
+  cv_n_jobs: int = 1,
+  benchmark_cv: bool = False,
+  npz_export_path: str | None = None,
+  benchmark_npz: bool = False,
+  onnx_locale: str | None = None,
+  onnx_optimized_path: str | None = None,
+  onnx_quantization: str = "float32",
+  onnx_prune_threshold: float = 0.0,
+  onnx_top_k: int = 10,
+  onnx_benchmark_path: str | None = None,
+  onnx_benchmark_baseline_path: str | None = None,
+  incremental_cache_dir: str | None = None,
+  search_checkpoint_path: str | None = None,
+  search_candidates: int = 40,
+  classifier: str = "lr",
+  hash_buckets: int | None = None,
+  hashing_report_path: str | None = None,
+  benchmark_expansion_scale: int | None = None,
+  canonicalize_synonyms: bool = False,
+  synonym_report_path: str | None = None,
+  kernel_feature_map: str = "nystroem",
+  dtype: str = "float64",
+  float32_report_path: str | None = None,
+  label_scaling_report_path: str | None = None):
   
   random_state = 500
+  row_cache = None
+  pipeline_dtype = PIPELINE_DTYPES[dtype]
+
+  if (canonicalize_synonyms and (use_search or incremental_cache_dir is not None or classifier != "lr" or hash_buckets is not None)):
+    raise ValueError("--canonicalize-synonyms is only supported for the precomputed LogisticRegression params")
+
+  if (classifier == "kernel-svm" and (not use_search or search_mode != "halving")):
+    raise ValueError("--classifier kernel-svm has no precomputed params, it needs --use-search with the halving search mode")
+
+  # the searches only tune LogisticRegression, softmax-sgd trains from the precomputed LR params
+  if (classifier == "softmax-sgd" and use_search):
+    raise ValueError("--classifier softmax-sgd has no search, it trains from the precomputed LogisticRegression params without --use-search")
+
+  # the incremental fit refits the cached precomputed LR vocabulary model on all rows of the cache
+  if (incremental_cache_dir is not None and (use_search or use_streaming or dedup_rows or classifier != "lr" or hash_buckets is not None)):
+    raise ValueError("--incremental-cache only refits the precomputed LogisticRegression params, it can't be combined with --use-search, --stream, --dedup-rows, --hash-buckets or a --classifier other than lr")
+
+  if (hash_buckets is not None and (use_search or incremental_cache_dir is not None or classifier != "lr")):
+    raise ValueError("--hash-buckets is only supported for the precomputed LogisticRegression params")
+
+  if (dtype != "float64" and (incremental_cache_dir is not None or classifier == "softmax-sgd" or hash_buckets is not None)):
+    raise ValueError(f"--dtype {dtype} isn't supported with --incremental-cache, --classifier softmax-sgd or --hash-buckets")
+
+  if (classifier == "kernel-svm" and (synonym_report_path is not None or hashing_report_path is not None or float32_report_path is not None)):
+    raise ValueError("--synonym-report, --hashing-report and --float32-report compare LR params, they can't be combined with --classifier kernel-svm")
+
+  # both read the vocabulary and multinomial LR/softmax weights, see model_utils.check_npz_exportable
+  if ((npz_export_path is not None or label_scaling_report_path is not None)
+    and (classifier == "kernel-svm" or hash_buckets is not None or canonicalize_synonyms)):
+    raise ValueError("--npz-path and --label-scaling-report need a vocabulary LR or softmax model, they can't be combined with --classifier kernel-svm, --hash-buckets or --canonicalize-synonyms")
+
+  if (use_streaming and dedup_rows):
+    raise ValueError("--dedup-rows groups all training rows in memory and can't be combined with --stream")
+
+  # search scorers don't get sample weights (see model_utils.make_fused_scorer), they'd rank params
+  # by the deduplicated rows instead of the repeated ones the weighted fit matches
+  if (use_search and dedup_rows):
+    raise ValueError("--dedup-rows weights rows the search scorers don't see and can't be combined with --use-search")
+
+  if (synonym_report_path is not None):
+    compare_synonym_canonicalization(load_hyperparams_from_file(training_params_path),
+      read_raw_data(training_data_path),
+      synonyms_lkp,
+      random_state,
+      max_phrase_variants=max_phrase_variants,
+      report_path=synonym_report_path)
+
+  if (benchmark_expansion_scale is not None):
+    benchmark_synonym_expansion([row.description for row in read_raw_data(training_data_path)],
+      synonyms_lkp,
+      scale=benchmark_expansion_scale,
+      max_phrase_variants=max_phrase_variants)
+
+  if (incremental_cache_dir is not None):
+    row_cache = TrainingRowCache.load(incremental_cache_dir)
+    lr_pipeline = create_lr_pipeline().set_params(**load_hyperparams_from_file(training_params_path))
+    training_rows = row_cache.update(read_raw_data(training_data_path), lr_pipeline.named_steps[VEC_STEP], max_phrase_variants)
+  elif (use_streaming):
+    training_rows = load_training_rows(training_data_path,
+      max_phrase_variants=max_phrase_variants,
+      canonicalize_synonyms=canonicalize_synonyms)
+  else:
+    json_data = read_raw_data(training_data_path)
+    training_rows = transform_to_weighted_training_rows(json_data,
+      max_phrase_variants,
+      dedup=dedup_rows,
+      canonicalize_synonyms=canonicalize_synonyms)
+    if (dedup_rows):
+      print(f"De-duplicated to {len(training_rows)} weighted rows (total weight {training_rows['weight'].sum():.1f})")
 
-  json_data = read_raw_data(training_data_path)
-  training_rows = transform_to_training_rows(json_data)
   X = training_rows["text"]
   y = training_rows["label"]
-  X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, stratify=y, random_state=random_state
+  w = training_rows["weight"]
+  X_train, X_test, y_train, y_test, w_train, w_test = train_test_split(
+    X, y, w, test_size=0.2, stratify=y, random_state=random_state
   )
 
-  if (use_search):
+  if (hashing_report_path is not None):
+    compare_hashing_vectorizers(load_hyperparams_from_file(training_params_path),
+      X_train,
+      y_train,
+      X_test,
+      y_test,
+      bucket_counts=sorted({1 << 8, 1 << 10, 1 << 12, 1 << 14, *([hash_buckets] if hash_buckets else [])}),
+      sample_weight_train=w_train,
+      sample_weight_test=w_test,
+      report_path=hashing_report_path)
+
+  if (float32_report_path is not None):
+    compare_float32_mode(load_hyperparams_from_file(training_params_path),
+      X_train,
+      y_train,
+      X_test,
+      y_test,
+      random_state,
+      sample_weight_train=w_train,
+      sample_weight_test=w_test,
+      report_path=float32_report_path)
+
+  if (use_search and classifier == "kernel-svm"):
+    final_estimator = create_svm_estimator_from_search(X_train=X_train,
+      X_test=X_test,
+      y_train=y_train,
+      y_test=y_test,
+      random_state=random_state,
+      training_params_path=training_params_path,
+      w_train=w_train,
+      w_test=w_test,
+      cv_n_jobs=cv_n_jobs,
+      search_checkpoint_path=search_checkpoint_path,
+      kernel_feature_map=kernel_feature_map,
+      dtype=pipeline_dtype)
+  elif (use_search and search_mode == "regularization-path"):
+    final_estimator = create_lr_estimator_from_regularization_path(X_train=X_train,
+      X_test=X_test,
+      y_train=y_train,
+      y_test=y_test,
+      random_state=random_state,
+      training_params_path=training_params_path,
+      w_train=w_train,
+      w_test=w_test,
+      cv_n_jobs=cv_n_jobs,
+      dtype=pipeline_dtype)
+  elif (use_search and search_mode == "bayesian"):
+    final_estimator = create_lr_estimator_from_bayesian_search(X_train=X_train,
+      X_test=X_test,
+      y_train=y_train,
+      y_test=y_test,
+      random_state=random_state,
+      training_params_path=training_params_path,
+      n_candidates=search_candidates,
+      w_train=w_train,
+      w_test=w_test,
+      cv_n_jobs=cv_n_jobs,
+      dtype=pipeline_dtype)
+  elif (use_search):
     final_estimator = create_lr_estimator_from_search(X_train=X_train,
       X_test=X_test,
       y_train=y_train,
       y_test=y_test,
       random_state=random_state,
-      training_params_path=training_params_path)
+      training_params_path=training_params_path,
+      w_train=w_train,
+      w_test=w_test,
+      cv_n_jobs=cv_n_jobs,
+      search_checkpoint_path=search_checkpoint_path,
+      dtype=pipeline_dtype)
+  elif (row_cache is not None):
+    final_estimator = create_lr_estimator_incrementally(X_train=X_train,
+      X_test=X_test,
+      y_train=y_train,
+      y_test=y_test,
+      lr_training_params_path=training_params_path,
+      row_cache=row_cache,
+      train_row_positions=training_rows.index.get_indexer(X_train.index),
+      w_train=w_train,
+      w_test=w_test)
+  elif (classifier == "softmax-sgd"):
+    final_estimator = create_softmax_estimator_from_precomputed_params(X_train=X_train,
+      X_test=X_test,
+      y_train=y_train,
+      y_test=y_test,
+      random_state=random_state,
+      lr_training_params_path=training_params_path,
+      w_train=w_train,
+      w_test=w_test,
+      cv_n_jobs=cv_n_jobs)
   else:
     final_estimator = create_lr_estimator_from_precomputed_params(X_train=X_train,
       X_test=X_test,
       y_train=y_train,
       y_test=y_test,
       random_state=random_state,
-      lr_training_params_path=training_params_path)
-    
+      lr_training_params_path=training_params_path,
+      w_train=w_train,
+      w_test=w_test,
+      cv_n_jobs=cv_n_jobs,
+      hash_buckets=hash_buckets,
+      canonical_synonyms=synonyms_lkp if canonicalize_synonyms else None,
+      dtype=pipeline_dtype)
+
+  # LR searches only save their params, the next run without --use-search fits and exports them.
+  # kernel-svm has no run from precomputed params, its searched model is exported right away.
+  if (not use_search or classifier == "kernel-svm"):
     # save to onnx
-    export_to_onnx(final_estimator, onnx_export_path)
+    export_to_onnx(final_estimator,
+      onnx_export_path,
+      locale=onnx_locale,
+      optimized_export_path=onnx_optimized_path,
+      top_k=onnx_top_k,
+      prune_threshold=onnx_prune_threshold,
+      quantization=onnx_quantization,
+      X_eval=X_test,
+      y_eval=y_test)
+
+    if (onnx_benchmark_path is not None):
+      benchmark_texts = list(X_test) + list(SANITY_CHECK_QUERIES)
+      model_reports = {"full": benchmark_onnx_model(onnx_export_path, final_estimator, benchmark_texts)}
+      if (onnx_optimized_path is not None):
+        # quantized/pruned weights are lossy, their parity is reported but not enforced
+        model_reports["optimized"] = benchmark_onnx_model(onnx_optimized_path,
+          final_estimator,
+          benchmark_texts,
+          k=onnx_top_k,
+          enforce_parity=onnx_quantization == "float32" and onnx_prune_threshold == 0)
+      save_onnx_benchmark_report(model_reports, onnx_benchmark_path, onnx_benchmark_baseline_path)
+
+  if (npz_export_path is not None):
+    export_to_npz(final_estimator, npz_export_path)
+
+    if (benchmark_npz):
+      benchmark_npz_inference(final_estimator, npz_export_path, SANITY_CHECK_QUERIES)
+
+  if (label_scaling_report_path is not None):
+    benchmark_label_scaling(final_estimator, list(X_test) + list(SANITY_CHECK_QUERIES), report_path=label_scaling_report_path)
+
+  if (benchmark_cv):
+    benchmark_cross_validation(clone(final_estimator),
+      X_train,
+      y_train,
+      random_state,
+      n_jobs=cv_n_jobs if cv_n_jobs != 1 else -1,
+      sample_weight_train=w_train)
 
   # Sanity check queries
-  print_top_k("red top white middle blue bottom", final_estimator, 5)
-  print_top_k("solid white plate", final_estimator, 5)
-  print_top_k("green top", final_estimator, 5)
-  print_top_k("green top white bottom", final_estimator, 5)
-  print_top_k("blue white plate", final_estimator, 5)
-  print_top_k("green background", final_estimator, 3)
-  print_top_k("green plate", final_estimator, 3)
-  print_top_k("solid green background", final_estimator, 3)
-  print_top_k("solid green plate", final_estimator, 3)
-  print_top_k("solid green", final_estimator, 3)
+  print_top_k(SANITY_CHECK_QUERIES, final_estimator)
 
   # get_feature_contribs(estimator, ["us-al", "us-nh", "us-tn", "us-vt"], "green plate")
   # get_feature_contribs(estimator, ["us-al", "us-nh", "us-tn", "us-vt"], "green background")
 
 
+# float32 searches ran with swapped solvers (create_dtype_params), the saved params keep the solver
+# float64 runs use, so a float32 search doesn't turn the shared params into newton-cg ones
+def save_search_params(training_params_path: str, search_results: SearchResults, dtype: Any):
+  model_params = search_results.to_model_params()
+  model_params.best_params = restore_dtype_params(model_params.best_params, dtype)
+  save_hyperparams_to_file(training_params_path, model_params)
+
 def create_lr_estimator_from_precomputed_params(X_train: Any,
   X_test: Any,
   y_train: Any,
   y_test: Any,
   random_state: int,
-  lr_training_params_path: str) -> Pipeline:
+  lr_training_params_path: str,
+  w_train: Any = None,
+  w_test: Any = None,
+  cv_n_jobs: int = 1,
+  hash_buckets: int | None = None,
+  canonical_synonyms: Dict[str, List[str]] | None = None,
+  dtype: Any = np.float64) -> Pipeline:
   
-  lr_pipeline = create_lr_pipeline()
+  lr_pipeline = create_lr_pipeline(hash_buckets=hash_buckets, canonical_synonyms=canonical_synonyms, dtype=dtype)
 
   print(f"Reading precomputed params from {lr_training_params_path}...")
   precomp_params = load_hyperparams_from_file(lr_training_params_path)
   print(f"Found: {precomp_params}")
 
-  lr_pipeline.set_params(**precomp_params)
+  lr_pipeline.set_params(**create_dtype_params(precomp_params, dtype))
 
   print("Fitting...")
-  estimator = lr_pipeline.fit(X=X_train, y=y_train)
+  estimator = fit_pipeline(lr_pipeline, X_train, y_train, w_train)
   print("Fitted!")
 
+  if (hash_buckets is not None):
+    print(f"Hashing vectorizer: {estimator.named_steps[VEC_STEP].get_collision_report()}")
+
   model_evals = compute_model_evaluations(lr_pipeline,
     estimator,
     random_state,
     X_train,
     y_train,
     X_test,
-    y_test)
-  
+    y_test,
+    sample_weight_train=w_train,
+    sample_weight_test=w_test,
+    # the token count cache mirrors the plain vocabulary vectorizer
+    use_vectorizer_cache=hash_buckets is None and canonical_synonyms is None,
+    cv_n_jobs=cv_n_jobs)
+
   model_evals.print()
 
   return estimator
 
-
-def create_lr_estimator_from_search(X_train: Any,
+# Vectorizer params, class weights and regularization strength come from the LogisticRegression params,
+# the classifier is trained with minibatch Adam (see softmax_classifier.py) instead of lbfgs.
+def create_softmax_estimator_from_precomputed_params(X_train: Any,
   X_test: Any,
   y_train: Any,
   y_test: Any,
   random_state: int,
-  training_params_path: str) -> Pipeline:
-  
+  lr_training_params_path: str,
+  w_train: Any = None,
+  w_test: Any = None,
+  cv_n_jobs: int = 1) -> Pipeline:
+
+  softmax_pipeline = create_softmax_sgd_pipeline()
+
+  print(f"Reading precomputed params from {lr_training_params_path}...")
+  precomp_params = load_hyperparams_from_file(lr_training_params_path)
+  vec_params = {name: value for name, value in precomp_params.items() if name.startswith(f"{VEC_STEP}__")}
+
+  softmax_pipeline.set_params(**vec_params,
+    clf__alpha=1.0 / (precomp_params.get(f"{CLF_STEP}__C", 1.0) * len(X_train)),
+    clf__class_weight=precomp_params.get(f"{CLF_STEP}__class_weight"),
+    clf__random_state=random_state)
+
+  print("Fitting...")
+  estimator = fit_pipeline(softmax_pipeline, X_train, y_train, w_train)
+  classifier = estimator.named_steps[CLF_STEP]
+  print(f"Fitted! ({classifier.n_iter_} epochs, best validation ndcg({classifier.ndcg_k}) {classifier.best_validation_score_:.4f})")
+
+  model_evals = compute_model_evaluations(softmax_pipeline,
+    estimator,
+    random_state,
+    X_train,
+    y_train,
+    X_test,
+    y_test,
+    sample_weight_train=w_train,
+    sample_weight_test=w_test,
+    cv_n_jobs=cv_n_jobs)
+
+  model_evals.print()
+
+  return estimator
+
+# Fast retrain path: tokens come from the training row cache, CV is skipped (holdout metrics only)
+# and LogisticRegression is warm started from the previous run's coefficients.
+def create_lr_estimator_incrementally(X_train: Any,
+  X_test: Any,
+  y_train: Any,
+  y_test: Any,
+  lr_training_params_path: str,
+  row_cache: TrainingRowCache,
+  train_row_positions: Any,
+  w_train: Any = None,
+  w_test: Any = None) -> Pipeline:
+
   lr_pipeline = create_lr_pipeline()
 
-  lr_param_distr: Dict[str, List[Any]] = {
+  print(f"Reading precomputed params from {lr_training_params_path}...")
+  lr_pipeline.set_params(**load_hyperparams_from_file(lr_training_params_path))
+
+  vectorizer = lr_pipeline.named_steps[VEC_STEP]
+  classifier = lr_pipeline.named_steps[CLF_STEP]
+  with span("vectorization", rows=len(X_train)) as vectorization_span:
+    features_train = fit_vectorizer_from_token_counts(vectorizer, row_cache.token_counts_for(train_row_positions))
+    vectorization_span.count(features=features_train.shape[1])
+  features = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+
+  warm_started = warm_start_classifier(classifier, row_cache.classifier_state_path, np.unique(y_train), features)
+  print(f"Fitting ({'warm start from previous run' if warm_started else 'cold start'})...")
+  with span("fit", rows=features_train.shape[0], features=features_train.shape[1]):
+    classifier.fit(features_train, y_train, sample_weight=w_train)
+  print(f"Fitted! ({int(np.max(classifier.n_iter_))} iterations)")
+
+  # the cache only moves on with a model fitted from it
+  save_classifier_state(row_cache.classifier_state_path, classifier, features)
+  row_cache.save()
+
+  holdout_metrics = compute_proba_metrics(y_test, lr_pipeline.predict_proba(X_test), classifier.classes_, sample_weight=w_test)
+  print(f"Holdout ndcg(10) {holdout_metrics['ndcg']:.4f}")
+  print(f"Holdout Accuracy: {holdout_metrics['accuracy']:.4f}")
+  print(f"Holdout Log Loss: {-holdout_metrics['neg_log_loss']:.4f}")
+
+  return lr_pipeline
+
+def create_lr_param_distributions(random_state: int) -> Dict[str, List[Any]]:
+  from scipy.stats import loguniform
+
+  return {
     # Vectorizer
     f"{VEC_STEP}__ngram_range": [(1, 1)],
     f"{VEC_STEP}__use_idf": [True, False],
@@ -119,6 +451,21 @@ def create_lr_estimator_from_search(X_train: Any,
     f"{CLF_STEP}__class_weight": [None, "balanced"]
   }
 
+def create_lr_estimator_from_search(X_train: Any,
+  X_test: Any,
+  y_train: Any,
+  y_test: Any,
+  random_state: int,
+  training_params_path: str,
+  w_train: Any = None,
+  w_test: Any = None,
+  cv_n_jobs: int = 1,
+  search_checkpoint_path: str | None = None,
+  dtype: Any = np.float64) -> Pipeline:
+  
+  lr_pipeline = create_lr_pipeline(dtype=dtype)
+  lr_param_distr = create_dtype_params(create_lr_param_distributions(random_state), dtype)
+
   search_results = find_best_params_random_halving_search(pipeline=lr_pipeline,
     X_train=X_train,
     X_test=X_test,
@@ -129,41 +476,166 @@ def create_lr_estimator_from_search(X_train: Any,
     resource=f"{CLF_STEP}__max_iter",
     min_resources=100,
     max_resources=10000,
-    refit="ndcg")
+    refit="ndcg",
+    sample_weight_train=w_train,
+    sample_weight_test=w_test,
+    cv_n_jobs=cv_n_jobs,
+    checkpoint_path=search_checkpoint_path)
   
   search_results.print_results()
-  save_hyperparams_to_file(training_params_path, search_results.to_model_params())
+  save_search_params(training_params_path, search_results, dtype)
+
+  return search_results.best_estimator
+
+# Same LR search space as create_lr_estimator_from_search, explored by TPE with early fold stopping
+# instead of random sampling + halving over max_iter
+def create_lr_estimator_from_bayesian_search(X_train: Any,
+  X_test: Any,
+  y_train: Any,
+  y_test: Any,
+  random_state: int,
+  training_params_path: str,
+  n_candidates: int = 40,
+  w_train: Any = None,
+  w_test: Any = None,
+  cv_n_jobs: int = 1,
+  dtype: Any = np.float64) -> Pipeline:
+
+  lr_pipeline = create_lr_pipeline(dtype=dtype)
+  lr_param_distr = create_dtype_params(create_lr_param_distributions(random_state), dtype)
+  # halving search grows max_iter as its resource, here every candidate gets the maximum
+  lr_param_distr[f"{CLF_STEP}__max_iter"] = [10000]
+
+  search_results = find_best_params_bayesian_search(pipeline=lr_pipeline,
+    X_train=X_train,
+    X_test=X_test,
+    y_train=y_train,
+    y_test=y_test,
+    random_state=random_state,
+    param_distributions=lr_param_distr,
+    n_candidates=n_candidates,
+    sample_weight_train=w_train,
+    sample_weight_test=w_test,
+    cv_n_jobs=cv_n_jobs)
+
+  search_results.print_results()
+  save_search_params(training_params_path, search_results, dtype)
 
   return search_results.best_estimator
 
+# Keep vectorizer/classifier settings from precomputed params and only re-tune C
+# along a warm-started regularization path
+def create_lr_estimator_from_regularization_path(X_train: Any,
+  X_test: Any,
+  y_train: Any,
+  y_test: Any,
+  random_state: int,
+  training_params_path: str,
+  w_train: Any = None,
+  w_test: Any = None,
+  cv_n_jobs: int = 1,
+  dtype: Any = np.float64) -> Pipeline:
+
+  lr_pipeline = create_lr_pipeline(dtype=dtype)
+
+  print(f"Reading base params from {training_params_path}...")
+  base_params = load_hyperparams_from_file(training_params_path)
+  base_params.pop(f"{CLF_STEP}__C", None)
+  base_params[f"{CLF_STEP}__solver"] = "lbfgs"
+  base_params[f"{CLF_STEP}__random_state"] = random_state
+  base_params[f"{CLF_STEP}__max_iter"] = 10000
+
+  search_results = find_best_params_regularization_path(pipeline=lr_pipeline,
+    X_train=X_train,
+    X_test=X_test,
+    y_train=y_train,
+    y_test=y_test,
+    random_state=random_state,
+    base_params=create_dtype_params(base_params, dtype),
+    # same range as loguniform C distribution used by random halving search
+    C_values=list(np.logspace(-5, 3, 33)),
+    sample_weight_train=w_train,
+    sample_weight_test=w_test,
+    cv_n_jobs=cv_n_jobs)
+
+  search_results.print_results()
+  save_search_params(training_params_path, search_results, dtype)
+
+  return search_results.best_estimator
+
+# kernel_feature_map ("nystroem" or "rbf-sampler") searches create_kernel_svm_pipeline instead of
+# the SVC ensemble, with the feature map size as halving resource so early rounds stay cheap
 def create_svm_estimator_from_search(X_train: Any,
   X_test: Any,
   y_train: Any,
   y_test: Any,
   random_state: int,
-  training_params_path: str) -> Pipeline:
+  training_params_path: str,
+  w_train: Any = None,
+  w_test: Any = None,
+  cv_n_jobs: int = 1,
+  search_checkpoint_path: str | None = None,
+  kernel_feature_map: str | None = None,
+  dtype: Any = np.float64) -> Pipeline:
+
+  from scipy.stats import loguniform
 
-  svc_pipeline = create_svm_pipeline()
   svc_param_distr: Dict[str, List[Any]] = {
     # Vectorizer
     f"{VEC_STEP}__ngram_range": [(1, 1), (1, 2)],
     f"{VEC_STEP}__use_idf": [True, False],
     f"{VEC_STEP}__norm": [None],
     f"{VEC_STEP}__sublinear_tf": [True, False],
-    # Classifier
-    f"{CLF_STEP}__estimator__kernel": ["poly", "rbf", "sigmoid"],
-    f"{CLF_STEP}__estimator__gamma": list(np.logspace(-5, 0, 100)) + ["scale", "auto"],
-    f"{CLF_STEP}__estimator__C": loguniform(0.001, 1000),
-    f"{CLF_STEP}__estimator__tol": loguniform(0.00001, 0.001),
-    f"{CLF_STEP}__estimator__degree": [2, 3, 4],
-    f"{CLF_STEP}__estimator__class_weight": [None, "balanced"],
-    f"{CLF_STEP}__estimator__coef0": [0, 1, 10],
-    f"{CLF_STEP}__estimator__random_state": [random_state],
-    # Calibration method
-    f"{CLF_STEP}__method": ["sigmoid", "isotonic"],
-    f"{CLF_STEP}__cv": [5],
   }
 
+  if (kernel_feature_map is None):
+    svc_pipeline = create_svm_pipeline(dtype=dtype)
+    svc_param_distr.update({
+      # Classifier
+      f"{CLF_STEP}__estimator__kernel": ["poly", "rbf", "sigmoid"],
+      f"{CLF_STEP}__estimator__gamma": list(np.logspace(-5, 0, 100)) + ["scale", "auto"],
+      f"{CLF_STEP}__estimator__C": loguniform(0.001, 1000),
+      f"{CLF_STEP}__estimator__tol": loguniform(0.00001, 0.001),
+      f"{CLF_STEP}__estimator__degree": [2, 3, 4],
+      f"{CLF_STEP}__estimator__class_weight": [None, "balanced"],
+      f"{CLF_STEP}__estimator__coef0": [0, 1, 10],
+      f"{CLF_STEP}__estimator__random_state": [random_state],
+      # Calibration method
+      f"{CLF_STEP}__method": ["sigmoid", "isotonic"],
+      f"{CLF_STEP}__cv": [5],
+    })
+    resource, min_resources, max_resources = f"{CLF_STEP}__estimator__max_iter", 1000, 30000
+  else:
+    svc_pipeline = create_kernel_svm_pipeline(kernel_feature_map, dtype=dtype)
+    svc_param_distr.update({
+      # gamma range assumes l2 normalized rows
+      f"{VEC_STEP}__norm": ["l2"],
+      # Feature map
+      f"{KERNEL_STEP}__gamma": list(np.logspace(-3, 1, 100)),
+      f"{KERNEL_STEP}__random_state": [random_state],
+      # Classifier
+      f"{CLF_STEP}__estimator__C": loguniform(0.001, 100),
+      f"{CLF_STEP}__estimator__tol": loguniform(0.00001, 0.001),
+      f"{CLF_STEP}__estimator__class_weight": [None, "balanced"],
+      f"{CLF_STEP}__estimator__max_iter": [5000],
+      f"{CLF_STEP}__estimator__random_state": [random_state],
+      # Single calibration on cross validated decision values
+      f"{CLF_STEP}__method": ["sigmoid", "isotonic"],
+    })
+    if (kernel_feature_map == "nystroem"):
+      svc_param_distr.update({
+        f"{KERNEL_STEP}__kernel": ["poly", "rbf", "sigmoid"],
+        f"{KERNEL_STEP}__degree": [2, 3],
+        f"{KERNEL_STEP}__coef0": [0, 1],
+      })
+      resource, min_resources, max_resources = f"{KERNEL_STEP}__n_components", 50, 400
+    else:
+      # random Fourier features need more components than Nystroem landmarks for the same accuracy
+      resource, min_resources, max_resources = f"{KERNEL_STEP}__n_components", 250, 2000
+
+  # the LR precomputed params must not be overwritten by kmap__*/clf__estimator__* params
+  check_params_file_estimator(training_params_path, svc_pipeline.named_steps[CLF_STEP].estimator.__class__.__name__)
+
   search_results = find_best_params_random_halving_search(pipeline=svc_pipeline,
     X_train=X_train,
     X_test=X_test,
@@ -171,13 +643,17 @@ def create_svm_estimator_from_search(X_train: Any,
     y_test=y_test,
     random_state=random_state,
     param_distributions=svc_param_distr,
-    resource=f"{CLF_STEP}__estimator__max_iter",
-    min_resources=1000,
-    max_resources=30000,
-    refit="ndcg")
+    resource=resource,
+    min_resources=min_resources,
+    max_resources=max_resources,
+    refit="ndcg",
+    sample_weight_train=w_train,
+    sample_weight_test=w_test,
+    cv_n_jobs=cv_n_jobs,
+    checkpoint_path=search_checkpoint_path)
   
   search_results.print_results()
-  save_hyperparams_to_file(training_params_path, search_results.to_model_params())
+  save_search_params(training_params_path, search_results, dtype)
 
   return search_results.best_estimator
 
@@ -185,6 +661,7 @@ def parse_args() -> argparse.Namespace:
   base_dir = Path(__file__).parent
   training_data_path = os.path.join(base_dir, "training_data", "plate_descriptions.json")
   training_params_path = os.path.join(base_dir, "training_params.json")
+  svm_training_params_path = os.path.join(base_dir, "svm_training_params.json")
   onnx_export_path = os.path.join(base_dir, "..", "ui", "public", "skl_plates_model.onnx")
 
   argument_parser = argparse.ArgumentParser(
@@ -198,6 +675,54 @@ def parse_args() -> argparse.Namespace:
     help="Enable grid search to find best hyperparams (default: False)."
   )
 
+  argument_parser.add_argument(
+    "--search-mode",
+    choices=["halving", "bayesian", "regularization-path"],
+    default="halving",
+    help="hyperparams search strategy used with --use-search (default: halving)"
+  )
+
+  argument_parser.add_argument(
+    "--classifier",
+    choices=["lr", "softmax-sgd", "kernel-svm"],
+    default="lr",
+    help="classifier trained from precomputed params: lbfgs LogisticRegression or minibatch Adam softmax with early stopping; "
+      "kernel-svm (kernel feature map + linear SVM, see --kernel-feature-map) is searched with --use-search instead (default: lr)"
+  )
+
+  argument_parser.add_argument(
+    "--kernel-feature-map",
+    choices=KERNEL_FEATURE_MAPS,
+    default="nystroem",
+    help="explicit kernel feature map of --classifier kernel-svm (default: nystroem)"
+  )
+
+  argument_parser.add_argument(
+    "--hash-buckets",
+    type=int,
+    default=None,
+    help="train LR from precomputed params on hashed token buckets instead of a vocabulary; the ONNX model then takes FNV-1a bucket ids (default: vocabulary)"
+  )
+
+  argument_parser.add_argument(
+    "--hashing-report",
+    default=None,
+    help="compare holdout ndcg, ONNX size and collision rate of the vocabulary vs hashing vectorizers and save JSON here (default: no report)"
+  )
+
+  argument_parser.add_argument(
+    "--search-candidates",
+    type=int,
+    default=40,
+    help="number of candidates proposed by --search-mode bayesian (default: 40)"
+  )
+
+  argument_parser.add_argument(
+    "--search-checkpoint",
+    default=None,
+    help="SQLite file storing every scored search fit; interrupted or repeated searches over the same data resume from it (halving mode only)"
+  )
+
   argument_parser.add_argument(
     "--data-path",
     default=training_data_path,
@@ -206,8 +731,8 @@ def parse_args() -> argparse.Namespace:
 
   argument_parser.add_argument(
     "--params-path",
-    default=training_params_path,
-    help="path to parameters json file"
+    default=None,
+    help="path to parameters json file (default: training_params.json, svm_training_params.json for --classifier kernel-svm)"
   )
 
   argument_parser.add_argument(
@@ -216,12 +741,211 @@ def parse_args() -> argparse.Namespace:
     help="trained model output path in ONNX format"
   )
 
-  return argument_parser.parse_args()
+  argument_parser.add_argument(
+    "--onnx-locale",
+    default=None,
+    help="locale of the ONNX StringNormalizer, e.g. C.UTF-8 where en_US isn't installed (default: onnxruntime default)"
+  )
+
+  argument_parser.add_argument(
+    "--onnx-optimized-path",
+    default=None,
+    help="also export a smaller top-k ONNX serving model with idf folded into the weights (default: no export)"
+  )
+
+  argument_parser.add_argument(
+    "--onnx-quantization",
+    choices=["float32", "float16", "int8"],
+    default="float32",
+    help="weight precision of the optimized ONNX model (default: float32)"
+  )
+
+  argument_parser.add_argument(
+    "--onnx-prune-threshold",
+    type=float,
+    default=0.0,
+    help="zero optimized ONNX weights below this fraction of the largest weight (default: 0, no pruning)"
+  )
+
+  argument_parser.add_argument(
+    "--onnx-top-k",
+    type=int,
+    default=10,
+    help="number of ranked plates returned by the optimized ONNX model (default: 10)"
+  )
+
+  argument_parser.add_argument(
+    "--onnx-benchmark-path",
+    default=None,
+    help="check exported ONNX rankings against predict_proba on holdout + sanity queries and save latency report JSON here (default: no benchmark)"
+  )
+
+  argument_parser.add_argument(
+    "--onnx-benchmark-baseline",
+    default=None,
+    help="previous ONNX benchmark report JSON, the run fails if model size or p95 latency regressed against it"
+  )
+
+  argument_parser.add_argument(
+    "--incremental-cache",
+    default=None,
+    help="cache dir for incremental retraining: only changed plates are re-expanded, LR warm starts from the previous run and CV is skipped (default: full retrain)"
+  )
+
+  argument_parser.add_argument(
+    "--stream",
+    action="store_true",
+    help="Parse and expand training data incrementally instead of loading it all at once (default: False)."
+  )
+
+  argument_parser.add_argument(
+    "--dedup-rows",
+    action="store_true",
+    help="Collapse identical (label, text) training rows into a single row with summed weight (default: False)."
+  )
+
+  argument_parser.add_argument(
+    "--max-phrase-variants",
+    type=int,
+    default=None,
+    help="cap on synonym variants generated per description phrase (default: no cap)"
+  )
+
+  argument_parser.add_argument(
+    "--npz-path",
+    default=None,
+    help="also export trained LR model as numpy .npz for numpy_inference.py (default: no export)"
+  )
+
+  argument_parser.add_argument(
+    "--benchmark-npz",
+    action="store_true",
+    help="Compare cold start and query latency of the npz model against sklearn (requires --npz-path)."
+  )
+
+  argument_parser.add_argument(
+    "--cv-jobs",
+    type=int,
+    default=1,
+    help="number of worker processes used for evaluation CV folds, -1 for all cores (default: 1)"
+  )
+
+  argument_parser.add_argument(
+    "--benchmark-cv",
+    action="store_true",
+    help="Time serial vs fold-parallel cross validation of the final model (default: False)."
+  )
+
+  argument_parser.add_argument(
+    "--benchmark-expansion",
+    type=int,
+    default=None,
+    metavar="SCALE",
+    help="Time synonym expansion through the token id index vs per word lookups on the descriptions enlarged SCALE times."
+  )
+
+  argument_parser.add_argument(
+    "--canonicalize-synonyms",
+    action="store_true",
+    help="Map synonyms to canonical tokens in the vectorizer and exported model instead of expanding training rows (default: False)."
+  )
+
+  argument_parser.add_argument(
+    "--synonym-report",
+    type=str,
+    default=None,
+    help="Compare synonym expansion with canonicalization (training rows, fit time, holdout ndcg) and write the report to this JSON path."
+  )
+
+  argument_parser.add_argument(
+    "--dtype",
+    choices=list(PIPELINE_DTYPES),
+    default="float64",
+    help="dtype of tf-idf features and classifier weights during fit, CV and search; float32 halves their bytes and trains LR with newton-cg instead of lbfgs (default: float64)"
+  )
+
+  argument_parser.add_argument(
+    "--float32-report",
+    type=str,
+    default=None,
+    help="Compare LR training in float32 with float64 (feature bytes, fit memory peak, fit/CV/predict times, holdout ndcg, top-k ranking agreement) and write the report to this JSON path."
+  )
+
+  argument_parser.add_argument(
+    "--label-scaling-report",
+    type=str,
+    default=None,
+    help="Benchmark top-k ranking with the inverted index ranker vs predict_proba on the final LR model copied to 50-10k synthetic labels and write the report to this JSON path."
+  )
+
+  argument_parser.add_argument(
+    "--run-report",
+    type=str,
+    default=None,
+    help="Write wall/cpu time, peak RSS and row/feature counts of every stage (load, expansion, vectorization, fit, cv, search, export) to this JSON path."
+  )
+
+  argument_parser.add_argument(
+    "--profile",
+    type=str,
+    default=None,
+    metavar="DIR",
+    help="Write a cProfile dump per stage and the run report (with tracemalloc peaks) into DIR. Tracing memory slows the run down."
+  )
+
+  parsed_args = argument_parser.parse_args()
+  if (parsed_args.params_path is None):
+    parsed_args.params_path = svm_training_params_path if parsed_args.classifier == "kernel-svm" else training_params_path
+
+  if (parsed_args.stream and parsed_args.dedup_rows):
+    argument_parser.error("--dedup-rows groups all training rows in memory and can't be combined with --stream")
+
+  if (parsed_args.use_search and parsed_args.dedup_rows):
+    argument_parser.error("--dedup-rows weights rows the search scorers don't see and can't be combined with --use-search")
+
+  return parsed_args
 
 if __name__ == "__main__":
   parsed_args = parse_args()
 
-  main(use_search=parsed_args.use_search,
-    training_data_path=parsed_args.data_path,
-    training_params_path=parsed_args.params_path,
-    onnx_export_path=parsed_args.onnx_path)
\ No newline at end of file
+  run_profiler = None
+  if (parsed_args.profile is not None or parsed_args.run_report is not None):
+    run_profiler = start_run_profiler(profile_dir=parsed_args.profile)
+
+  try:
+    main(use_search=parsed_args.use_search,
+      training_data_path=parsed_args.data_path,
+      training_params_path=parsed_args.params_path,
+      onnx_export_path=parsed_args.onnx_path,
+      use_streaming=parsed_args.stream,
+      dedup_rows=parsed_args.dedup_rows,
+      max_phrase_variants=parsed_args.max_phrase_variants,
+      search_mode=parsed_args.search_mode,
+      cv_n_jobs=parsed_args.cv_jobs,
+      benchmark_cv=parsed_args.benchmark_cv,
+      npz_export_path=parsed_args.npz_path,
+      benchmark_npz=parsed_args.benchmark_npz,
+      onnx_locale=parsed_args.onnx_locale,
+      onnx_optimized_path=parsed_args.onnx_optimized_path,
+      onnx_quantization=parsed_args.onnx_quantization,
+      onnx_prune_threshold=parsed_args.onnx_prune_threshold,
+      onnx_top_k=parsed_args.onnx_top_k,
+      onnx_benchmark_path=parsed_args.onnx_benchmark_path,
+      onnx_benchmark_baseline_path=parsed_args.onnx_benchmark_baseline,
+      incremental_cache_dir=parsed_args.incremental_cache,
+      search_checkpoint_path=parsed_args.search_checkpoint,
+      search_candidates=parsed_args.search_candidates,
+      classifier=parsed_args.classifier,
+      kernel_feature_map=parsed_args.kernel_feature_map,
+      hash_buckets=parsed_args.hash_buckets,
+      hashing_report_path=parsed_args.hashing_report,
+      benchmark_expansion_scale=parsed_args.benchmark_expansion,
+      canonicalize_synonyms=parsed_args.canonicalize_synonyms,
+      synonym_report_path=parsed_args.synonym_report,
+      dtype=parsed_args.dtype,
+      float32_report_path=parsed_args.float32_report,
+      label_scaling_report_path=parsed_args.label_scaling_report)
+  finally:
+    if (run_profiler is not None):
+      stop_run_profiler()
+      run_profiler.save_report(parsed_args.run_report or os.path.join(parsed_args.profile, "run_report.json"))
@@ -0,0 +1,226 @@
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.linear_model import LogisticRegression
+
+from data_loader import EXCLUDED_KEYS, WEIGHTED_TRAINING_ROW_COLUMNS, RawTrainingDataRow, iter_trainable_raw_rows, iter_training_text, synonyms_lkp
+from synonym_index import SynonymIndex
+from vectorizer_cache import CACHE_COMPATIBLE_VEC_PARAMS
+
+CACHE_FORMAT_VERSION = 1
+ROWS_CACHE_FILE = "training_rows.json"
+CLASSIFIER_STATE_FILE = "classifier_state.npz"
+
+# Vectorizer params that decide which tokens are counted for a text
+ANALYZER_PARAMS = ["lowercase", "token_pattern", "ngram_range", "stop_words", "strip_accents"]
+
+# Content hash of a raw training row. Any edit of key, version, weight or description changes it.
+def hash_raw_row(raw_row: RawTrainingDataRow) -> str:
+  payload = json.dumps(asdict(raw_row), sort_keys=True, ensure_ascii=False)
+  return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Token counts are stored as [feature, count] pairs, ngram tuples of TraceableTfidfVectorizer as json lists
+def _encode_token_counts(counts: Dict[Any, int]) -> List[List[Any]]:
+  return [[list(feature) if isinstance(feature, tuple) else feature, count] for feature, count in counts.items()]
+
+def _decode_token_counts(pairs: List[List[Any]]) -> Dict[Any, int]:
+  return {(tuple(feature) if isinstance(feature, list) else feature): count for feature, count in pairs}
+
+def _feature_name(feature: Any) -> str:
+  return " ".join(feature) if isinstance(feature, tuple) else str(feature)
+
+# On-disk cache of expanded training rows and their token counts, keyed by the content hash
+# of the RawTrainingDataRow they were expanded from. On the next run only rows whose hash changed
+# are expanded and tokenized again, everything else is read back from the cache.
+# Entries are only valid for the synonyms, phrase variant cap and tokenization they were built with,
+# a change in any of those drops the whole cache.
+class TrainingRowCache:
+  def __init__(self, cache_dir: str):
+    self.cache_dir = Path(cache_dir)
+    self.settings: Dict[str, Any] = {}
+    self.entries: Dict[str, Dict[str, Any]] = {}
+    self.token_counts: List[Dict[Any, int]] = []
+    self.reused_rows = 0
+    self.expanded_rows = 0
+    self.removed_rows = 0
+
+  @property
+  def classifier_state_path(self) -> Path:
+    return self.cache_dir / CLASSIFIER_STATE_FILE
+
+  @classmethod
+  def load(cls, cache_dir: str) -> "TrainingRowCache":
+    cache = cls(cache_dir)
+    rows_path = cache.cache_dir / ROWS_CACHE_FILE
+
+    if rows_path.exists():
+      with rows_path.open("r", encoding="utf-8") as file:
+        cached = json.load(file)
+      cache.settings = cached["settings"]
+      cache.entries = cached["entries"]
+
+    return cache
+
+  def save(self):
+    self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    with (self.cache_dir / ROWS_CACHE_FILE).open("w", encoding="utf-8") as file:
+      json.dump({"settings": self.settings, "entries": self.entries}, file, ensure_ascii=False)
+
+  # Weighted training rows (same frame as transform_to_weighted_training_rows(..., dedup=False)).
+  # Token counts of every row, as produced by the vectorizer's analyzer, end up in self.token_counts.
+  def update(self,
+    training_data: Iterable[RawTrainingDataRow],
+    vectorizer: Any,
+    max_phrase_variants: int | None = None) -> pd.DataFrame:
+    vec_params = vectorizer.get_params()
+    settings = json.loads(json.dumps({
+      "format": CACHE_FORMAT_VERSION,
+      "vectorizer": type(vectorizer).__name__,
+      "analyzer": {name: vec_params.get(name) for name in ANALYZER_PARAMS},
+      "max_phrase_variants": max_phrase_variants,
+      "synonyms": synonyms_lkp,
+      "excluded_keys": sorted(EXCLUDED_KEYS),
+    }, default=str))
+
+    if settings != self.settings:
+      self.settings = settings
+      self.entries = {}
+
+    analyzer = vectorizer.build_analyzer()
+    synonym_index = SynonymIndex(synonyms_lkp)
+    entries: Dict[str, Dict[str, Any]] = {}
+    rows: List[Tuple[str, str, float]] = []
+    self.token_counts = []
+    self.reused_rows = 0
+    self.expanded_rows = 0
+
+    for raw_row in iter_trainable_raw_rows(training_data):
+      row_hash = hash_raw_row(raw_row)
+      entry = self.entries.get(row_hash)
+
+      if entry is None:
+        texts = list(iter_training_text(raw_row.description, max_phrase_variants, synonym_index))
+        entry = {
+          "label": raw_row.key,
+          "weight": float(raw_row.weight),
+          "texts": texts,
+          "token_counts": [_encode_token_counts(_count_tokens(analyzer, text)) for text in texts],
+        }
+        self.expanded_rows += 1
+      else:
+        self.reused_rows += 1
+
+      entries[row_hash] = entry
+      rows.extend((entry["label"], text, entry["weight"]) for text in entry["texts"])
+      self.token_counts.extend(_decode_token_counts(pairs) for pairs in entry["token_counts"])
+
+    self.removed_rows = len(set(self.entries) - set(entries))
+    self.entries = entries
+
+    print(f"Training row cache: {self.reused_rows} raw rows reused, {self.expanded_rows} expanded, {self.removed_rows} removed")
+
+    return pd.DataFrame.from_records(rows, columns=WEIGHTED_TRAINING_ROW_COLUMNS)
+
+  def token_counts_for(self, row_positions: Sequence[int]) -> List[Dict[Any, int]]:
+    return [self.token_counts[position] for position in row_positions]
+
+def _count_tokens(analyzer: Any, text: str) -> Dict[Any, int]:
+  counts: Dict[Any, int] = {}
+  for feature in analyzer(text):
+    counts[feature] = counts.get(feature, 0) + 1
+  return counts
+
+# Fit a tf-idf vectorizer from cached token counts instead of re-tokenizing its training texts.
+# Vocabulary (sorted features) and document frequencies/idf come out the same as vectorizer.fit(texts).
+# Returns the tf-idf matrix of the fitted rows.
+def fit_vectorizer_from_token_counts(vectorizer: Any, token_counts: List[Dict[Any, int]]) -> csr_matrix:
+  vec_params = vectorizer.get_params()
+  unsupported = {
+    name: vec_params.get(name) for name, value in CACHE_COMPATIBLE_VEC_PARAMS.items()
+    if vec_params.get(name) != value
+  }
+  if unsupported:
+    raise ValueError(f"Vectorizer params not supported by training row cache: {unsupported}")
+
+  vocabulary = {feature: idx for idx, feature in enumerate(sorted({feature for counts in token_counts for feature in counts}))}
+
+  indptr = np.zeros(len(token_counts) + 1, dtype=np.int64)
+  indices: List[int] = []
+  data: List[int] = []
+  for row, counts in enumerate(token_counts):
+    indices.extend(vocabulary[feature] for feature in counts)
+    data.extend(counts.values())
+    indptr[row + 1] = len(indices)
+
+  counts_matrix = csr_matrix((np.asarray(data, dtype=vectorizer.dtype), np.asarray(indices, dtype=np.int64), indptr),
+    shape=(len(token_counts), len(vocabulary)))
+  counts_matrix.sort_indices()
+
+  tfidf = TfidfTransformer(norm=vectorizer.norm,
+    use_idf=vectorizer.use_idf,
+    smooth_idf=vectorizer.smooth_idf,
+    sublinear_tf=vectorizer.sublinear_tf).fit(counts_matrix)
+
+  # fitting with the vocabulary fixed only sets up the vectorizer (there's nothing to tokenize),
+  # the vocabulary is then kept as a learned one and idf_ taken from the cached counts
+  vectorizer.set_params(vocabulary=vocabulary).fit([""])
+  vectorizer.set_params(vocabulary=None)
+  vectorizer.fixed_vocabulary_ = False
+  if vectorizer.use_idf:
+    vectorizer.idf_ = tfidf.idf_
+
+  return tfidf.transform(counts_matrix)
+
+# Persist a fitted multinomial LogisticRegression with its class and feature names,
+# so the next run can warm start from it even if the vocabulary or plate list changed.
+def save_classifier_state(state_path: Path, classifier: LogisticRegression, features: Sequence[Any]):
+  state_path.parent.mkdir(parents=True, exist_ok=True)
+
+  np.savez(state_path,
+    coef=classifier.coef_,
+    intercept=classifier.intercept_,
+    classes=np.asarray(classifier.classes_, dtype=str),
+    features=np.asarray([_feature_name(feature) for feature in features], dtype=str))
+
+# Initialize classifier coef_/intercept_ from a previous run's state, remapped to the new classes and features.
+# New classes and features start at zero. Returns False when there is no usable state
+# (no previous run, or a binary model which has a single coefficient row).
+def warm_start_classifier(classifier: LogisticRegression, state_path: Path, classes: Sequence[str], features: Sequence[Any]) -> bool:
+  if not state_path.exists() or len(classes) <= 2:
+    return False
+
+  with np.load(state_path, allow_pickle=False) as state:
+    previous_coef = state["coef"]
+    previous_intercept = state["intercept"]
+    previous_classes = state["classes"]
+    previous_features = state["features"]
+
+  if previous_coef.shape[0] != len(previous_classes):
+    return False
+
+  class_index = {str(label): idx for idx, label in enumerate(previous_classes)}
+  feature_index = {str(feature): idx for idx, feature in enumerate(previous_features)}
+  class_pairs = [(new, class_index[str(label)]) for new, label in enumerate(classes) if str(label) in class_index]
+  feature_pairs = [(new, feature_index[name]) for new, name in enumerate(map(_feature_name, features)) if name in feature_index]
+
+  coef = np.zeros((len(classes), len(features)), dtype=np.float64)
+  intercept = np.zeros(len(classes), dtype=np.float64)
+  if class_pairs:
+    new_classes, old_classes = map(list, zip(*class_pairs))
+    intercept[new_classes] = previous_intercept[old_classes]
+    if feature_pairs:
+      new_features, old_features = map(list, zip(*feature_pairs))
+      coef[np.ix_(new_classes, new_features)] = previous_coef[np.ix_(old_classes, old_features)]
+
+  classifier.set_params(warm_start=True)
+  classifier.coef_ = coef
+  classifier.intercept_ = intercept
+
+  return True
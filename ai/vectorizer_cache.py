@@ -0,0 +1,267 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+import hashlib
+import uuid
+import numpy as np
+from sklearn import clone
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from sklearn.pipeline import Pipeline
+
+from pipeline_factory import VEC_STEP
+
+# Vectorizer params that can be derived from a cached count matrix by reweighting.
+# Everything else (tokenization, vocabulary pruning) must stay at the values the cache was built with.
+TFIDF_PARAMS = ["ngram_range", "use_idf", "sublinear_tf", "norm", "smooth_idf", "dtype"]
+CACHE_COMPATIBLE_VEC_PARAMS = {
+  "analyzer": "word",
+  "binary": False,
+  "min_df": 1,
+  "max_df": 1.0,
+  "max_features": None,
+  "vocabulary": None,
+}
+
+# Cache last unpickled in this process. Joblib workers unpickle a fresh estimator copy for every task,
+# so this lets LRU entries computed by one task be reused by later tasks of the same search in the
+# same worker. A worker only keeps one: the next search's cache replaces it.
+_worker_cache: "TokenCountCache | None" = None
+
+# Marks the arrays of a cached matrix read-only, so a caller modifying it in place gets an error
+# instead of corrupting the matrices later fits are served
+def _read_only(matrix: Any) -> Any:
+  for array in (matrix.data, matrix.indices, matrix.indptr):
+    array.flags.writeable = False
+  return matrix
+
+# Tokenizes a training corpus once per ngram_range into a sparse count matrix,
+# and keeps a bounded LRU of tf-idf matrices derived from it. Cached matrices are read-only.
+# Scoped to one CV or search (see cached_pipeline_scope), close() drops the corpus and matrices.
+class TokenCountCache:
+  def __init__(self,
+    corpus: Iterable[str],
+    lowercase: bool = True,
+    token_pattern: str = r"[a-z0-9-]+",
+    stop_words: Any = None,
+    max_entries: int = 64):
+    self.cache_id = uuid.uuid4().hex
+    self.corpus = list(corpus)
+    self.lowercase = lowercase
+    self.token_pattern = token_pattern
+    self.stop_words = stop_words
+    self.max_entries = max_entries
+    self.hits = 0
+    self.misses = 0
+    self._counts: Dict[Tuple[int, int], Any] = {}
+    self._entries: OrderedDict = OrderedDict()
+
+  # Sparse (n_docs x n_tokens) count matrix over the whole corpus.
+  # Vocabulary columns are sorted, same as CountVectorizer/TfidfVectorizer.
+  # Workers don't get the corpus, only the count matrices warmed before the search.
+  def counts(self, ngram_range: Tuple[int, int]):
+    ngram_range = tuple(ngram_range)
+    if ngram_range not in self._counts:
+      if self.corpus is None:
+        raise ValueError(f"Token count cache has no counts for ngram_range {ngram_range}, it was closed or not warmed with it")
+      counter = CountVectorizer(lowercase=self.lowercase,
+        token_pattern=self.token_pattern,
+        stop_words=self.stop_words,
+        ngram_range=ngram_range)
+      self._counts[ngram_range] = _read_only(counter.fit_transform(self.corpus).tocsr())
+
+    return self._counts[ngram_range]
+
+  # Tokenize upfront, so workers receive ready count matrices instead of doing it per task.
+  def warm(self, ngram_ranges: Iterable[Tuple[int, int]]):
+    for ngram_range in ngram_ranges:
+      self.counts(ngram_range)
+
+  def get_or_compute(self, key: Tuple, compute: Callable[[], Any]) -> Any:
+    if key in self._entries:
+      self.hits += 1
+      self._entries.move_to_end(key)
+      return self._entries[key]
+
+    self.misses += 1
+    value = compute()
+    if not isinstance(value, tuple):
+      value = _read_only(value)
+    self._entries[key] = value
+    if len(self._entries) > self.max_entries:
+      self._entries.popitem(last=False)
+
+    return value
+
+  def close(self):
+    self.corpus = None
+    self._counts = {}
+    self._entries = OrderedDict()
+
+  # sklearn clone() deep-copies non-estimator params. The cache must be shared, not copied.
+  def __deepcopy__(self, memo):
+    return self
+
+  # LRU entries are process-local and are not shipped to joblib workers, neither is the corpus:
+  # joblib memory maps the count matrices' arrays, a list of strings would be pickled per task.
+  def __reduce__(self):
+    state = {
+      "lowercase": self.lowercase,
+      "token_pattern": self.token_pattern,
+      "stop_words": self.stop_words,
+      "max_entries": self.max_entries,
+      "counts": self._counts,
+    }
+    return (_restore_token_count_cache, (self.cache_id, state))
+
+def _restore_token_count_cache(cache_id: str, state: Dict[str, Any]) -> TokenCountCache:
+  global _worker_cache
+  cache = _worker_cache
+
+  if cache is None or cache.cache_id != cache_id:
+    cache = TokenCountCache.__new__(TokenCountCache)
+    cache.cache_id = cache_id
+    cache.corpus = None
+    cache.lowercase = state["lowercase"]
+    cache.token_pattern = state["token_pattern"]
+    cache.stop_words = state["stop_words"]
+    cache.max_entries = state["max_entries"]
+    cache.hits = 0
+    cache.misses = 0
+    cache._counts = {}
+    cache._entries = OrderedDict()
+    _worker_cache = cache
+
+  for ngram_range, counts in state["counts"].items():
+    cache._counts.setdefault(ngram_range, counts)
+
+  return cache
+
+def _indices_key(indices: np.ndarray) -> str:
+  return hashlib.blake2b(np.ascontiguousarray(indices).tobytes(), digest_size=16).hexdigest()
+
+# Drop-in replacement for the pipeline's tf-idf vectorizer step during CV and hyperparam search.
+# X is an array of row indices into the cached corpus rather than raw strings.
+# Fitted on the same rows, it produces the same matrix as TraceableTfidfVectorizer
+# (vocabulary = tokens seen in the fitted rows, idf from their document frequencies).
+class CachedTfidfVectorizer(TransformerMixin, BaseEstimator):
+  def __init__(self,
+    cache: TokenCountCache | None = None,
+    ngram_range: Tuple[int, int] = (1, 1),
+    use_idf: bool = True,
+    sublinear_tf: bool = False,
+    norm: str | None = "l2",
+    smooth_idf: bool = True,
+    dtype: Any = np.float64):
+    self.cache = cache
+    self.ngram_range = ngram_range
+    self.use_idf = use_idf
+    self.sublinear_tf = sublinear_tf
+    self.norm = norm
+    self.smooth_idf = smooth_idf
+    self.dtype = dtype
+
+  def _params_key(self) -> Tuple:
+    return tuple((name, str(getattr(self, name))) for name in TFIDF_PARAMS)
+
+  def fit(self, X, y=None):
+    indices = np.asarray(X, dtype=np.int64).ravel()
+    self.fit_key_ = _indices_key(indices)
+
+    def _fit():
+      # counts in the output dtype, TfidfTransformer keeps float32 and computes idf_ in it, like TfidfVectorizer
+      counts = self.cache.counts(self.ngram_range)[indices].astype(self.dtype)
+      feature_mask = np.flatnonzero(counts.getnnz(axis=0))
+      feature_mask.flags.writeable = False
+      tfidf = TfidfTransformer(norm=self.norm,
+        use_idf=self.use_idf,
+        smooth_idf=self.smooth_idf,
+        sublinear_tf=self.sublinear_tf).fit(counts[:, feature_mask])
+      return feature_mask, tfidf
+
+    self.feature_mask_, self.tfidf_ = self.cache.get_or_compute(("fit", self._params_key(), self.fit_key_), _fit)
+    return self
+
+  def transform(self, X):
+    indices = np.asarray(X, dtype=np.int64).ravel()
+
+    def _transform():
+      counts = self.cache.counts(self.ngram_range)[indices]
+      return self.tfidf_.transform(counts[:, self.feature_mask_].astype(self.dtype))
+
+    key = ("transform", self._params_key(), self.fit_key_, _indices_key(indices))
+    return self.cache.get_or_compute(key, _transform)
+
+  def get_tfidf_params(self) -> Dict[str, Any]:
+    return {name: getattr(self, name) for name in TFIDF_PARAMS}
+
+# Swap the vectorizer step of a pipeline for a CachedTfidfVectorizer over X.
+# Returns the cached pipeline and the row indices to use in place of X.
+def create_cached_pipeline(pipeline: Pipeline,
+  X: Iterable[str],
+  ngram_ranges: Iterable[Tuple[int, int]] = (),
+  max_entries: int = 64) -> Tuple[Pipeline, np.ndarray]:
+  vec = pipeline.named_steps[VEC_STEP]
+
+  vec_params = vec.get_params()
+  unsupported = {
+    name: vec_params.get(name) for name, value in CACHE_COMPATIBLE_VEC_PARAMS.items()
+    if vec_params.get(name) != value
+  }
+  if unsupported:
+    raise ValueError(f"Vectorizer params not supported by token count cache: {unsupported}")
+
+  cache = TokenCountCache(X,
+    lowercase=vec.lowercase,
+    token_pattern=vec.token_pattern,
+    stop_words=vec.stop_words,
+    max_entries=max_entries)
+  cache.warm([vec.ngram_range, *ngram_ranges])
+
+  cached_vec = CachedTfidfVectorizer(cache=cache, **{name: getattr(vec, name) for name in TFIDF_PARAMS})
+  cached_pipeline = Pipeline(steps=[
+    (name, cached_vec if name == VEC_STEP else clone(step)) for name, step in pipeline.steps
+  ])
+
+  return cached_pipeline, np.arange(len(cache.corpus))
+
+# create_cached_pipeline for the duration of one CV or search: the cache is closed on exit, so its
+# corpus and matrices are freed even while the cached pipeline is still referenced (e.g. by a search).
+# Disabled, it yields the pipeline and X unchanged.
+@contextmanager
+def cached_pipeline_scope(pipeline: Pipeline,
+  X: Iterable[str],
+  ngram_ranges: Iterable[Tuple[int, int]] = (),
+  enabled: bool = True) -> Iterator[Tuple[Pipeline, Any]]:
+  if not enabled:
+    yield pipeline, X
+    return
+
+  cached_pipeline, indices = create_cached_pipeline(pipeline, X, ngram_ranges)
+  try:
+    yield cached_pipeline, indices
+  finally:
+    cached_pipeline.named_steps[VEC_STEP].cache.close()
+
+# Convert a fitted cached pipeline back into a regular text pipeline (e.g. for ONNX export).
+# The text vectorizer is refit on X with the same tf-idf params, which yields the same features
+# the cached vectorizer was fit with, so the fitted downstream steps can be reused as-is.
+def to_text_pipeline(cached_estimator: Pipeline, template: Pipeline, X: Iterable[str]) -> Pipeline:
+  cached_vec: CachedTfidfVectorizer = cached_estimator.named_steps[VEC_STEP]
+  vec = clone(template.named_steps[VEC_STEP]).set_params(**cached_vec.get_tfidf_params())
+  vec.fit(X)
+
+  return Pipeline(steps=[
+    (name, vec if name == VEC_STEP else step) for name, step in cached_estimator.steps
+  ])
+
+# ngram ranges a search may try, so their count matrices can be built before workers start
+def get_search_ngram_ranges(param_space: Dict[str, Any] | List[Dict[str, Any]]) -> List[Tuple[int, int]]:
+  spaces = param_space if isinstance(param_space, list) else [param_space]
+  ngram_ranges: List[Tuple[int, int]] = []
+
+  for space in spaces:
+    values = space.get(f"{VEC_STEP}__ngram_range", [])
+    ngram_ranges.extend(tuple(value) for value in values if isinstance(value, (tuple, list)))
+
+  return ngram_ranges